@@ -0,0 +1,89 @@
+"""
+Microbenchmark for RefSystem.parse_aria_tree on a synthetic 5k-node aria tree.
+
+Usage: python benchmarks/bench_ref_system.py [--nodes 5000] [--rounds 50]
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Any
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from tutan_agent.core.ref_system import RefSystem, AriaTreeStreamParser
+
+LAYOUTS = ["android.widget.FrameLayout", "android.widget.LinearLayout", "androidx.recyclerview.widget.RecyclerView"]
+WIDGETS = ["android.widget.TextView", "android.widget.Button", "android.widget.ImageView", "android.widget.EditText"]
+
+
+def make_tree(n_nodes: int, seed: int = 0) -> Dict[str, Any]:
+    """Build a synthetic tree of roughly `n_nodes` nodes, about 60% of them layout containers."""
+    rng = random.Random(seed)
+    root = {"class": LAYOUTS[0], "bounds": {"left": 0, "top": 0, "right": 1080, "bottom": 2400}, "children": []}
+    containers = [root]
+    for i in range(1, n_nodes):
+        parent = rng.choice(containers)
+        top = (i * 37) % 2300
+        node = {"bounds": {"left": 0, "top": top, "right": 1080, "bottom": top + 100}, "children": []}
+        if rng.random() < 0.6:
+            node["class"] = rng.choice(LAYOUTS)
+            containers.append(node)
+        else:
+            node["class"] = rng.choice(WIDGETS)
+            node["id"] = f"com.example:id/item_{i}"
+            node["text"] = f"Item {i}" if rng.random() < 0.7 else ""
+            node["clickable"] = rng.random() < 0.5
+            node["editable"] = node["class"].endswith("EditText")
+        parent["children"].append(node)
+    return root
+
+
+def bench(ref_system: RefSystem, tree: Dict[str, Any], rounds: int) -> float:
+    ref_system.parse_aria_tree(tree)  # warm-up
+    start = time.perf_counter()
+    for _ in range(rounds):
+        ref_system.parse_aria_tree(tree)
+    return (time.perf_counter() - start) / rounds
+
+
+def bench_body(body: bytes, rounds: int, streaming: bool, chunk_size: int = 64 * 1024) -> float:
+    """Time body -> context, either json.loads + parse or chunked streaming parse."""
+    ref_system = RefSystem()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        if streaming:
+            parser = AriaTreeStreamParser(ref_system)
+            for i in range(0, len(body), chunk_size):
+                parser.feed(body[i:i + chunk_size])
+            parser.close()
+        else:
+            ref_system.parse_aria_tree(json.loads(body))
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    tree = make_tree(args.nodes)
+    full = bench(RefSystem(), tree, args.rounds)
+    incremental = bench(RefSystem(incremental=True), tree, args.rounds)
+    print(f"nodes={args.nodes} rounds={args.rounds}")
+    print(f"parse_aria_tree            {full * 1000:8.2f} ms/parse")
+    print(f"parse_aria_tree (incr.)    {incremental * 1000:8.2f} ms/parse")
+
+    body = json.dumps(tree).encode("utf-8")
+    buffered = bench_body(body, args.rounds, streaming=False)
+    print(f"json.loads + parse         {buffered * 1000:8.2f} ms/body ({len(body) // 1024} KiB)")
+    if AriaTreeStreamParser.available():
+        streamed = bench_body(body, args.rounds, streaming=True)
+        print(f"AriaTreeStreamParser       {streamed * 1000:8.2f} ms/body")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import asyncio
+import struct
+from tutan_agent.adb.client import ADBClient
+
+class FakeADBServer:
+    """Minimal adb server speaking the smart-socket protocol on a random local port."""
+    def __init__(self, shell_v2: bool = True):
+        self.shell_v2 = shell_v2
+        self.devices = "emulator-5554\tdevice product:sdk model:Pixel_7 device:emu\n"
+        self.forwards = []
+        self.requests = []
+        self.server = None
+        self.port = None
+        self._track_writers = []
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        for writer in self._track_writers:
+            writer.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def set_devices(self, listing: str):
+        self.devices = listing
+        for writer in self._track_writers:
+            writer.write(self._lp(listing))
+            await writer.drain()
+
+    @staticmethod
+    def _lp(text: str) -> bytes:
+        data = text.encode()
+        return b"%04x" % len(data) + data
+
+    async def _read_request(self, reader) -> str:
+        length = int(await reader.readexactly(4), 16)
+        request = (await reader.readexactly(length)).decode()
+        self.requests.append(request)
+        return request
+
+    async def _handle(self, reader, writer):
+        request = await self._read_request(reader)
+        if request == "host:devices-l":
+            writer.write(b"OKAY" + self._lp(self.devices))
+        elif request == "host:track-devices-l":
+            writer.write(b"OKAY" + self._lp(self.devices))
+            self._track_writers.append(writer)
+            await writer.drain()
+            return
+        elif request.startswith("host-serial:"):
+            self.forwards.append(request.split(":forward:")[1])
+            writer.write(b"OKAY" + b"OKAY")
+        elif request.startswith("host:transport:"):
+            if request.split(":", 2)[2] not in self.devices:
+                writer.write(b"FAIL" + self._lp("device not found"))
+                await writer.drain()
+                writer.close()
+                return
+            writer.write(b"OKAY")
+            service = await self._read_request(reader)
+            if service.startswith("shell,v2,raw:") and self.shell_v2:
+                out = service.split(":", 1)[1].encode()
+                writer.write(b"OKAY" + struct.pack("<BI", 1, len(out)) + out + struct.pack("<BI", 3, 1) + b"\x07")
+            elif service.startswith("shell:"):
+                writer.write(b"OKAY" + service.split(":", 1)[1].encode())
+            elif service.startswith("exec:"):
+                writer.write(b"OKAY" + b"\x89PNG\x00\xff")
+            else:
+                writer.write(b"FAIL" + self._lp("closed"))
+        else:
+            writer.write(b"FAIL" + self._lp(f"unknown host service {request}"))
+        await writer.drain()
+        writer.close()
+
+def _run(coro_fn, **server_kwargs):
+    async def main():
+        server = FakeADBServer(**server_kwargs)
+        await server.start()
+        try:
+            return await coro_fn(server, ADBClient(port=server.port))
+        finally:
+            await server.stop()
+    return asyncio.run(main())
+
+def test_shell_v2_exit_code_and_exec_out():
+    async def scenario(server, client):
+        shell = await client.run(["-s", "emulator-5554", "shell", "input", "tap", "1", "2"])
+        exec_out = await client.run(["-s", "emulator-5554", "exec-out", "screencap", "-p"], binary=True)
+        return shell, exec_out
+
+    shell, exec_out = _run(scenario)
+    assert shell == (7, "input tap 1 2", "")
+    assert exec_out == (0, b"\x89PNG\x00\xff", "")
+
+def test_legacy_shell_fallback():
+    async def scenario(server, client):
+        return await client.shell("emulator-5554", "echo hi")
+
+    code, out, _ = _run(scenario, shell_v2=False)
+    assert code == 0 and out == b"echo hi"
+
+def test_missing_device_keeps_shell_v2():
+    from tutan_agent.adb.client import ADBProtocolError
+
+    async def scenario(server, client):
+        try:
+            await client.shell("emulator-9999", "true")
+        except ADBProtocolError as e:
+            error = e
+        return error, await client.shell("emulator-5554", "echo hi")
+
+    error, (code, out, _) = _run(scenario)
+    assert "not found" in str(error)
+    assert code == 7 and out == b"echo hi"
+
+def test_devices_forward_and_unsupported_args():
+    async def scenario(server, client):
+        devices = await client.run(["devices", "-l"])
+        forward = await client.run(["-s", "emulator-5554", "forward", "tcp:8080", "tcp:8080"])
+        return devices, forward, server.forwards
+
+    (code, stdout, _), forward, forwards = _run(scenario)
+    assert code == 0 and stdout.startswith("List of devices attached\nemulator-5554")
+    assert forward[0] == 0 and forwards == ["tcp:8080;tcp:8080"]
+    assert not ADBClient.supports(["-s", "x", "push", "a", "b"])
+    assert not ADBClient.supports(["connect", "1.2.3.4:5555"])
+
+def test_track_devices_stream():
+    async def scenario(server, client):
+        updates = client.track_devices()
+        first = await updates.__anext__()
+        await server.set_devices("")
+        second = await updates.__anext__()
+        await updates.aclose()
+        return first, second
+
+    first, second = _run(scenario)
+    assert first.startswith("emulator-5554")
+    assert second == ""
+
+def test_manager_uses_native_backend():
+    from tutan_agent.adb.manager import ADBManager
+
+    async def scenario(server, client):
+        adb = ADBManager()
+        previous, adb._native_client = adb._native_client, client
+        try:
+            return await adb.execute_async(["-s", "emulator-5554", "shell", "input", "keyevent", "BACK"])
+        finally:
+            adb._native_client = previous
+
+    assert _run(scenario) == (7, "input keyevent BACK", "")
+
+def test_manager_device_tracking_events():
+    from tutan_agent.adb.manager import ADBManager
+
+    async def scenario(server, client):
+        adb = ADBManager()
+        previous, adb._native_client = adb._native_client, client
+        adb._apply_device_list({})
+        events = []
+        got_event = asyncio.Event()
+
+        async def on_event(event):
+            events.append(event)
+            got_event.set()
+
+        tracker = asyncio.create_task(adb.track_devices(on_event))
+        try:
+            await asyncio.wait_for(got_event.wait(), 2)
+            assert adb._tracking_active
+            assert [d.serial for d in adb.scan_devices()] == ["emulator-5554"]
+
+            got_event.clear()
+            await server.set_devices("emulator-5554\toffline\n")
+            await asyncio.wait_for(got_event.wait(), 2)
+            got_event.clear()
+            await server.set_devices("")
+            await asyncio.wait_for(got_event.wait(), 2)
+        finally:
+            tracker.cancel()
+            adb._native_client = previous
+        return events
+
+    events = _run(scenario)
+    assert [e["event"] for e in events] == ["connected", "state_changed", "disconnected"]
+    assert events[0]["model"] == "Pixel_7"
+    assert events[1]["previous_status"] == "device"
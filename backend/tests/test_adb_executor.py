@@ -0,0 +1,52 @@
+import asyncio
+import sys
+import time
+from tutan_agent.adb.manager import ADBManager
+
+def _manager() -> ADBManager:
+    adb = ADBManager()
+    # Run the Python interpreter in place of adb so commands are real subprocesses
+    adb.adb_path = sys.executable
+    return adb
+
+def test_execute_async_returns_output():
+    adb = _manager()
+    code, stdout, stderr = asyncio.run(adb.execute_async(["-c", "print('hello')"], serial="exec-output"))
+    assert code == 0
+    assert stdout.strip() == "hello"
+
+def test_execute_async_binary_and_timeout():
+    adb = _manager()
+    code, stdout, _ = asyncio.run(adb.execute_async(
+        ["-c", "import sys; sys.stdout.buffer.write(bytes([0, 255]))"], serial="exec-binary", binary=True
+    ))
+    assert code == 0 and stdout == b"\x00\xff"
+
+    code, _, stderr = asyncio.run(adb.execute_async(
+        ["-c", "import time; time.sleep(5)"], serial="exec-timeout", timeout=0.2
+    ))
+    assert code == -1 and stderr == "timeout"
+    assert adb.get_exec_metrics()["exec-timeout"]["timeouts"] == 1
+
+def test_per_device_concurrency_limit():
+    adb = _manager()
+    adb.max_concurrency_per_device = 1
+    sleep_cmd = ["-c", "import time; time.sleep(0.3)"]
+
+    async def run():
+        start = time.monotonic()
+        same = asyncio.gather(*(adb.execute_async(sleep_cmd, serial="exec-limited") for _ in range(2)))
+        other = adb.execute_async(sleep_cmd, serial="exec-other")
+        await asyncio.sleep(0.05)
+        depth = adb.get_exec_metrics()["exec-limited"]["queue_depth"]
+        await asyncio.gather(same, other)
+        return depth, time.monotonic() - start
+
+    try:
+        depth, elapsed = asyncio.run(run())
+    finally:
+        adb.max_concurrency_per_device = 2
+    assert depth == 1
+    # Two serialized commands on one device; the other device is not blocked
+    assert elapsed >= 0.6
+    assert adb.get_exec_metrics()["exec-other"]["completed"] == 1
@@ -0,0 +1,79 @@
+import asyncio
+import json
+import os
+import time
+import pytest
+from tutan_agent.core.artifact_store import ArtifactStore
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\0" * 100
+JPEG = b"\xff\xd8\xff" + b"\1" * 100
+
+def _files(root):
+    return sorted(os.path.relpath(os.path.join(d, n), root) for d, _, names in os.walk(root) for n in names)
+
+def test_content_addressed_and_deduplicated(tmp_path):
+    store = ArtifactStore(str(tmp_path))
+
+    async def run():
+        ids = [store.put_screenshot(PNG), store.put_screenshot(PNG), store.put_screenshot(JPEG)]
+        await store.flush()
+        return ids
+
+    first, second, third = asyncio.run(run())
+    assert first == second and first.startswith("screenshots/") and first.endswith(".png")
+    assert third.endswith(".jpg")
+    assert len(_files(tmp_path)) == 2
+    assert store.stats["written"] == 2 and store.stats["deduplicated"] == 1
+    assert store.read(first) == (PNG, "image/png")
+    assert store.put_screenshot(None) is None
+
+def test_tree_is_compressed_and_served_decompressed(tmp_path):
+    store = ArtifactStore(str(tmp_path))
+    tree = json.dumps({"role": "root", "children": [{"text": "OK"}] * 200}).encode()
+
+    async def run():
+        artifact_id = store.put_tree(tree)
+        await store.flush()
+        return artifact_id, await store.read_async(artifact_id)
+
+    artifact_id, (data, media_type) = asyncio.run(run())
+    assert data == tree and media_type == "application/json"
+    assert os.path.getsize(store._path(artifact_id)) < len(tree) / 5
+
+def test_invalid_and_missing_ids(tmp_path):
+    store = ArtifactStore(str(tmp_path))
+    with pytest.raises(ValueError):
+        store.read("screenshots/../../etc/passwd")
+    assert store.read("screenshots/" + "0" * 64 + ".png") is None
+
+def test_retention_by_age_then_size(tmp_path):
+    store = ArtifactStore(str(tmp_path), max_bytes=250, max_age_days=1)
+
+    async def run():
+        ids = [store.put_screenshot(bytes([i]) * 100) for i in range(4)]
+        await store.flush()
+        return ids
+
+    ids = asyncio.run(run())
+    now = time.time()
+    os.utime(store._path(ids[0]), (now - 3 * 86400, now - 3 * 86400))
+    for age, artifact_id in enumerate(ids[1:]):
+        os.utime(store._path(artifact_id), (now - 10 + age, now - 10 + age))
+
+    assert store.enforce_retention() == 2
+    # Expired first, then the least recently written until under max_bytes
+    assert [store.read(i) is not None for i in ids] == [False, False, True, True]
+
+def test_flush_while_writes_complete(tmp_path):
+    store = ArtifactStore(str(tmp_path))
+
+    async def run():
+        for i in range(200):
+            store.put_screenshot(JPEG + i.to_bytes(2, "big"))
+            if i % 20 == 0:
+                await store.flush()
+        await store.flush()
+
+    asyncio.run(run())
+    assert store.stats["written"] == 200
+    assert store.get_stats()["queued"] == 0
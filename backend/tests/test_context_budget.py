@@ -0,0 +1,91 @@
+import asyncio
+from tutan_agent.agents.context_budget import ContextBudget, count_tokens
+from tutan_agent.agents.planner import TutanPlanner
+
+def make_history(steps, incremental=False):
+    history = []
+    for i in range(steps):
+        if incremental:
+            history.append({"role": "user", "content": f"User Task: t\n\nUI Context (Ref System):\n[e1] screen {i}\n\nDecide the next step."})
+        history.append({"role": "assistant", "content": f"Thinking: step {i}\nAction: click({{'ref_id': 'e{i}'}})"})
+        history.append({"role": "user", "content": "Action result: Success"})
+    return history
+
+def test_count_tokens_heuristic_is_positive():
+    assert count_tokens("") == 0
+    assert count_tokens("hello world") > 0
+    assert count_tokens("打开设置") >= 4
+
+def test_short_history_kept_verbatim():
+    budget = ContextBudget(max_tokens=4000, keep_steps=4)
+    history = make_history(3)
+    compacted, folded = budget.compact_history(history)
+    assert compacted == history
+    assert folded == 0
+
+def test_old_steps_folded_in_blocks():
+    budget = ContextBudget(max_tokens=4000, keep_steps=4, fold_every=5)
+    # Not a full block beyond the kept steps yet
+    assert budget.compact_history(make_history(6)) == (make_history(6), 0)
+
+    compacted, folded = budget.compact_history(make_history(9))
+    assert folded == 5
+    assert compacted[0]["content"].startswith("Summary of earlier steps:")
+    assert "1. click({'ref_id': 'e0'}) -> Success" in compacted[0]["content"]
+    assert len(compacted) == 1 + 4 * 2
+
+    # The digest does not change until the next block is full; recent steps stay verbatim
+    for steps in (10, 13):
+        again, folded_again = budget.compact_history(make_history(steps))
+        assert folded_again == 5
+        assert again[0] == compacted[0]
+        assert len(again) - 1 >= 4 * 2
+
+def test_ui_context_keeps_actionable_lines_first():
+    budget = ContextBudget(max_tokens=4000)
+    lines = [f"[e{i}] View" for i in range(200)] + ['[e900] Button text="OK" [clickable]']
+    fitted = budget.fit_ui_context("\n".join(lines), budget=60)
+    assert '[e900] Button text="OK" [clickable]' in fitted
+    assert "omitted" in fitted.splitlines()[-1]
+    assert count_tokens(fitted) < count_tokens("\n".join(lines))
+
+def test_planner_prompt_stays_flat():
+    class FakeResponse:
+        status_code = 200
+        def json(self):
+            return {"choices": [{"message": {"content": '{"action": "wait", "params": {}}'}}]}
+
+    async def run():
+        planner = TutanPlanner("key", "http://llm", "model", budget=ContextBudget(max_tokens=3000, keep_steps=2))
+        async def post(url, json):
+            return FakeResponse()
+        planner.client.post = post
+        context = "\n".join(f'[e{i}] Button text="item {i}" [clickable]' for i in range(40))
+        sizes = []
+        for steps in (5, 30, 60):
+            await planner.plan_next_step("task", context, make_history(steps))
+            sizes.append(planner.context_stats["last_prompt_tokens"])
+        await planner.close()
+        return sizes
+
+    sizes = asyncio.run(run())
+    assert sizes[2] - sizes[0] < 600
+
+def test_delta_falls_back_when_base_folded():
+    async def run():
+        planner = TutanPlanner("key", "http://llm", "model", budget=ContextBudget(max_tokens=3000, keep_steps=1))
+        async def post(url, json):
+            raise RuntimeError("offline")
+        planner.client.post = post
+        history = make_history(5, incremental=True)
+        # Only a delta prompt remains in the kept step
+        history += [{"role": "user", "content": "User Task: t\n\nUI Context changes since the last observation:\n~ [e1]"},
+                    {"role": "assistant", "content": "Thinking: x\nAction: back({})"},
+                    {"role": "user", "content": "Action result: Success"}]
+        await planner.plan_next_step("t", "[e1] full", history, ui_delta="+ [e2] new")
+        await planner.close()
+        return planner
+
+    planner = asyncio.run(run())
+    assert "UI Context (Ref System)" in planner.last_prompt
+    assert planner.context_stats["delta_fallbacks"] == 1
@@ -0,0 +1,88 @@
+import asyncio
+import json
+import httpx
+from tutan_agent.agents.llm_gateway import LLMGateway
+from tutan_agent.agents.planner import TutanPlanner
+
+def completion(plan):
+    return httpx.Response(200, json={"choices": [{"message": {"content": json.dumps(plan)}}]})
+
+def test_calls_to_a_busy_endpoint_share_a_batch_window():
+    seen = []
+    async def handler(request):
+        seen.append((str(request.url), request.headers["authorization"]))
+        await asyncio.sleep(0.01)
+        return completion({"action": "back", "params": {}})
+
+    async def run():
+        gateway = LLMGateway(batch_window=0.05, transport=httpx.MockTransport(handler))
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await gateway.post("http://llm/v1", "key", {})
+        alone = loop.time() - started
+        lone_batches = gateway.stats["batches"]
+        # The first call makes the endpoint busy; the other four wait for one window
+        responses = await asyncio.gather(*(gateway.post("http://llm/v1", f"key-{i}", {"n": i}) for i in range(5)))
+        await gateway.close()
+        return gateway, responses, alone, lone_batches
+
+    gateway, responses, alone, lone_batches = asyncio.run(run())
+    assert alone < 0.05 and lone_batches == 0
+    assert all(r.status_code == 200 for r in responses)
+    assert gateway.stats["batches"] == 1 and gateway.stats["max_batch"] == 4
+    assert seen[0][0] == "http://llm/v1/chat/completions"
+    assert {auth for _, auth in seen[1:]} == {f"Bearer key-{i}" for i in range(5)}
+
+def test_retries_with_backoff():
+    attempts = []
+    def handler(request):
+        attempts.append(request)
+        if len(attempts) == 1:
+            raise httpx.ConnectError("refused")
+        if len(attempts) == 2:
+            return httpx.Response(429, headers={"retry-after": "0"})
+        return completion({"action": "home", "params": {}})
+
+    async def run():
+        gateway = LLMGateway(batch_window=0, backoff=0.01, transport=httpx.MockTransport(handler))
+        response = await gateway.post("http://llm", "key", {})
+        await gateway.close()
+        return gateway, response
+
+    gateway, response = asyncio.run(run())
+    assert response.status_code == 200
+    assert len(attempts) == 3 and gateway.stats["retries"] == 2
+
+def test_in_flight_cap_and_rate_limit():
+    async def run():
+        active = {"now": 0, "max": 0}
+        async def handler(request):
+            active["now"] += 1
+            active["max"] = max(active["max"], active["now"])
+            await asyncio.sleep(0.02)
+            active["now"] -= 1
+            return completion({})
+
+        gateway = LLMGateway(max_in_flight=2, rate=200, batch_window=0, transport=httpx.MockTransport(handler))
+        await asyncio.gather(*(gateway.post("http://llm", "key", {}) for _ in range(6)))
+        await gateway.close()
+        return gateway, active["max"]
+
+    gateway, peak = asyncio.run(run())
+    assert peak == 2 and gateway.stats["max_in_flight_seen"] == 2
+    assert gateway.stats["throttled"] >= 1
+
+def test_planner_uses_gateway():
+    async def run():
+        gateway = LLMGateway(batch_window=0, transport=httpx.MockTransport(
+            lambda r: completion({"thinking": "t", "action": "click", "params": {"ref_id": "e1"}})))
+        planners = [TutanPlanner("key", "http://llm", "model", gateway=gateway) for _ in range(3)]
+        plans = await asyncio.gather(*(p.plan_next_step("task", "[e1] Button [clickable]", []) for p in planners))
+        for planner in planners:
+            await planner.close()
+        await gateway.close()
+        return gateway, plans
+
+    gateway, plans = asyncio.run(run())
+    assert all(plan["action"] == "click" for plan in plans)
+    assert gateway.stats["requests"] == 3
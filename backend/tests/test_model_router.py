@@ -0,0 +1,148 @@
+import asyncio
+import json
+import httpx
+from tutan_agent.agents.model_router import ModelRouter, match_rules, ROUTED_SYSTEM_PROMPT
+from tutan_agent.agents.planner import TutanPlanner
+from tutan_agent.core.perception import PerceptionPipeline, UISnapshot
+from tutan_agent.core.ref_system import RefNode, RefSystem
+from tutan_agent.core.session_store import SessionStore
+
+def node(ref_id, text, clickable=True, editable=False):
+    return RefNode(ref_id, "Button", text, "", "", 0, 0, 10, 10, clickable, editable)
+
+def snapshot(*nodes):
+    refs = {n.ref_id: n for n in nodes}
+    return UISnapshot("\n".join(RefSystem.format_node(n) for n in nodes), "accessibility", {}, None, refs=refs)
+
+def planner(model, plan, calls):
+    def handler(request):
+        calls.append(model)
+        content = plan if isinstance(plan, str) else json.dumps(plan)
+        return httpx.Response(200, json={"choices": [{"message": {"content": content}}]})
+    p = TutanPlanner("key", "http://llm", model, system_prompt=ROUTED_SYSTEM_PROMPT if model == "small" else None)
+    p.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return p
+
+def route(small_plan, screen, history=()):
+    calls = []
+    async def run():
+        large = planner("large", {"action": "back", "params": {}}, calls)
+        router = ModelRouter(large, planner("small", small_plan, calls))
+        decision = await router.plan_next_step("task", screen, list(history))
+        await large.close()
+        await router.close()
+        return decision
+    return asyncio.run(run()), calls
+
+def test_rules_click_only_confirm_button():
+    assert match_rules({"e1": node("e1", "OK")})["params"] == {"ref_id": "e1"}
+    assert match_rules({"e1": node("e1", "Delete")}) is None
+    assert match_rules({"e1": node("e1", "OK"), "e2": node("e2", "Cancel")}) is None
+
+    decision, calls = route({}, snapshot(node("e1", "知道了"), node("e2", "Title", clickable=False)))
+    assert decision.route == "rules" and decision.planner is None and calls == []
+
+def test_confident_small_model_is_used():
+    plan = {"action": "click", "params": {"ref_id": "e2"}, "confidence": 0.9}
+    decision, calls = route(plan, snapshot(node("e1", "Wi-Fi"), node("e2", "Bluetooth")))
+    assert decision.route == "small" and decision.plan["params"] == {"ref_id": "e2"}
+    assert calls == ["small"]
+
+def test_escalates_on_low_confidence_bad_ref_or_invalid_json():
+    screen = snapshot(node("e1", "Wi-Fi"), node("e2", "Bluetooth"))
+    for small_plan in ({"action": "click", "params": {"ref_id": "e2"}, "confidence": 0.3},
+                       {"action": "click", "params": {"ref_id": "e9"}, "confidence": 0.95},
+                       "not json"):
+        decision, calls = route(small_plan, screen)
+        assert decision.route == "large" and decision.escalated
+        assert calls == ["small", "large"]
+
+def test_failed_step_goes_straight_to_large_model():
+    history = [{"role": "assistant", "content": "Action: click"}, {"role": "user", "content": "Action result: Failed"}]
+    decision, calls = route({"action": "back", "params": {}, "confidence": 1}, snapshot(node("e1", "OK")), history)
+    assert decision.route == "large" and calls == ["large"]
+
+class ScreenController:
+    """Serves a sequence of screens and, like DeviceController, a new RefNode dict per parse."""
+    serial = "fake"
+
+    def __init__(self, *screens):
+        self.screens = list(screens)
+        self.current_nodes = {}
+
+    async def get_ui_context(self):
+        nodes = self.screens[0]
+        self.current_nodes = {n.ref_id: n for n in nodes}
+        return "\n".join(RefSystem.format_node(n) for n in nodes), "accessibility"
+
+    async def get_screenshot(self, step=None):
+        return b"png"
+
+    def get_current_nodes(self):
+        return {}
+
+    def get_current_lines(self):
+        return {}
+
+def test_routing_on_prefetched_snapshots():
+    calls, slots_held = [], []
+    def handler(request):
+        calls.append("small")
+        slots_held.append(large.llm_slots.locked())
+        plan = {"action": "click", "params": {"ref_id": "e2"}, "confidence": 0.9}
+        return httpx.Response(200, json={"choices": [{"message": {"content": json.dumps(plan)}}]})
+
+    large = planner("large", {"action": "back", "params": {}}, calls)
+    large.llm_slots = asyncio.Semaphore(1)
+    small = TutanPlanner("key", "http://llm", "small", system_prompt=ROUTED_SYSTEM_PROMPT)
+    small.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    controller = ScreenController([node("e1", "Wi-Fi"), node("e2", "Bluetooth")], [node("e1", "OK")])
+
+    async def run():
+        router = ModelRouter(large, small)
+        pipeline = PerceptionPipeline(controller)
+        routes = [(await router.plan_next_step("task", await pipeline.next_snapshot(), [])).route]
+        # Later steps go through the prefetch/revalidation path
+        for _ in range(2):
+            pipeline.prefetch()
+            routes.append((await router.plan_next_step("task", await pipeline.next_snapshot(), [])).route)
+            controller.screens.pop(0)
+        await large.close()
+        await router.close()
+        return routes
+
+    assert asyncio.run(run()) == ["small", "small", "rules"]
+    assert calls == ["small", "small"] and slots_held == [True, True]
+
+def test_rule_not_repeated_on_unchanged_screen():
+    calls = []
+    async def run():
+        large = planner("large", {"action": "finish", "params": {"message": "done"}}, calls)
+        router = ModelRouter(large)
+        screen = snapshot(node("e1", "OK"))
+        routes = [(await router.plan_next_step("task", screen, [])).route for _ in range(2)]
+        await large.close()
+        return routes
+
+    assert asyncio.run(run()) == ["rules", "large"]
+
+def test_wait_is_not_a_failed_step():
+    history = [{"role": "assistant", "content": "Thinking: loading\nAction: wait({})"},
+               {"role": "user", "content": "Action result: Failed"}]
+    decision, calls = route({"action": "back", "params": {}, "confidence": 0.9},
+                            snapshot(node("e1", "Wi-Fi"), node("e2", "Bluetooth")), history)
+    assert decision.route == "small" and calls == ["small"]
+
+def test_route_stats_in_session_store(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.db"))
+    store.create_session("s1", "dev", "task", {})
+    steps = [("rules", 0.001, "success", False), ("small", 0.4, "success", False),
+             ("large", 2.0, "failed", True), ("large", 1.0, "success", False)]
+    for i, (route_name, latency, result, escalated) in enumerate(steps, 1):
+        store.add_step("s1", {"step": i, "action": "click", "params": {}, "result": result,
+                              "route": route_name, "plan_latency": latency, "escalated": escalated})
+    stats = store.get_route_stats(serial="dev")
+    assert stats["large"]["steps"] == 2 and stats["large"]["avg_latency"] == 1.5
+    assert stats["large"]["success_rate"] == 0.5 and stats["large"]["escalated"] == 1
+    assert stats["rules"]["success_rate"] == 1.0
+    assert store.get_route_stats(serial="other") == {}
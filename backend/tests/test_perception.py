@@ -0,0 +1,104 @@
+import asyncio
+from tutan_agent.core.perception import PerceptionPipeline
+
+class FakeController:
+    serial = "fake"
+
+    def __init__(self):
+        self.context = "[e1] Button text=\"OK\" [clickable]"
+        self.tree_calls = 0
+        self.screenshot_calls = 0
+
+    async def get_ui_context(self):
+        self.tree_calls += 1
+        await asyncio.sleep(0.01)
+        return self.context, "accessibility"
+
+    async def get_screenshot(self, step=None):
+        self.screenshot_calls += 1
+        await asyncio.sleep(0.01)
+        return f"png-{self.screenshot_calls}".encode()
+
+    def get_current_nodes(self):
+        return {}
+
+    def get_current_lines(self):
+        return {"e1": self.context}
+
+def test_capture_without_prefetch():
+    controller = FakeController()
+    pipeline = PerceptionPipeline(controller)
+    snapshot = asyncio.run(pipeline.next_snapshot())
+    assert snapshot.ui_context == controller.context
+    assert snapshot.screenshot == b"png-1"
+    assert pipeline.stats["captured"] == 1
+
+def test_prefetch_reused_when_ui_unchanged():
+    async def run():
+        controller = FakeController()
+        pipeline = PerceptionPipeline(controller)
+        pipeline.prefetch()
+        snapshot = await pipeline.next_snapshot()
+        return controller, pipeline, snapshot
+
+    controller, pipeline, snapshot = asyncio.run(run())
+    assert snapshot.screenshot == b"png-1"
+    assert controller.screenshot_calls == 1
+    assert pipeline.stats["reused"] == 1
+
+def test_prefetch_discarded_when_ui_changed():
+    async def run():
+        controller = FakeController()
+        pipeline = PerceptionPipeline(controller)
+        pipeline.prefetch()
+        await asyncio.sleep(0.05)
+        controller.context = "[e1] Button text=\"Next\" [clickable]"
+        snapshot = await pipeline.next_snapshot()
+        return controller, pipeline, snapshot
+
+    controller, pipeline, snapshot = asyncio.run(run())
+    assert "Next" in snapshot.ui_context
+    assert snapshot.screenshot == b"png-2"
+    assert pipeline.stats["discarded"] == 1
+
+def test_prefetch_reused_without_validation_on_static_stream():
+    from tutan_agent.core.screen_monitor import ScreenChangeMonitor
+
+    async def run():
+        controller = FakeController()
+        controller.screen_monitor = ScreenChangeMonitor("fake")
+        pipeline = PerceptionPipeline(controller)
+        pipeline.prefetch()
+        snapshot = await pipeline.next_snapshot()
+        return controller, pipeline, snapshot
+
+    controller, pipeline, snapshot = asyncio.run(run())
+    assert snapshot.screenshot == b"png-1"
+    assert controller.tree_calls == 1
+    assert pipeline.stats["reused"] == 1
+
+def test_refs_kept_on_revalidated_and_recaptured_snapshots():
+    from tutan_agent.core.ref_system import RefNode
+
+    class RefController(FakeController):
+        async def get_ui_context(self):
+            result = await super().get_ui_context()
+            # New dict per parse, like DeviceController
+            self.current_nodes = {"e1": RefNode("e1", "Button", "OK", "", "", 0, 0, 10, 10, True, False)}
+            return result
+
+    async def run():
+        controller = RefController()
+        pipeline = PerceptionPipeline(controller)
+        refs = []
+        for change in (False, True):
+            pipeline.prefetch()
+            if change:
+                await asyncio.sleep(0.05)
+                controller.context = "[e1] Button text=\"Next\" [clickable]"
+            refs.append(list((await pipeline.next_snapshot()).refs))
+        return pipeline, refs
+
+    pipeline, refs = asyncio.run(run())
+    assert refs == [["e1"], ["e1"]]
+    assert pipeline.stats["reused"] == 1 and pipeline.stats["discarded"] == 1
@@ -0,0 +1,99 @@
+import asyncio
+import json
+import httpx
+from tutan_agent.agents.plan_cache import PlanCache, plan_key, normalize_ui_context
+from tutan_agent.agents.planner import TutanPlanner
+
+HISTORY = [
+    {"role": "assistant", "content": "Thinking: open\nAction: click({'ref_id': 'e1'})"},
+    {"role": "user", "content": "Action result: Success"},
+]
+
+def test_key_ignores_volatile_text_but_not_refs():
+    base = plan_key("open wifi", '[e1] Text text="12:30"  [clickable]', HISTORY, "m", "1.0")
+    assert base == plan_key("open  wifi", '[e1] Text text="09:05" [clickable]', HISTORY, "m", "1.0")
+    assert base != plan_key("open wifi", '[e2] Text text="12:30" [clickable]', HISTORY, "m", "1.0")
+    assert base != plan_key("open wifi", '[e1] Text text="12:30" [clickable]', HISTORY, "m", "2.0")
+    assert base != plan_key("open wifi", '[e1] Text text="12:30" [clickable]', [], "m", "1.0")
+    assert normalize_ui_context("a  85%\n\n b") == "a <pct>\nb"
+
+def test_memory_and_disk_tiers(tmp_path):
+    db = str(tmp_path / "cache.db")
+    async def run():
+        cache = PlanCache(db_path=db, max_entries=1)
+        cache.put("k1", {"action": "back", "params": {}}, "m", "1.0")
+        cache.put("k2", {"action": "home", "params": {}}, "m", "1.0")
+        # k1 was evicted from memory but is still on disk
+        first = await cache.get("k1")
+        second = await cache.get("k1")
+        missing = await cache.get("nope")
+        return cache, first, second, missing
+
+    cache, first, second, missing = asyncio.run(run())
+    assert first == second == {"action": "back", "params": {}}
+    assert missing is None
+    assert cache.stats["disk_hits"] == 1 and cache.stats["memory_hits"] == 1 and cache.stats["misses"] == 1
+
+    # A fresh process sees the disk tier
+    reopened = PlanCache(db_path=db)
+    assert asyncio.run(reopened.get("k2")) == {"action": "home", "params": {}}
+
+def test_ttl_and_invalidation(tmp_path):
+    async def run():
+        cache = PlanCache(db_path=str(tmp_path / "cache.db"), ttl=0.05)
+        cache.put("old", {"action": "back"}, "m", "1.0")
+        await asyncio.sleep(0.1)
+        expired = await cache.get("old")
+
+        cache.ttl = 3600
+        cache.put("a", {"action": "back"}, "m", "1.0")
+        cache.put("b", {"action": "back"}, "m", "2.0")
+        removed = cache.invalidate(app_version="1.0")
+        return cache, expired, removed, await cache.get("a"), await cache.get("b")
+
+    cache, expired, removed, a, b = asyncio.run(run())
+    assert expired is None and cache.stats["expired"] == 1
+    assert removed == 1
+    assert a is None and b == {"action": "back"}
+
+def test_invalidate_shared_table_once(tmp_path):
+    # Two shard processes share the table; one invalidates, the other only forgets
+    db = str(tmp_path / "cache.db")
+    async def run():
+        first, second = PlanCache(db_path=db), PlanCache(db_path=db)
+        second.put("a", {"action": "back"}, "m", "1.0")
+        await second.forget_async(app_version="1.0")
+        removed = await first.invalidate_async(app_version="1.0")
+        return removed, await second.get("a")
+
+    removed, cached = asyncio.run(run())
+    assert removed == 1 and cached is None
+
+def test_planner_reuses_successful_plans_only(tmp_path):
+    calls = []
+    def handler(request):
+        calls.append(request)
+        content = json.dumps({"thinking": "t", "action": "click", "params": {"ref_id": "e1"}})
+        return httpx.Response(200, json={"choices": [{"message": {"content": content}}]})
+
+    async def run():
+        cache = PlanCache(db_path=str(tmp_path / "cache.db"))
+        planner = TutanPlanner("key", "http://llm", "m", cache=cache, app_version="1.0")
+        planner.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        ui = '[e1] Button text="OK" [clickable]'
+
+        plan = await planner.plan_next_step("task", ui, [])
+        planner.record_outcome(plan, success=False)
+        plan = await planner.plan_next_step("task", ui, [])
+        planner.record_outcome(plan, success=True)
+        hit = await planner.plan_next_step("task", ui, [])
+        # The cached plan failed this time, so it is dropped
+        planner.record_outcome(hit, success=False)
+        await planner.plan_next_step("task", ui, [])
+        await planner.close()
+        return cache, hit
+
+    cache, hit = asyncio.run(run())
+    assert hit["action"] == "click"
+    assert len(calls) == 3
+    assert cache.stats["memory_hits"] == 1
@@ -0,0 +1,85 @@
+import asyncio
+import json
+import httpx
+from tutan_agent.agents.json_stream import IncrementalJSONObject
+from tutan_agent.agents.planner import TutanPlanner
+
+def sse(chunks):
+    lines = [f"data: {json.dumps({'choices': [{'delta': {'content': c}}]})}\n\n" for c in chunks]
+    return lines + ["data: [DONE]\n\n"]
+
+class SlowStream(httpx.AsyncByteStream):
+    def __init__(self, lines, tail_delay):
+        self.lines = lines
+        self.tail_delay = tail_delay
+
+    async def __aiter__(self):
+        for i, line in enumerate(self.lines):
+            if i == 3:
+                await asyncio.sleep(self.tail_delay)
+            yield line.encode()
+
+def make_planner(lines, tail_delay=0.0):
+    planner = TutanPlanner("key", "http://llm", "model", stream=True)
+    def handler(request):
+        assert json.loads(request.content)["stream"] is True
+        return httpx.Response(200, stream=SlowStream(lines, tail_delay))
+    planner.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return planner
+
+def test_parser_emits_keys_as_they_complete():
+    parser = IncrementalJSONObject()
+    assert parser.feed('```json\n{"action": "cl') == []
+    assert parser.feed('ick", "params": {"ref_id": "e') == [("action", "click")]
+    assert parser.feed('5", "n": [1, {"x": "}"}]}, "score": 0.5') == [("params", {"ref_id": "e5", "n": [1, {"x": "}"}]})]
+    assert parser.feed('}\n```') == [("score", 0.5)]
+    assert parser.done
+
+def test_streamed_action_returned_before_tail():
+    async def run():
+        chunks = ['{"action": "click", ', '"params": {"ref_id": "e3"}', ', "thinking": "', 'the OK button"}']
+        planner = make_planner(sse(chunks), tail_delay=0.3)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        plan = await planner.plan_next_step("task", "[e3] Button text=\"OK\" [clickable]", [])
+        early = loop.time() - started
+        full = await planner.complete_plan(plan)
+        await planner.close()
+        return plan, full, early, planner
+
+    plan, full, early, planner = asyncio.run(run())
+    assert plan["action"] == "click" and plan["params"] == {"ref_id": "e3"}
+    assert early < 0.25
+    assert full["thinking"] == "the OK button"
+    assert planner.stream_stats["early_actions"] == 1
+
+def test_streamed_plan_with_thinking_first():
+    async def run():
+        planner = make_planner(sse(['{"thinking": "go back", ', '"action": "back", "params": {}}']))
+        plan = await planner.plan_next_step("task", "[e1] View", [])
+        full = await planner.complete_plan(plan)
+        await planner.close()
+        return full
+
+    assert asyncio.run(run()) == {"thinking": "go back", "action": "back", "params": {}}
+
+def test_stream_error_status():
+    async def run():
+        planner = TutanPlanner("key", "http://llm", "model", stream=True)
+        planner.client = httpx.AsyncClient(transport=httpx.MockTransport(lambda r: httpx.Response(500, text="boom")))
+        plan = await planner.plan_next_step("task", "[e1] View", [])
+        await planner.close()
+        return plan
+
+    assert asyncio.run(run()) == {"error": "API returned 500"}
+
+def test_stream_finished_with_action_returns_full_plan():
+    async def run():
+        planner = make_planner(sse(['{"action": "back", "params": {}', ', "thinking": "done already"}']))
+        plan = await planner.plan_next_step("task", "[e1] View", [])
+        await planner.close()
+        return plan, planner
+
+    plan, planner = asyncio.run(run())
+    assert plan == {"action": "back", "params": {}, "thinking": "done already"}
+    assert planner.stream_stats["early_actions"] == 0
@@ -55,3 +55,96 @@ def test_ref_system_reset():
     ref_sys.reset()
     assert len(ref_sys.current_refs) == 0
     assert ref_sys._ref_counter == 0
+
+def _screen(title: str, with_extra: bool = False):
+    children = [
+        {"class": "android.widget.TextView", "id": "title", "text": title,
+         "bounds": {"left": 0, "top": 0, "right": 1080, "bottom": 100}},
+        {"class": "android.widget.Button", "id": "ok", "text": "OK", "clickable": True,
+         "bounds": {"left": 100, "top": 500, "right": 300, "bottom": 600}},
+    ]
+    if with_extra:
+        children.append({"class": "android.widget.Button", "id": "cancel", "text": "Cancel", "clickable": True,
+                         "bounds": {"left": 400, "top": 500, "right": 600, "bottom": 600}})
+    return {"class": "android.widget.FrameLayout", "children": children}
+
+def test_incremental_ref_ids_are_stable():
+    ref_sys = RefSystem(incremental=True)
+    ref_sys.parse_aria_tree(_screen("Home"))
+    ok_id = next(r for r, n in ref_sys.current_refs.items() if n.resource_id == "ok")
+    old_lines = dict(ref_sys.current_lines)
+
+    ref_sys.parse_aria_tree(_screen("Settings", with_extra=True))
+    assert ref_sys.get_node(ok_id).resource_id == "ok"
+
+    delta = RefSystem.compute_delta(old_lines, ref_sys.current_lines)
+    assert len(delta["added"]) == 1 and "Cancel" in delta["added"][0]
+    assert len(delta["changed"]) == 1 and "Settings" in delta["changed"][0]
+    assert delta["removed"] == []
+
+    text = RefSystem.format_delta(delta)
+    assert text.startswith("+ [")
+    assert "~ [" in text
+
+def test_non_incremental_renumbers():
+    ref_sys = RefSystem()
+    ref_sys.parse_aria_tree(_screen("Home", with_extra=True))
+    first = dict(ref_sys.current_lines)
+    ref_sys.parse_aria_tree(_screen("Home", with_extra=True))
+    assert ref_sys.current_lines == first
+    assert RefSystem.format_delta(RefSystem.compute_delta(first, first)) == "(no changes)"
+
+def test_deep_tree_does_not_recurse():
+    depth = 20000
+    root = node = {"class": "android.widget.FrameLayout", "children": []}
+    for _ in range(depth):
+        child = {"class": "android.widget.FrameLayout", "children": []}
+        node["children"].append(child)
+        node = child
+    node["children"].append({"class": "android.widget.Button", "text": "Deep", "clickable": True,
+                             "bounds": {"left": 0, "top": 0, "right": 10, "bottom": 10}})
+
+    ref_sys = RefSystem()
+    context = ref_sys.parse_aria_tree(root)
+    assert context == f'[e{depth + 2}] Button text="Deep" [clickable]'
+    assert ref_sys.get_node(f"e{depth + 2}").center() == (5, 5)
+
+def test_parse_5k_nodes_within_budget():
+    import time
+    root = {"class": "android.widget.FrameLayout", "children": []}
+    for i in range(50):
+        row = {"class": "android.widget.LinearLayout", "children": []}
+        for j in range(99):
+            row["children"].append({"class": "android.widget.TextView", "id": f"item_{i}_{j}",
+                                    "text": f"Item {j}" if j % 2 else "",
+                                    "bounds": {"left": 0, "top": j, "right": 100, "bottom": j + 10}})
+        root["children"].append(row)
+
+    ref_sys = RefSystem()
+    start = time.perf_counter()
+    ref_sys.parse_aria_tree(root)
+    elapsed = time.perf_counter() - start
+    assert len(ref_sys.current_refs) == 50 * 49
+    # Generous guard; see benchmarks/bench_ref_system.py for real numbers
+    assert elapsed < 0.5
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 16])
+def test_stream_parser_matches_buffered(chunk_size):
+    pytest.importorskip("ijson")
+    from tutan_agent.core.ref_system import AriaTreeStreamParser
+
+    tree = _screen("Home", with_extra=True)
+    tree["children"][0]["children"] = [{"class": "android.widget.ImageView", "contentDescription": "Logo",
+                                        "extras": {"nested": [1, {"a": "b"}]}}]
+    body = json.dumps(tree).encode("utf-8")
+
+    expected_sys = RefSystem()
+    expected = expected_sys.parse_aria_tree(tree)
+
+    ref_sys = RefSystem()
+    parser = AriaTreeStreamParser(ref_sys)
+    for i in range(0, len(body), chunk_size):
+        parser.feed(body[i:i + chunk_size])
+    assert parser.close() == expected
+    assert ref_sys.current_lines == expected_sys.current_lines
+    assert ref_sys.get_node("e4").bounds == {"left": 100, "top": 500, "right": 300, "bottom": 600}
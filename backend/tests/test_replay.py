@@ -0,0 +1,127 @@
+from tutan_agent.agents.replay import TrajectoryReplayer, step_fingerprint
+from tutan_agent.core.ref_system import RefNode
+from tutan_agent.core.session_store import SessionStore
+
+def node(ref_id, text, resource_id="", top=0):
+    return RefNode(ref_id, "Button", text, "", resource_id, 0, top, 100, top + 50, True, False)
+
+def screen(*nodes):
+    return {n.ref_id: n for n in nodes}
+
+def record(tmp_path, steps):
+    store = SessionStore(str(tmp_path / "sessions.db"))
+    store.create_session("rec", "dev", "check in", {})
+    for number, (refs, action, params, result) in enumerate(steps, 1):
+        store.add_step("rec", {"step": number, "action": action, "params": params, "result": result,
+                               "fingerprint": step_fingerprint(refs, params)})
+    return store.get_session_steps("rec")
+
+def test_replay_remaps_refs_by_fingerprint(tmp_path):
+    home = screen(node("e1", "Check in", "app:id/checkin"), node("e2", "Settings", "app:id/settings"))
+    done = screen(node("e1", "OK", "app:id/ok"))
+    steps = record(tmp_path, [
+        (home, "click", {"ref_id": "e1"}, "success"),
+        (done, "finish", {"message": "done"}, "success"),
+    ])
+    replayer = TrajectoryReplayer(steps)
+
+    # Same screen, but the ref IDs were numbered differently this run
+    live = screen(node("e7", "Settings", "app:id/settings"), node("e9", "Check in", "app:id/checkin"))
+    plan = replayer.next_plan(live)
+    assert plan["action"] == "click" and plan["params"] == {"ref_id": "e9"}
+
+    plan = replayer.next_plan(screen(node("e3", "OK", "app:id/ok")))
+    assert plan["action"] == "finish"
+    assert replayer.exhausted and replayer.stats["replayed"] == 2
+
+def test_replay_diverges_and_resyncs(tmp_path):
+    home = screen(node("e1", "Check in", "app:id/checkin"))
+    done = screen(node("e1", "OK", "app:id/ok"))
+    steps = record(tmp_path, [
+        (home, "click", {"ref_id": "e1"}, "success"),
+        (home, "click", {"ref_id": "e1"}, "failed"),
+        (done, "click", {"ref_id": "e1"}, "success"),
+    ])
+    replayer = TrajectoryReplayer(steps)
+    assert len(replayer.steps) == 2
+
+    popup = screen(node("e1", "Allow", "android:id/button1"), node("e2", "Deny", "android:id/button2"))
+    assert replayer.next_plan(popup) is None
+    assert replayer.stats["diverged"] == 1
+
+    # The planner handled the popup and the first recorded step; the replay picks up at the next one
+    plan = replayer.next_plan(screen(node("e4", "OK", "app:id/ok")))
+    assert plan["params"] == {"ref_id": "e4"}
+    assert replayer.exhausted
+
+def test_duplicate_targets_resolved_by_position(tmp_path):
+    recorded = screen(node("e1", "Item", top=0), node("e2", "Item", top=300))
+    steps = record(tmp_path, [(recorded, "click", {"ref_id": "e2"}, "success")])
+    live = screen(node("e5", "Item", top=0), node("e6", "Item", top=300))
+    assert TrajectoryReplayer(steps).next_plan(live)["params"] == {"ref_id": "e6"}
+
+def test_replays_recorded_agent_run(tmp_path):
+    import asyncio
+    from tutan_agent.agents.base import TutanAgent
+    from tutan_agent.agents.model_router import RouteDecision
+    from tutan_agent.core.perception import PerceptionPipeline
+    from tutan_agent.core.ref_system import RefSystem
+
+    screens = {
+        "home": [node("e1", "Check in", "app:id/checkin")],
+        "list": [node("e1", "Item A", "app:id/item")],
+        "list2": [node("e1", "Item B", "app:id/item")],
+    }
+
+    class Controller:
+        """Moves between screens like the device would; reports success like DeviceController."""
+        serial = "fake"
+        screenshots = type("Screenshots", (), {"session_id": None})()
+        def __init__(self):
+            self.screen = "home"
+            self.current_nodes = {}
+        async def get_ui_context(self):
+            self.current_nodes = screen(*screens[self.screen])
+            return "\n".join(RefSystem.format_node(n) for n in screens[self.screen]), "accessibility"
+        async def get_screenshot(self, step=None):
+            return None
+        def get_current_nodes(self):
+            return {}
+        def get_current_lines(self):
+            return {}
+        async def execute_action(self, action, params):
+            self.screen = {("home", "click"): "list", ("list", "scroll"): "list2"}.get((self.screen, action), self.screen)
+            return action in ("click", "type", "back", "home")
+
+    class Router:
+        def __init__(self, plans):
+            self.plans = list(plans)
+        async def plan_next_step(self, task, snapshot, history, ui_delta=None):
+            action, params = self.plans.pop(0)
+            return RouteDecision({"action": action, "params": params}, "large", None)
+        async def close(self):
+            pass
+
+    async def run_agent(plans, replay_session=None):
+        agent = TutanAgent("fake", {})
+        agent.controller = Controller()
+        agent.perception = PerceptionPipeline(agent.controller)
+        agent.store = SessionStore(str(tmp_path / "sessions.db"))
+        agent.router = Router(plans)
+        async def settled(action, started=None):
+            pass
+        agent.settle_detector.wait = settled
+        events = [event async for event in agent.stream_task("check in", replay_session=replay_session)]
+        return agent.session_id, events
+
+    async def run():
+        recorded, _ = await run_agent([("click", {"ref_id": "e1"}), ("scroll", {"direction": "down"}),
+                                       ("wait", {}), ("finish", {"message": "done"})])
+        _, events = await run_agent([], replay_session=recorded)
+        return events
+
+    events = asyncio.run(run())
+    steps = [e["data"] for e in events if e["type"] == "step"]
+    assert [s["action"] for s in steps] == ["click", "scroll", "wait", "finish"]
+    assert all(s["route"] == "replay" for s in steps)
+    assert events[-1]["type"] == "done"
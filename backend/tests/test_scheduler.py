@@ -0,0 +1,131 @@
+import asyncio
+from tutan_agent.adb.manager import ADBDevice
+from tutan_agent.agents.scheduler import TaskScheduler
+from tutan_agent.core.session_store import SessionStore
+
+class FakePlanner:
+    llm_slots = None
+
+class FakeAgent:
+    """Runs each task for `duration` seconds while holding an LLM slot."""
+    def __init__(self, serial: str, log: list, duration: float = 0.05):
+        self.serial = serial
+        self.log = log
+        self.duration = duration
+        self.planner = FakePlanner()
+        self._abort = False
+
+    async def stream_task(self, task):
+        self._abort = False
+        self.log.append(("start", self.serial, task))
+        yield {"type": "status", "data": {"message": "Task started", "session_id": f"s-{task}"}}
+        async with self.planner.llm_slots:
+            await asyncio.sleep(self.duration)
+        if self._abort:
+            yield {"type": "status", "data": {"message": "Task aborted by user"}}
+            return
+        self.log.append(("end", self.serial, task))
+        yield {"type": "done", "data": {"message": "ok"}}
+
+    def abort(self):
+        self._abort = True
+
+def _scheduler(tmp_path, devices, log, **kwargs):
+    agents = {}
+
+    async def factory(serial):
+        return agents.setdefault(serial, FakeAgent(serial, log))
+
+    store = SessionStore(str(tmp_path / "tasks.db"))
+    return TaskScheduler(factory, lambda: devices, store=store, poll_interval=0.05, **kwargs), store
+
+async def _drain(scheduler, timeout=2.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while (scheduler._pending or scheduler._running) and loop.time() < deadline:
+        await asyncio.sleep(0.01)
+
+def test_one_task_per_device_in_priority_order(tmp_path):
+    log = []
+    devices = [ADBDevice("a", "device")]
+
+    async def run():
+        scheduler, store = _scheduler(tmp_path, devices, log)
+        scheduler.start()
+        low = scheduler.submit("low", priority=0)
+        scheduler.submit("first", priority=0, device_serial="a")
+        scheduler.submit("high", priority=5)
+        await _drain(scheduler)
+        stats = scheduler.get_stats()
+        await scheduler.stop()
+        return stats, store.get_task(low.id)
+
+    stats, low = asyncio.run(run())
+    assert [entry[2] for entry in log if entry[0] == "start"] == ["high", "low", "first"]
+    # Never two tasks on the same device at once
+    assert [entry[0] for entry in log] == ["start", "end"] * 3
+    assert low["status"] == "completed" and low["session_id"] == "s-low"
+    assert stats["queue_depth"] == 0 and stats["finished"] == 3
+
+def test_placement_on_matching_devices_and_llm_limit(tmp_path):
+    log = []
+    devices = [ADBDevice("a", "device", "Pixel_7"), ADBDevice("b", "device", "Pixel_8"),
+               ADBDevice("c", "offline", "Pixel_8")]
+
+    async def run():
+        scheduler, _ = _scheduler(tmp_path, devices, log, max_llm_concurrency=1)
+        scheduler.start()
+        scheduler.submit("p8", device_model="Pixel_8")
+        scheduler.submit("any")
+        await asyncio.sleep(0.03)
+        running = dict(scheduler.get_stats()["running"])
+        in_flight = scheduler.get_stats()["llm_in_flight"]
+        await _drain(scheduler)
+        await scheduler.stop()
+        return running, in_flight
+
+    running, in_flight = asyncio.run(run())
+    assert set(running) == {"a", "b"}
+    assert {(e[1], e[2]) for e in log if e[0] == "start"} == {("b", "p8"), ("a", "any")}
+    # The global LLM limit serializes the two agents
+    assert in_flight == 1
+
+def test_cancel_and_recovery_from_store(tmp_path):
+    log = []
+
+    async def run():
+        scheduler, store = _scheduler(tmp_path, [], log)
+        scheduler.start()
+        kept = scheduler.submit("kept")
+        dropped = scheduler.submit("dropped")
+        assert scheduler.cancel(dropped.id)
+        await scheduler.stop()
+
+        # A new scheduler picks up the queue where the old one stopped
+        devices = [ADBDevice("a", "device")]
+        restarted, _ = _scheduler(tmp_path, devices, log)
+        restarted.start()
+        await _drain(restarted)
+        await restarted.stop()
+        return store.get_task(kept.id), store.get_task(dropped.id)
+
+    kept, dropped = asyncio.run(run())
+    assert dropped["status"] == "cancelled"
+    assert kept["status"] == "completed"
+    assert [e[2] for e in log if e[0] == "start"] == ["kept"]
+
+def test_abort_running_task(tmp_path):
+    log = []
+
+    async def run():
+        scheduler, store = _scheduler(tmp_path, [ADBDevice("a", "device")], log)
+        scheduler.start()
+        task = scheduler.submit("long")
+        await asyncio.sleep(0.02)
+        assert scheduler.running_task("a").id == task.id
+        scheduler.cancel(task.id)
+        await _drain(scheduler)
+        await scheduler.stop()
+        return store.get_task(task.id)
+
+    assert asyncio.run(run())["status"] == "aborted"
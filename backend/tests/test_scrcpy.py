@@ -0,0 +1,81 @@
+import asyncio
+import socket
+import struct
+from tutan_agent.core.scrcpy import ScrcpyStreamer, CONTROL_MSG_INJECT_TOUCH_EVENT, CONTROL_MSG_INJECT_KEYCODE
+
+def _streamer_with_control():
+    streamer = ScrcpyStreamer("fake", hub=None)
+    ours, theirs = socket.socketpair()
+    ours.setblocking(False)
+    streamer.control_socket = ours
+    streamer.frame_size = (540, 1200)
+    streamer.device_size = (1080, 2400)
+    return streamer, theirs
+
+def test_inject_tap_scales_to_frame():
+    streamer, peer = _streamer_with_control()
+    asyncio.run(streamer.inject_tap(500, 1000))
+    data = peer.recv(64)
+    assert len(data) == 64
+    msg_type, action, pointer, x, y, w, h, pressure, _, _ = struct.unpack(">BBqiiHHHII", data[:32])
+    assert (msg_type, action, x, y, w, h, pressure) == (CONTROL_MSG_INJECT_TOUCH_EVENT, 0, 250, 500, 540, 1200, 0xFFFF)
+    assert struct.unpack(">BBqiiHHHII", data[32:])[1] == 1
+
+def test_inject_tap_after_rotation():
+    streamer, peer = _streamer_with_control()
+    streamer.frame_size = (1200, 540)  # landscape video, `wm size` still portrait
+    assert asyncio.run(streamer.inject_tap(2000, 800))
+    x, y, w, h = struct.unpack(">BBqiiHHHII", peer.recv(64)[:32])[3:7]
+    assert (x, y, w, h) == (1000, 400, 1200, 540)
+
+    # Outside the frame (it is from the other orientation): nothing is sent
+    assert not asyncio.run(streamer.inject_tap(500, 2000))
+    # The encoder restarted, so the codec-header size is stale
+    streamer._config_packets = 2
+    assert not asyncio.run(streamer.inject_tap(100, 100))
+    peer.setblocking(False)
+    try:
+        leftover = peer.recv(64)
+    except BlockingIOError:
+        leftover = b""
+    assert leftover == b""
+
+def test_inject_keycode():
+    streamer, peer = _streamer_with_control()
+    asyncio.run(streamer.inject_keycode(4))
+    data = peer.recv(64)
+    assert data == struct.pack(">BBiii", CONTROL_MSG_INJECT_KEYCODE, 0, 4, 0, 0) + struct.pack(">BBiii", CONTROL_MSG_INJECT_KEYCODE, 1, 4, 0, 0)
+
+def _packet(pts_flags: int, payload: bytes) -> bytes:
+    return struct.pack(">QI", pts_flags, len(payload)) + payload
+
+def test_packet_reader_reassembles_split_packets():
+    from tutan_agent.core.scrcpy import PacketReader, PACKET_FLAG_CONFIG, PACKET_FLAG_KEY_FRAME
+
+    big = bytes(range(256)) * 40  # larger than the ring below, forces growth
+    stream = (_packet(PACKET_FLAG_CONFIG, b"sps-pps")
+              + _packet(PACKET_FLAG_KEY_FRAME | 1000, b"idr")
+              + _packet(2000, big))
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        ours, theirs = socket.socketpair()
+        ours.setblocking(False)
+        theirs.setblocking(False)
+
+        async def write():
+            for i in range(0, len(stream), 500):
+                await loop.sock_sendall(theirs, stream[i:i + 500])
+                await asyncio.sleep(0)
+            theirs.close()
+
+        writer = asyncio.create_task(write())
+        reader = PacketReader(ours, capacity=64)
+        packets = [await reader.read_packet() for _ in range(3)]
+        await writer
+        return packets
+
+    config, key, delta = asyncio.run(run())
+    assert (config.config, config.pts, config.data) == (True, None, b"sps-pps")
+    assert (key.keyframe, key.pts, key.data) == (True, 1000, b"idr")
+    assert (delta.keyframe, delta.pts, delta.data) == (False, 2000, big)
@@ -0,0 +1,75 @@
+import asyncio
+from tutan_agent.core.scrcpy import VideoPacket
+from tutan_agent.core.screen_monitor import ScreenChangeMonitor
+
+def _packet(size: int, key: bool = False, config: bool = False):
+    return VideoPacket(None if config else 0, config, key, b"\0" * size)
+
+def test_change_and_stable_events():
+    async def run():
+        monitor = ScreenChangeMonitor("dev", quiet_window=0.05)
+        events = []
+        monitor.add_listener(lambda serial, state: events.append(state))
+        monitor.observe(_packet(20000, key=True))
+        await asyncio.sleep(0.1)
+        # Tiny repeat frames on a static screen are not activity
+        monitor.observe(_packet(40))
+        await asyncio.sleep(0.1)
+        monitor.observe(_packet(5000))
+        await asyncio.sleep(0.1)
+        return events, monitor.get_stats()
+
+    events, stats = asyncio.run(run())
+    assert events == ["stable", "changed", "stable"]
+    assert stats["packets"] == 3 and stats["changes"] == 1
+
+def test_periodic_keyframe_of_same_size_is_ignored():
+    async def run():
+        monitor = ScreenChangeMonitor("dev", quiet_window=0.05)
+        monitor.observe(_packet(20000, key=True))
+        first = monitor.last_change
+        await asyncio.sleep(0.01)
+        monitor.observe(_packet(20300, key=True))
+        unchanged = monitor.last_change == first
+        monitor.observe(_packet(30000, key=True))
+        return unchanged, monitor.last_change > first
+
+    assert asyncio.run(run()) == (True, True)
+
+def test_wait_stable_follows_activity():
+    async def run():
+        loop = asyncio.get_running_loop()
+        monitor = ScreenChangeMonitor("dev", quiet_window=0.05)
+        started = loop.time()
+        monitor.observe(_packet(5000))
+
+        async def animate():
+            for _ in range(5):
+                await asyncio.sleep(0.02)
+                monitor.observe(_packet(5000))
+
+        animation = asyncio.create_task(animate())
+        settled = await monitor.wait_stable(since=started, timeout=1.0)
+        await animation
+        return settled, loop.time() - started
+
+    settled, elapsed = asyncio.run(run())
+    assert settled
+    assert 0.15 <= elapsed < 0.5
+
+def test_wait_stable_times_out_and_stops_with_stream():
+    async def run():
+        monitor = ScreenChangeMonitor("dev", quiet_window=0.05)
+
+        async def animate():
+            while not monitor.closed:
+                monitor.observe(_packet(5000))
+                await asyncio.sleep(0.01)
+
+        animation = asyncio.create_task(animate())
+        timed_out = not await monitor.wait_stable(timeout=0.1)
+        monitor.close()
+        await animation
+        return timed_out, monitor.live
+
+    assert asyncio.run(run()) == (True, False)
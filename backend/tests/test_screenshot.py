@@ -0,0 +1,68 @@
+import asyncio
+import io
+import struct
+import pytest
+from PIL import Image
+from tutan_agent.core.screenshot import RawFrame, FrameCache, ScreenshotPipeline, ScreenshotFrame
+
+def _raw_screencap(width: int, height: int, dataspace: bool = True) -> bytes:
+    header = struct.pack("<III", width, height, 1) + (struct.pack("<I", 0) if dataspace else b"")
+    return header + bytes([255, 0, 0, 255]) * (width * height)
+
+@pytest.mark.parametrize("dataspace", [True, False])
+def test_raw_frame_parse(dataspace):
+    frame = RawFrame.parse(_raw_screencap(4, 3, dataspace))
+    assert (frame.width, frame.height) == (4, 3)
+    assert frame.to_image().getpixel((1, 1)) == (255, 0, 0, 255)
+
+def test_raw_frame_rejects_bad_size():
+    with pytest.raises(ValueError):
+        RawFrame.parse(_raw_screencap(4, 3)[:-5])
+
+def test_pipeline_downscales_and_caches():
+    class FakePipeline(ScreenshotPipeline):
+        async def _capture_bytes(self, png):
+            return _raw_screencap(400, 800)
+
+    cache = FrameCache(max_frames=2)
+    pipeline = FakePipeline("fake", max_side=200, image_format="JPEG", cache=cache)
+    frame = asyncio.run(pipeline.capture(step=1))
+    assert frame.size == (100, 200)
+    assert frame.source_size == (400, 800)
+    assert Image.open(io.BytesIO(frame.data)).format == "JPEG"
+    assert cache.get("fake", 1) is frame
+    assert cache.get("fake") is frame
+
+def test_pipeline_falls_back_to_png():
+    class FakePipeline(ScreenshotPipeline):
+        async def _capture_bytes(self, png):
+            if not png:
+                return b"garbage-header"
+            out = io.BytesIO()
+            Image.new("RGB", (10, 20)).save(out, format="PNG")
+            return out.getvalue()
+
+    pipeline = FakePipeline("fake", max_side=100, cache=FrameCache())
+    frame = asyncio.run(pipeline.capture())
+    assert frame.size == (10, 20)
+    assert pipeline.raw is False
+    assert pipeline.stats["raw_failures"] == 1
+
+def test_frame_cache_evicts_oldest():
+    cache = FrameCache(max_frames=2)
+    for step in range(3):
+        cache.put(ScreenshotFrame("s", step, b"", "JPEG", (1, 1), (1, 1)))
+    assert cache.get("s", 0) is None
+    assert len(cache) == 2
+
+def test_frame_cache_keeps_sessions_apart():
+    cache = FrameCache()
+    first = ScreenshotFrame("s", 1, b"a", "JPEG", (1, 1), (1, 1), session_id="task-1")
+    second = ScreenshotFrame("s", 1, b"b", "JPEG", (1, 1), (1, 1), session_id="task-2")
+    cache.put(first)
+    cache.put(second)
+    assert cache.get("s", 1, "task-1") is first
+    assert cache.get("s", 1, "task-2") is second
+    # Without a session: the latest task's step
+    assert cache.get("s", 1) is second
+    assert cache.get("s", 2, "task-1") is None
@@ -0,0 +1,111 @@
+import asyncio
+import sqlite3
+import threading
+from tutan_agent.core.session_store import SessionStore
+
+def test_writes_are_batched_and_visible_to_reads(tmp_path):
+    store = SessionStore(str(tmp_path / "s.db"))
+    store.create_session("s1", "dev", "open settings", {"model_name": "m"})
+    for step in range(1, 51):
+        store.add_step("s1", {"step": step, "action": "click", "params": {"ref_id": "e1"}})
+    store.update_session_status("s1", "completed")
+
+    steps = store.get_session_steps("s1")
+    sessions = store.get_all_sessions()
+    stats = store.get_writer_stats()
+    store.close()
+
+    assert [s["step_number"] for s in steps] == list(range(1, 51))
+    assert sessions[0]["status"] == "completed"
+    assert stats["statements"] == 52 and stats["batches"] < 52 and stats["queued"] == 0
+
+def test_wal_mode_and_shared_writer(tmp_path):
+    path = str(tmp_path / "s.db")
+    first, second = SessionStore(path), SessionStore(path)
+    with sqlite3.connect(path) as conn:
+        mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    shared = first._writer is second._writer
+    first.close()
+    assert mode == "wal" and shared
+
+def test_concurrent_writers_and_async_flush(tmp_path):
+    store = SessionStore(str(tmp_path / "s.db"))
+    store.create_session("s1", "dev", "task", {})
+
+    def write(offset):
+        for i in range(100):
+            store.add_step("s1", {"step": offset + i, "action": "wait"})
+
+    threads = [threading.Thread(target=write, args=(n * 100,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    async def run():
+        await store.flush_async()
+        return await store.get_session_steps_async("s1")
+
+    steps = asyncio.run(run())
+    store.close()
+    assert len(steps) == 400
+
+def test_bad_statement_does_not_drop_the_batch(tmp_path):
+    store = SessionStore(str(tmp_path / "s.db"))
+    store.create_session("s1", "dev", "task", {})
+    store._writer.submit("INSERT INTO missing_table VALUES (?)", (1,))
+    store.add_step("s1", {"step": 1, "action": "back"})
+
+    steps = store.get_session_steps("s1")
+    errors = store.get_writer_stats()["errors"]
+    store.close()
+    assert len(steps) == 1 and errors == 1
+
+def _seed(store):
+    for i in range(7):
+        session_id = f"s{i}"
+        serial = "a" if i % 2 else "b"
+        store._writer.submit(
+            "INSERT INTO sessions (id, device_serial, task, status, start_time, end_time) VALUES (?, ?, ?, ?, ?, ?)",
+            (session_id, serial, "t", "completed" if i < 5 else "failed", 100.0 + i, 110.0 + 2 * i)
+        )
+        for step in range(1, i + 2):
+            store.add_step(session_id, {"step": step, "action": "click", "result": "success" if step > 1 else "failed"})
+
+def test_cursor_pagination_and_filters(tmp_path):
+    store = SessionStore(str(tmp_path / "s.db"))
+    _seed(store)
+
+    pages, cursor = [], None
+    while True:
+        rows, cursor = store.list_sessions(limit=3, cursor=cursor)
+        pages.append([r["id"] for r in rows])
+        if cursor is None:
+            break
+    device_a, _ = store.list_sessions(serial="a", status="completed")
+    window, _ = store.list_sessions(since=102.0, until=104.0)
+    steps = store.get_session_steps("s6", after_step=2, limit=3)
+    plan = store._read_conn().execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM steps WHERE session_id = ? ORDER BY step_number", ("s1",)
+    ).fetchall()
+    store.close()
+
+    assert pages == [["s6", "s5", "s4"], ["s3", "s2", "s1"], ["s0"]]
+    assert [r["id"] for r in device_a] == ["s3", "s1"]
+    assert [r["id"] for r in window] == ["s3", "s2"]
+    assert [s["step_number"] for s in steps] == [3, 4, 5]
+    assert "idx_steps_session" in " ".join(str(tuple(row)) for row in plan)
+
+def test_session_stats_aggregates(tmp_path):
+    store = SessionStore(str(tmp_path / "s.db"))
+    _seed(store)
+    stats = store.get_session_stats()
+    device_b = store.get_session_stats(serial="b")
+    store.close()
+
+    assert stats["total"] == 7
+    assert stats["by_status"]["completed"]["count"] == 5
+    assert stats["by_status"]["failed"]["avg_duration"] == 15.5
+    assert stats["by_device"]["a"]["count"] == 3
+    assert stats["steps"] == 28 and stats["failed_steps"] == 7
+    assert device_b["total"] == 4
@@ -0,0 +1,67 @@
+import asyncio
+from tutan_agent.core.settle_detector import SettleDetector, SettleHistogram
+
+class FakeController:
+    serial = "fake"
+
+    def __init__(self, changes: int):
+        self.changes = changes
+        self.polls = 0
+
+    async def get_aria_tree_raw(self):
+        self.polls += 1
+        if self.polls <= self.changes:
+            return f"tree-{self.polls}".encode()
+        return b"tree-final"
+
+    async def get_screenshot(self):
+        return None
+
+class BlindController:
+    serial = "blind"
+
+    async def get_aria_tree_raw(self):
+        return None
+
+    async def get_screenshot(self):
+        return None
+
+def test_settles_after_quiet_window():
+    detector = SettleDetector(FakeController(changes=3), quiet_window=0.05, poll_interval=0.01, timeout=2.0)
+    elapsed = asyncio.run(detector.wait("click"))
+    assert elapsed < 1.0
+    stats = detector.get_stats()
+    assert stats["click"]["count"] == 1
+    assert stats["click"]["timeouts"] == 0
+
+def test_times_out_on_constantly_changing_ui():
+    detector = SettleDetector(FakeController(changes=10**6), quiet_window=0.05, poll_interval=0.01, timeout=0.1)
+    elapsed = asyncio.run(detector.wait("scroll"))
+    assert elapsed >= 0.1
+    assert detector.get_stats()["scroll"]["timeouts"] == 1
+
+def test_fixed_delay_without_change_signal():
+    detector = SettleDetector(BlindController(), fallback_delay=0.05)
+    elapsed = asyncio.run(detector.wait("back"))
+    assert elapsed >= 0.05
+
+def test_histogram_buckets():
+    hist = SettleHistogram()
+    hist.observe(0.2)
+    hist.observe(10.0, timed_out=True)
+    data = hist.to_dict()
+    assert data["buckets"]["le_0.25"] == 1
+    assert data["buckets"]["le_inf"] == 1
+    assert data["count"] == 2
+    assert data["timeouts"] == 1
+
+def test_settles_on_screen_monitor():
+    from tutan_agent.core.screen_monitor import ScreenChangeMonitor
+
+    controller = FakeController(changes=10**6)
+    controller.screen_monitor = ScreenChangeMonitor("fake", quiet_window=0.05)
+    detector = SettleDetector(controller, timeout=1.0)
+    elapsed = asyncio.run(detector.wait("click"))
+    assert 0.05 <= elapsed < 0.5
+    assert controller.polls == 0
+    assert detector.get_stats()["click"]["timeouts"] == 0
@@ -0,0 +1,154 @@
+import asyncio
+import pytest
+from tutan_agent.core.scrcpy import VideoPacket
+from tutan_agent.core.stream_hub import StreamHub
+from tutan_agent.shard.ipc import IPCChannel, IPCError
+from tutan_agent.shard.router import ShardRouter
+from tutan_agent.shard.worker import RelayHub, ChannelEmitter
+
+async def _channel_pair():
+    accepted = asyncio.get_running_loop().create_future()
+
+    async def on_connect(reader, writer):
+        accepted.set_result(IPCChannel(reader, writer, "server"))
+
+    server = await asyncio.start_server(on_connect, "127.0.0.1", 0)
+    reader, writer = await asyncio.open_connection("127.0.0.1", server.sockets[0].getsockname()[1])
+    client = IPCChannel(reader, writer, "client")
+    return server, client, await accepted
+
+def test_ipc_calls_notifications_and_payloads():
+    async def run():
+        server, client, remote = await _channel_pair()
+        received = []
+
+        async def echo(params, payload):
+            return {"n": params["n"] + 1}, payload[::-1]
+
+        async def fail(params, payload):
+            raise ValueError("boom")
+
+        async def record(params, payload):
+            received.append((params["i"], payload))
+
+        remote.on("echo", echo)
+        remote.on("fail", fail)
+        remote.on("record", record)
+        for channel in (client, remote):
+            channel.start()
+
+        result = await client.call("echo", {"n": 1}, b"abc")
+        with pytest.raises(IPCError, match="boom"):
+            await client.call("fail")
+        for i in range(3):
+            await client.notify("record", {"i": i}, bytes([i]))
+        await asyncio.sleep(0.05)
+
+        await remote.close()
+        await client.closed.wait()
+        with pytest.raises(ConnectionResetError):
+            await client.call("echo", {"n": 1})
+        server.close()
+        return result, received
+
+    result, received = asyncio.run(run())
+    assert result == ({"n": 2}, b"cba")
+    assert received == [(0, b"\x00"), (1, b"\x01"), (2, b"\x02")]
+
+def test_relay_hub_forwards_video_to_front_hub():
+    class FakeSio:
+        def __init__(self):
+            self.sent = []
+
+        async def emit(self, event, data, to=None):
+            self.sent.append(data["data"])
+
+    async def run():
+        server, worker_side, front_side = await _channel_pair()
+        sio = FakeSio()
+        front_hub = StreamHub(sio)
+
+        async def emit(params, payload):
+            data = params["data"]
+            front_hub.publish(data["serial"], VideoPacket(data["pts"], data["config"], data["keyframe"], payload))
+
+        front_side.on("emit", emit)
+        for channel in (worker_side, front_side):
+            channel.start()
+        front_hub.subscribe("viewer", "dev")
+
+        relay = RelayHub(ChannelEmitter(worker_side))
+        relay.publish("dev", VideoPacket(None, True, False, b"cfg"))
+        relay.publish("dev", VideoPacket(1, False, True, b"key"))
+        await asyncio.sleep(0.05)
+        front_hub.unsubscribe("viewer")
+        relay.clear("dev")
+        await worker_side.close()
+        server.close()
+        return sio.sent
+
+    assert asyncio.run(run()) == [b"cfg", b"key"]
+
+def test_router_spawns_and_routes_to_workers():
+    async def emit(event, data):
+        pass
+
+    async def run():
+        router = ShardRouter(2, StreamHub(None), emit)
+        await router.start()
+        try:
+            first, second = router.shard_for("a"), router.shard_for("b")
+            stats = await router.screen_stats()
+            has_agent = await router.has_agent("a")
+            shot = await router.screenshot("a", step=3)
+            pids = router.get_stats()["pids"]
+        finally:
+            await router.close()
+        return first, second, stats, has_agent, shot, pids
+
+    first, second, stats, has_agent, shot, pids = asyncio.run(run())
+    assert {first, second} == {0, 1}
+    assert stats == {} and has_agent is False and shot is None
+    assert len(set(pids.values())) == 2
+
+def test_cancelled_llm_acquire_does_not_leak_slot():
+    from tutan_agent.shard.worker import RemoteLLMSlots
+
+    async def emit(event, data):
+        pass
+
+    async def run():
+        router = ShardRouter(1, StreamHub(None), emit)
+        router._ready[0] = asyncio.Event()
+        server = await asyncio.start_server(router._on_connect, "127.0.0.1", 0)
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.sockets[0].getsockname()[1])
+        worker = IPCChannel(reader, writer, "shard-0")
+        worker.start()
+        await worker.call("hello", {"shard": 0, "token": router.token})
+
+        semaphore = asyncio.Semaphore(1)
+        router._agents["a"] = type("Agent", (), {"planner": type("Planner", (), {"llm_slots": semaphore})})()
+        slots = RemoteLLMSlots(worker, "a")
+
+        async def plan():
+            async with slots:
+                await asyncio.sleep(0.01)
+
+        await semaphore.acquire()  # another planner holds the only slot
+        waiting = asyncio.create_task(plan())
+        await asyncio.sleep(0.05)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        semaphore.release()
+        await asyncio.sleep(0.05)
+        in_flight_after_cancel = 1 - semaphore._value
+
+        await asyncio.wait_for(plan(), 2)
+        await asyncio.sleep(0.05)
+        in_flight = 1 - semaphore._value
+        held = router.get_stats()["llm_slots_held"]
+        await worker.close()
+        server.close()
+        return in_flight_after_cancel, in_flight, held
+
+    assert asyncio.run(run()) == (0, 0, {0: 0})
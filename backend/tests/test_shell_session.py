@@ -0,0 +1,78 @@
+import asyncio
+import os
+import stat
+from tutan_agent.adb.shell_session import ADBShellSession
+
+def _fake_adb(tmp_path) -> str:
+    # Stands in for `adb -s <serial> shell`: ignores its arguments and runs a local sh
+    script = tmp_path / "adb"
+    script.write_text("#!/bin/sh\nexec sh\n")
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    return str(script)
+
+def test_commands_share_one_shell(tmp_path):
+    async def run():
+        session = ADBShellSession("fake", adb_path=_fake_adb(tmp_path))
+        first = await session.run("echo hello")
+        second = await session.run("echo $$; exit_code() { return 3; }; exit_code")
+        pid = session.process.pid
+        third = await session.run("echo again")
+        same_process = session.process.pid == pid
+        await session.close()
+        return first, second, third, same_process
+
+    first, second, third, same_process = asyncio.run(run())
+    assert first == (0, "hello\n")
+    assert second[0] == 3
+    assert third == (0, "again\n")
+    assert same_process
+
+def test_reconnects_after_shell_dies(tmp_path):
+    async def run():
+        session = ADBShellSession("fake", adb_path=_fake_adb(tmp_path))
+        await session.run("true")
+        session.process.kill()
+        await session.process.wait()
+        result = await session.run("echo back")
+        await session.close()
+        return result, session.restarts
+
+    result, restarts = asyncio.run(run())
+    assert result == (0, "back\n")
+    assert restarts in (0, 1)
+
+def test_timeout_resets_session(tmp_path):
+    async def run():
+        session = ADBShellSession("fake", adb_path=_fake_adb(tmp_path))
+        timed_out = await session.run("sleep 1", timeout=0.2)
+        after = await session.run("echo ok")
+        await session.close()
+        return timed_out, after
+
+    timed_out, after = asyncio.run(run())
+    assert timed_out == (-1, "timeout")
+    assert after == (0, "ok\n")
+
+def test_output_without_trailing_newline(tmp_path):
+    async def run():
+        session = ADBShellSession("fake", adb_path=_fake_adb(tmp_path))
+        results = [await session.run("printf abc", timeout=2), await session.run("echo next", timeout=2)]
+        await session.close()
+        return results
+
+    assert asyncio.run(run()) == [(0, "abc"), (0, "next\n")]
+
+def test_cancelled_command_does_not_shift_results(tmp_path):
+    async def run():
+        session = ADBShellSession("fake", adb_path=_fake_adb(tmp_path))
+        pending = asyncio.create_task(session.run("sleep 0.3; echo late"))
+        await asyncio.sleep(0.1)
+        pending.cancel()
+        await asyncio.gather(pending, return_exceptions=True)
+        result = await session.run("echo ok")
+        await asyncio.sleep(0.3)
+        after = await session.run("echo again")
+        await session.close()
+        return result, after
+
+    assert asyncio.run(run()) == ((0, "ok\n"), (0, "again\n"))
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import httpx
+from tutan_agent.agents.planner import TutanPlanner
+from tutan_agent.agents.speculation import Speculator, predict_next_context
+
+SCREEN = '[e1] EditText text="" [clickable] [editable]\n[e2] Button text="Send" [clickable]'
+
+def test_predicts_typing_and_focus_only():
+    typed = predict_next_context(SCREEN, "type", {"ref_id": "e1", "text": "hi"})
+    assert typed.splitlines()[0] == '[e1] EditText text="hi" [clickable] [editable]'
+    assert predict_next_context('[e1] EditText [editable]', "type", {"ref_id": "e1", "text": "a"}) == \
+        '[e1] EditText text="a" [editable]'
+    assert predict_next_context(SCREEN, "click", {"ref_id": "e1"}) == SCREEN
+    assert predict_next_context(SCREEN, "wait", {}) == SCREEN
+    # Navigation is not predictable
+    assert predict_next_context(SCREEN, "click", {"ref_id": "e2"}) is None
+    assert predict_next_context(SCREEN, "scroll", {"direction": "down"}) is None
+
+def make_speculator(calls):
+    def handler(request):
+        calls.append(json.loads(request.content))
+        plan = {"thinking": "send it", "action": "click", "params": {"ref_id": "e2"}}
+        return httpx.Response(200, json={"choices": [{"message": {"content": json.dumps(plan)}}]})
+    planner = TutanPlanner("key", "http://llm", "model")
+    planner.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return Speculator(planner)
+
+def test_speculative_plan_used_when_screen_matches():
+    calls = []
+    async def run():
+        speculator = make_speculator(calls)
+        history = [{"role": "assistant", "content": "Action: type"}, {"role": "user", "content": "Action result: Success"}]
+        assert speculator.launch("send hi", SCREEN, "type", {"ref_id": "e1", "text": "hi"}, history)
+        actual = SCREEN.replace('text=""', 'text="hi"')
+        plan = await speculator.take(actual)
+        await speculator.planner.close()
+        return speculator, plan
+
+    speculator, plan = asyncio.run(run())
+    assert plan["params"] == {"ref_id": "e2"}
+    assert 'text=\\"hi\\"' in json.dumps(calls[0]["messages"][-1]["content"])
+    assert speculator.stats["hits"] == 1
+
+def test_speculative_plan_discarded_on_other_screen():
+    calls = []
+    async def run():
+        speculator = make_speculator(calls)
+        speculator.launch("send hi", SCREEN, "type", {"ref_id": "e1", "text": "hi"}, [])
+        plan = await speculator.take('[e1] TextView text="Sent"')
+        await speculator.planner.close()
+        return speculator, plan
+
+    speculator, plan = asyncio.run(run())
+    assert plan is None
+    assert speculator.stats["misses"] == 1
+
+def test_agent_launches_speculation_after_wait(tmp_path):
+    from tutan_agent.agents.base import TutanAgent
+    from tutan_agent.agents.model_router import RouteDecision
+    from tutan_agent.core.perception import PerceptionPipeline
+    from tutan_agent.core.session_store import SessionStore
+
+    class Controller:
+        serial = "fake"
+        screenshots = type("Screenshots", (), {"session_id": None})()
+        async def get_ui_context(self):
+            return SCREEN, "accessibility"
+        async def get_screenshot(self, step=None):
+            return None
+        def get_current_nodes(self):
+            return {}
+        def get_current_lines(self):
+            return {}
+        async def execute_action(self, action, params):
+            # Like DeviceController: wait/scroll/finish are not reported as performed
+            return action in ("click", "type")
+
+    class Router:
+        plans = [("wait", {}), ("click", {"ref_id": "e2"}), ("finish", {})]
+        async def plan_next_step(self, task, snapshot, history, ui_delta=None):
+            action, params = self.plans.pop(0)
+            return RouteDecision({"action": action, "params": params}, "large", None)
+        async def close(self):
+            pass
+
+    async def run():
+        agent = TutanAgent("fake", {"speculative": "1"})
+        agent.controller = Controller()
+        agent.perception = PerceptionPipeline(agent.controller)
+        agent.store = SessionStore(str(tmp_path / "sessions.db"))
+        agent.router = Router()
+        launched = []
+        agent.speculator.launch = lambda task, ui_context, action, *args: launched.append(action)
+        async def settled(action, started=None):
+            pass
+        agent.settle_detector.wait = settled
+        async for _ in agent.stream_task("task"):
+            pass
+        await agent.speculator.planner.close()
+        return launched
+
+    assert asyncio.run(run()) == ["wait", "click"]
@@ -0,0 +1,106 @@
+import asyncio
+from tutan_agent.core.scrcpy import VideoPacket
+from tutan_agent.core.stream_hub import StreamHub
+
+class FakeSio:
+    """
+    Mirrors python-socketio: emit only appends the packets (header + binary attachment)
+    to the viewer's engine.io queue and returns; the client drains that queue.
+    """
+    def __init__(self, drain_delay: float = 0.0):
+        self.drain_delay = drain_delay
+        self.sent = {}
+        self.max_backlog_seen = 0
+        self.manager = self
+        self.eio = self
+        self.sockets = {}
+
+    def eio_sid_from_sid(self, sid, namespace):
+        return sid
+
+    async def _drain(self, queue):
+        while True:
+            await queue.get()
+            await asyncio.sleep(self.drain_delay)
+
+    async def emit(self, event, data, to=None):
+        if to not in self.sockets:
+            socket = self.sockets[to] = type("Socket", (), {"queue": asyncio.Queue()})()
+            socket.drainer = asyncio.create_task(self._drain(socket.queue))
+        queue = self.sockets[to].queue
+        queue.put_nowait(b"451-")
+        queue.put_nowait(data["data"])
+        self.max_backlog_seen = max(self.max_backlog_seen, queue.qsize())
+        self.sent.setdefault(to, []).append(data["data"])
+
+def _config():
+    return VideoPacket(None, True, False, b"cfg")
+
+def _frame(n: int, key: bool = False):
+    return VideoPacket(n, False, key, f"{'K' if key else 'P'}{n}".encode())
+
+def test_new_viewer_gets_config_and_gop():
+    async def run():
+        sio = FakeSio()
+        hub = StreamHub(sio)
+        hub.publish("dev", _config())
+        hub.publish("dev", _frame(1, key=True))
+        hub.publish("dev", _frame(2))
+        hub.subscribe("late", "dev")
+        hub.publish("dev", _frame(3))
+        await asyncio.sleep(0.01)
+        hub.unsubscribe("late")
+        return sio.sent["late"]
+
+    assert asyncio.run(run()) == [b"cfg", b"K1", b"P2", b"P3"]
+
+def test_viewer_without_keyframe_waits_for_one():
+    async def run():
+        sio = FakeSio()
+        hub = StreamHub(sio)
+        hub.subscribe("v", "dev")
+        hub.publish("dev", _frame(1))
+        hub.publish("dev", _frame(2, key=True))
+        await asyncio.sleep(0.01)
+        hub.unsubscribe("v")
+        return sio.sent["v"]
+
+    assert asyncio.run(run()) == [b"K2"]
+
+def test_slow_viewer_drops_delta_frames_only():
+    async def run():
+        slow_sio = FakeSio(drain_delay=0.01)
+        hub = StreamHub(slow_sio, max_queue=3)
+        hub.publish("dev", _frame(0, key=True))
+        subscriber = hub.subscribe("slow", "dev")
+        for n in range(1, 10):
+            hub.publish("dev", _frame(n))
+        hub.publish("dev", _frame(10, key=True))
+        hub.publish("dev", _frame(11))
+        await asyncio.sleep(0.2)
+        hub.unsubscribe("slow", "dev")
+        return slow_sio.sent["slow"], subscriber.dropped
+
+    sent, dropped = asyncio.run(run())
+    # The queue filled up with K0,P1,P2; P3..P9 are dropped and the queued
+    # frames become obsolete once K10 arrives
+    assert sent == [b"K10", b"P11"]
+    assert dropped == 10
+
+def test_slow_client_backlog_triggers_drops():
+    async def run():
+        sio = FakeSio(drain_delay=0.01)
+        hub = StreamHub(sio, max_queue=3, max_backlog=4)
+        hub.publish("dev", _frame(0, key=True))
+        subscriber = hub.subscribe("slow", "dev")
+        for n in range(1, 40):
+            await asyncio.sleep(0.002)
+            hub.publish("dev", _frame(n, key=n % 20 == 0))
+        await asyncio.sleep(0.1)
+        hub.unsubscribe("slow", "dev")
+        return sio, subscriber
+
+    sio, subscriber = asyncio.run(run())
+    assert subscriber.dropped > 0
+    assert sio.max_backlog_seen <= 4 + 2
+    assert b"K20" in sio.sent["slow"]
@@ -0,0 +1,203 @@
+import asyncio
+import os
+import struct
+from typing import List, Optional, Set, Tuple, Union, AsyncIterator
+from loguru import logger
+
+
+class ADBProtocolError(Exception):
+    """The adb server answered FAIL or broke the smart-socket protocol."""
+
+
+class ADBServiceError(ADBProtocolError):
+    """The device transport was selected but the service itself was refused."""
+
+
+class ADBClient:
+    """
+    Pure-Python client for the adb server's smart-socket protocol (localhost:5037).
+    Talks to the server directly instead of spawning an `adb` process per command.
+
+    A smart socket is bound to the single service it opens, so each command uses its
+    own (cheap, local) TCP connection; long-lived services such as track-devices keep
+    theirs open.
+    """
+    SHELL_V2_STDOUT = 1
+    SHELL_V2_STDERR = 2
+    SHELL_V2_EXIT = 3
+
+    def __init__(self, host: str = "127.0.0.1", port: Optional[int] = None):
+        self.host = host
+        self.port = port or int(os.environ.get("ANDROID_ADB_SERVER_PORT", "5037"))
+        # Devices whose adbd rejected the shell v2 service (e.g. pre-N Android)
+        self._legacy_shell: Set[str] = set()
+
+    # --- Low-level protocol ---
+
+    async def _connect(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        return await asyncio.open_connection(self.host, self.port)
+
+    @staticmethod
+    async def _send(writer: asyncio.StreamWriter, request: str):
+        payload = request.encode("utf-8")
+        writer.write(b"%04x" % len(payload) + payload)
+        await writer.drain()
+
+    @staticmethod
+    async def _read_length_prefixed(reader: asyncio.StreamReader) -> bytes:
+        length = int(await reader.readexactly(4), 16)
+        return await reader.readexactly(length)
+
+    async def _read_status(self, reader: asyncio.StreamReader):
+        status = await reader.readexactly(4)
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            message = await self._read_length_prefixed(reader)
+            raise ADBProtocolError(message.decode("utf-8", errors="ignore"))
+        raise ADBProtocolError(f"Unexpected adb server status: {status!r}")
+
+    async def _request(self, request: str) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        reader, writer = await self._connect()
+        try:
+            await self._send(writer, request)
+            await self._read_status(reader)
+        except Exception:
+            writer.close()
+            raise
+        return reader, writer
+
+    async def _open_service(self, serial: str, service: str) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """Switch a new connection to the device transport and open `service` on it."""
+        reader, writer = await self._request(f"host:transport:{serial}")
+        try:
+            await self._send(writer, service)
+            await self._read_status(reader)
+        except ADBProtocolError as e:
+            writer.close()
+            raise ADBServiceError(str(e)) from e
+        except Exception:
+            writer.close()
+            raise
+        return reader, writer
+
+    # --- Services ---
+
+    async def host_command(self, command: str) -> str:
+        """Run a host service that answers with one length-prefixed payload (e.g. host:version)."""
+        reader, writer = await self._request(command)
+        try:
+            return (await self._read_length_prefixed(reader)).decode("utf-8", errors="ignore")
+        finally:
+            writer.close()
+
+    async def devices(self, long: bool = True) -> str:
+        return await self.host_command("host:devices-l" if long else "host:devices")
+
+    async def forward(self, serial: str, local: str, remote: str):
+        reader, writer = await self._request(f"host-serial:{serial}:forward:{local};{remote}")
+        try:
+            # A second OKAY follows once the forward is actually installed
+            await self._read_status(reader)
+        finally:
+            writer.close()
+
+    async def exec_out(self, serial: str, command: str) -> bytes:
+        """Raw binary-safe output of `exec:` (used for screencap)."""
+        reader, writer = await self._open_service(serial, f"exec:{command}")
+        try:
+            return await reader.read()
+        finally:
+            writer.close()
+
+    async def shell(self, serial: str, command: str) -> Tuple[int, bytes, bytes]:
+        """
+        Run a shell command; returns (exit code, stdout, stderr).
+        Uses the shell v2 protocol for exit codes and falls back to legacy `shell:` on
+        devices that refuse it. Transport errors (offline/unknown serial) are raised.
+        """
+        if serial not in self._legacy_shell:
+            try:
+                reader, writer = await self._open_service(serial, f"shell,v2,raw:{command}")
+            except ADBServiceError:
+                logger.debug(f"{serial} rejected shell v2, using legacy shell protocol")
+                self._legacy_shell.add(serial)
+            else:
+                try:
+                    return await self._read_shell_v2(reader)
+                finally:
+                    writer.close()
+
+        reader, writer = await self._open_service(serial, f"shell:{command}")
+        try:
+            return 0, await reader.read(), b""
+        finally:
+            writer.close()
+
+    async def _read_shell_v2(self, reader: asyncio.StreamReader) -> Tuple[int, bytes, bytes]:
+        stdout, stderr = bytearray(), bytearray()
+        exit_code = 0
+        while True:
+            try:
+                header = await reader.readexactly(5)
+            except asyncio.IncompleteReadError:
+                break
+            packet_id, length = struct.unpack("<BI", header)
+            data = await reader.readexactly(length)
+            if packet_id == self.SHELL_V2_STDOUT:
+                stdout += data
+            elif packet_id == self.SHELL_V2_STDERR:
+                stderr += data
+            elif packet_id == self.SHELL_V2_EXIT:
+                exit_code = data[0] if data else 0
+                break
+        return exit_code, bytes(stdout), bytes(stderr)
+
+    async def track_devices(self, long: bool = True) -> AsyncIterator[str]:
+        """Yield the full device list every time the adb server reports a change."""
+        reader, writer = await self._request("host:track-devices-l" if long else "host:track-devices")
+        try:
+            while True:
+                yield (await self._read_length_prefixed(reader)).decode("utf-8", errors="ignore")
+        finally:
+            writer.close()
+
+    # --- `adb` CLI argument compatibility (drop-in for ADBManager._execute) ---
+
+    @staticmethod
+    def _split_serial(args: List[str]) -> Tuple[Optional[str], List[str]]:
+        if len(args) >= 2 and args[0] == "-s":
+            return args[1], args[2:]
+        return None, args
+
+    @classmethod
+    def supports(cls, args: List[str]) -> bool:
+        """Whether `args` (adb CLI arguments) can be served natively."""
+        serial, rest = cls._split_serial(args)
+        if rest == ["devices", "-l"] or rest == ["devices"]:
+            return True
+        if serial is None or not rest:
+            return False
+        if rest[0] in ("shell", "exec-out"):
+            return len(rest) > 1
+        return rest[0] == "forward" and len(rest) == 3 and not rest[1].startswith("-")
+
+    async def run(self, args: List[str], binary: bool = False) -> Tuple[int, Union[str, bytes], str]:
+        """Execute adb CLI-style arguments; returns (returncode, stdout, stderr) like the CLI."""
+        serial, rest = self._split_serial(args)
+        try:
+            if rest[0] == "devices":
+                listing = await self.devices(long="-l" in rest)
+                stdout = "List of devices attached\n" + listing
+                return 0, stdout.encode("utf-8") if binary else stdout, ""
+            if rest[0] == "forward":
+                await self.forward(serial, rest[1], rest[2])
+                return 0, b"" if binary else "", ""
+            command = " ".join(rest[1:])
+            if rest[0] == "exec-out":
+                out = await self.exec_out(serial, command)
+                return 0, out if binary else out.decode("utf-8", errors="ignore"), ""
+            code, out, err = await self.shell(serial, command)
+            return code, out if binary else out.decode("utf-8", errors="ignore"), err.decode("utf-8", errors="ignore")
+        except ADBProtocolError as e:
+            return 1, b"" if binary else "", str(e)
@@ -1,11 +1,15 @@
 import subprocess
+import asyncio
 import time
 import threading
 import os
 import re
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional, Tuple, Union, Any, Callable, Awaitable
 from loguru import logger
 
+from tutan_agent.adb.client import ADBClient
+from tutan_agent.adb.shell_session import ADBShellSession
+
 class ADBDevice:
     def __init__(self, serial: str, status: str, model: Optional[str] = None):
         self.serial = serial
@@ -36,9 +40,23 @@ class ADBManager:
         self._cache_lock = threading.Lock()
         self._cache_ttl = 5.0  # 5 seconds cache
         self._last_scan = 0
+
+        # Async execution: per-device concurrency limits and queue metrics
+        self.max_concurrency_per_device = int(os.environ.get("ADB_MAX_CONCURRENCY_PER_DEVICE", "2"))
+        self._device_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._exec_stats: Dict[str, Dict[str, float]] = {}
+
+        # "native" talks to the adb server socket directly instead of spawning adb processes
+        self.backend = os.environ.get("ADB_BACKEND", "subprocess")
+        self._native_client: Optional[ADBClient] = ADBClient() if self.backend == "native" else None
+
+        # One long-lived `adb shell` per device for input injection
+        self.persistent_shell = os.environ.get("ADB_PERSISTENT_SHELL", "1") == "1"
+        self._shell_sessions: Dict[str, ADBShellSession] = {}
         
         # Start background monitor
         self._stop_monitor = threading.Event()
+        self._tracking_active = False
         self._monitor_thread = threading.Thread(target=self._monitor_loop, daemon=True)
         self._monitor_thread.start()
         
@@ -73,6 +91,15 @@ class ADBManager:
 
     def _execute(self, args: List[str], timeout: int = 10) -> Tuple[int, str, str]:
         """Execute an ADB command with timeout."""
+        if self._native_client is not None and ADBClient.supports(args):
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                try:
+                    return asyncio.run(asyncio.wait_for(self._native_client.run(args), timeout=timeout))
+                except (OSError, asyncio.TimeoutError) as e:
+                    logger.warning(f"Native adb client failed ({e!r}), falling back to adb process")
+
         cmd = [self.adb_path] + args
         try:
             result = subprocess.run(
@@ -91,10 +118,107 @@ class ADBManager:
             logger.error(f"ADB execution error: {e}")
             return -1, "", str(e)
 
+    @staticmethod
+    def _serial_from_args(args: List[str]) -> Optional[str]:
+        if len(args) >= 2 and args[0] == "-s":
+            return args[1]
+        return None
+
+    async def execute_async(self, args: List[str], timeout: float = 10, serial: Optional[str] = None,
+                            binary: bool = False) -> Tuple[int, Union[str, bytes], str]:
+        """
+        Execute an ADB command without blocking the event loop.
+        Commands for the same device share a semaphore (`max_concurrency_per_device`),
+        so one slow `adb shell` only queues work for its own device.
+        """
+        key = serial or self._serial_from_args(args) or "host"
+        semaphore = self._device_semaphores.get(key)
+        if semaphore is None:
+            semaphore = self._device_semaphores[key] = asyncio.Semaphore(self.max_concurrency_per_device)
+        stats = self._exec_stats.setdefault(key, {
+            "queued": 0, "running": 0, "completed": 0, "timeouts": 0, "errors": 0, "total_time": 0.0
+        })
+
+        cmd = [self.adb_path] + args
+        stats["queued"] += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            stats["queued"] -= 1
+
+        stats["running"] += 1
+        started = time.monotonic()
+        process = None
+        try:
+            if self._native_client is not None and ADBClient.supports(args):
+                try:
+                    return await asyncio.wait_for(self._native_client.run(args, binary=binary), timeout=timeout)
+                except OSError as e:
+                    logger.warning(f"Native adb client failed ({e!r}), falling back to adb process")
+
+            process = await asyncio.create_subprocess_exec(
+                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+            if not binary:
+                stdout = stdout.decode("utf-8", errors="ignore")
+            return process.returncode, stdout, stderr.decode("utf-8", errors="ignore")
+        except asyncio.TimeoutError:
+            stats["timeouts"] += 1
+            logger.error(f"ADB command timeout: {' '.join(cmd)}")
+            if process and process.returncode is None:
+                process.kill()
+                await process.wait()
+            return -1, b"" if binary else "", "timeout"
+        except Exception as e:
+            stats["errors"] += 1
+            logger.error(f"ADB execution error: {e}")
+            return -1, b"" if binary else "", str(e)
+        finally:
+            stats["running"] -= 1
+            stats["completed"] += 1
+            stats["total_time"] += time.monotonic() - started
+            semaphore.release()
+
+    async def run_shell(self, serial: str, command: str, timeout: float = 10) -> Tuple[int, str]:
+        """
+        Run a device shell command, reusing the device's persistent shell when enabled.
+        Returns (exit status, output).
+        """
+        if self.persistent_shell:
+            session = self._shell_sessions.get(serial)
+            if session is None:
+                session = self._shell_sessions[serial] = ADBShellSession(serial, self.adb_path)
+            try:
+                return await session.run(command, timeout=timeout)
+            except Exception as e:
+                logger.warning(f"Persistent shell unavailable for {serial} ({e!r}), using one-shot adb shell")
+
+        code, stdout, stderr = await self.execute_async(["-s", serial, "shell", command], timeout=timeout)
+        return code, stdout or stderr
+
+    async def close_shell_sessions(self):
+        for session in self._shell_sessions.values():
+            await session.close()
+        self._shell_sessions = {}
+
+    def get_exec_metrics(self) -> Dict[str, Any]:
+        """Per-device queue depth, in-flight commands and latency of `execute_async`."""
+        return {
+            key: {
+                "queue_depth": int(stats["queued"]),
+                "in_flight": int(stats["running"]),
+                "completed": int(stats["completed"]),
+                "timeouts": int(stats["timeouts"]),
+                "errors": int(stats["errors"]),
+                "avg_latency": round(stats["total_time"] / stats["completed"], 4) if stats["completed"] else 0.0
+            } for key, stats in self._exec_stats.items()
+        }
+
     def scan_devices(self, force: bool = False) -> List[ADBDevice]:
-        """Scan for connected devices with caching."""
+        """Scan for connected devices with caching (served from memory while tracking is active)."""
         now = time.time()
-        if not force and (now - self._last_scan < self._cache_ttl):
+        if not force and (self._tracking_active or now - self._last_scan < self._cache_ttl):
             with self._cache_lock:
                 return list(self._devices.values())
 
@@ -103,9 +227,16 @@ class ADBManager:
             logger.error(f"Failed to list devices: {stderr}")
             return []
 
-        new_devices = {}
         lines = stdout.strip().split('\n')
-        for line in lines[1:]:  # Skip header
+        self._apply_device_list(self._parse_device_list(lines[1:]))  # Skip header
+        with self._cache_lock:
+            return list(self._devices.values())
+
+    @staticmethod
+    def _parse_device_list(lines: List[str]) -> Dict[str, ADBDevice]:
+        """Parse `devices -l` / `track-devices-l` lines into devices keyed by serial."""
+        new_devices = {}
+        for line in lines:
             if not line.strip():
                 continue
             
@@ -121,11 +252,54 @@ class ADBManager:
                     model = model_match.group(1)
                 
                 new_devices[serial] = ADBDevice(serial, status, model)
+        return new_devices
 
+    def _apply_device_list(self, new_devices: Dict[str, ADBDevice]) -> List[Dict[str, Any]]:
+        """Replace the device cache and return connect/disconnect/state-change events."""
+        events = []
         with self._cache_lock:
+            for serial, device in new_devices.items():
+                old = self._devices.get(serial)
+                if old is None:
+                    events.append({"event": "connected", "serial": serial, "status": device.status, "model": device.model})
+                elif old.status != device.status:
+                    events.append({"event": "state_changed", "serial": serial, "status": device.status,
+                                   "previous_status": old.status, "model": device.model})
+            for serial, old in self._devices.items():
+                if serial not in new_devices:
+                    events.append({"event": "disconnected", "serial": serial, "status": "disconnected", "model": old.model})
             self._devices = new_devices
-            self._last_scan = now
-            return list(self._devices.values())
+            self._last_scan = time.time()
+        return events
+
+    async def track_devices(self, on_event: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None):
+        """
+        Keep the device cache current from the adb server's `host:track-devices-l` stream.
+        Every change is applied immediately and passed to `on_event`. While the stream is
+        up, polling is paused; on failure it reconnects with backoff and polling resumes.
+        """
+        client = self._native_client or ADBClient()
+        backoff = 1.0
+        while not self._stop_monitor.is_set():
+            try:
+                async for listing in client.track_devices():
+                    if not self._tracking_active:
+                        logger.info("ADB device tracking active")
+                        self._tracking_active = True
+                    backoff = 1.0
+                    events = self._apply_device_list(self._parse_device_list(listing.split("\n")))
+                    for event in events:
+                        logger.info(f"Device {event['serial']} {event['event']} ({event['status']})")
+                        if on_event:
+                            await on_event(event)
+            except asyncio.CancelledError:
+                self._tracking_active = False
+                raise
+            except Exception as e:
+                logger.warning(f"ADB device tracking interrupted: {e!r}")
+            self._tracking_active = False
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
 
     def connect_wireless(self, address: str) -> Tuple[bool, str]:
         """Connect to a device via WiFi."""
@@ -157,7 +331,8 @@ class ADBManager:
         """Background thread to keep device list fresh."""
         while not self._stop_monitor.is_set():
             try:
-                self.scan_devices(force=True)
+                if not self._tracking_active:
+                    self.scan_devices(force=True)
             except Exception as e:
                 logger.error(f"ADB monitor error: {e}")
             time.sleep(10)
@@ -0,0 +1,82 @@
+import asyncio
+import uuid
+from typing import Optional, Tuple
+from loguru import logger
+
+
+class ADBShellSession:
+    """
+    Long-lived `adb shell` for one device.
+    Commands are written to the shell's stdin one at a time and delimited by an end
+    marker line carrying a per-command nonce and the exit status, so no adb client or
+    device shell is spawned per command. The session restarts itself if the shell dies
+    and is torn down when a command times out or is cancelled mid-read.
+    """
+    def __init__(self, serial: str, adb_path: str = "adb"):
+        self.serial = serial
+        self.adb_path = adb_path
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self._lock = asyncio.Lock()
+        self.restarts = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(
+            self.adb_path, "-s", self.serial, "shell",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT
+        )
+        logger.debug(f"Persistent shell started for {self.serial}")
+
+    async def _run_once(self, command: str, timeout: float) -> Tuple[int, str]:
+        if not self.alive:
+            await self.start()
+        marker = f"__TUTAN_{uuid.uuid4().hex}__"
+        # The leading newline puts the marker on its own line even if the output lacks one
+        self.process.stdin.write(f"{command} 2>&1; printf '\\n%s %d\\n' {marker} $?\n".encode("utf-8"))
+        await self.process.stdin.drain()
+
+        output = []
+        while True:
+            line = await asyncio.wait_for(self.process.stdout.readline(), timeout=timeout)
+            if not line:
+                raise ConnectionResetError(f"adb shell for {self.serial} closed")
+            text = line.decode("utf-8", errors="ignore")
+            if text.startswith(marker + " "):
+                # Drop the newline printed in front of the marker
+                return int(text.split()[-1]), "".join(output)[:-1]
+            output.append(text)
+
+    async def run(self, command: str, timeout: float = 10) -> Tuple[int, str]:
+        """Run `command` in the shell and return (exit status, combined output)."""
+        async with self._lock:
+            try:
+                return await self._run(command, timeout)
+            except asyncio.CancelledError:
+                # Unread output of an abandoned command would be taken as the next one's result
+                await self.close()
+                raise
+
+    async def _run(self, command: str, timeout: float) -> Tuple[int, str]:
+        try:
+            return await self._run_once(command, timeout)
+        except (ConnectionError, BrokenPipeError) as e:
+            logger.warning(f"Persistent shell for {self.serial} lost ({e}), reconnecting")
+        except asyncio.TimeoutError:
+            # Output of a hung command would corrupt the next one's framing
+            logger.error(f"Persistent shell command timeout on {self.serial}: {command}")
+            await self.close()
+            return -1, "timeout"
+        await self.close()
+        self.restarts += 1
+        return await self._run_once(command, timeout)
+
+    async def close(self):
+        process, self.process = self.process, None
+        if process is not None and process.returncode is None:
+            process.kill()
+            await process.wait()
@@ -5,8 +5,22 @@ from loguru import logger
 import time
 
 from tutan_agent.core.device_controller import DeviceController
+from tutan_agent.core.perception import PerceptionPipeline
+from tutan_agent.core.settle_detector import SettleDetector
 from tutan_agent.agents.planner import TutanPlanner
 from tutan_agent.core.session_store import SessionStore
+from tutan_agent.core.artifact_store import artifact_store
+from tutan_agent.core.ref_system import RefSystem
+from tutan_agent.agents.plan_cache import plan_cache
+from tutan_agent.agents.llm_gateway import llm_gateway
+from tutan_agent.agents.replay import TrajectoryReplayer, step_fingerprint
+from tutan_agent.agents.speculation import Speculator
+from tutan_agent.agents.model_router import ModelRouter, ROUTED_SYSTEM_PROMPT
+
+
+def _flag(value) -> bool:
+    return str(value or "").lower() in ("1", "true", "yes")
+
 
 class TutanAgent:
     """
@@ -14,14 +28,39 @@ class TutanAgent:
     Orchestrates between LLM, Ref System, and Hybrid Device Controller.
     Supports full async streaming and state management.
     """
-    def __init__(self, device_serial: str, model_config: Dict[str, str]):
+    def __init__(self, device_serial: str, model_config: Dict[str, str], incremental_context: bool = False):
         self.serial = device_serial
-        self.controller = DeviceController(device_serial)
+        self.incremental_context = incremental_context
+        self.controller = DeviceController(device_serial, incremental_refs=incremental_context)
+        self.perception = PerceptionPipeline(self.controller)
+        self.settle_detector = SettleDetector(self.controller)
         self.planner = TutanPlanner(
             api_key=model_config.get("api_key", "EMPTY"),
             base_url=model_config.get("base_url", "http://localhost:8000/v1"),
-            model=model_config.get("model_name", "gpt-4o")
+            model=model_config.get("model_name", "gpt-4o"),
+            stream=_flag(model_config.get("stream")),
+            cache=plan_cache if _flag(model_config.get("plan_cache")) else None,
+            app_version=model_config.get("app_version") or "",
+            gateway=llm_gateway
         )
+        # Optional second planner that plans the next step while the current one settles
+        self.speculator: Optional[Speculator] = None
+        if _flag(model_config.get("speculative")):
+            self.speculator = Speculator(TutanPlanner(
+                api_key=self.planner.api_key, base_url=self.planner.base_url, model=self.planner.model,
+                gateway=llm_gateway
+            ))
+        # Rules and an optional small model answer simple steps before the main model
+        small = None
+        if model_config.get("small_model_name"):
+            small = TutanPlanner(
+                api_key=model_config.get("small_api_key") or self.planner.api_key,
+                base_url=model_config.get("small_base_url") or self.planner.base_url,
+                model=model_config["small_model_name"],
+                gateway=llm_gateway,
+                system_prompt=ROUTED_SYSTEM_PROMPT
+            )
+        self.router = ModelRouter(self.planner, small, rules=_flag(model_config.get("rule_routing")))
         self.model_config = model_config
         self.history: List[Dict[str, str]] = []
         self._is_running = False
@@ -30,21 +69,25 @@ class TutanAgent:
         self.max_steps = 30
         self.session_id: Optional[str] = None
         self.store = SessionStore()
+        self.artifacts = artifact_store
 
     async def initialize(self):
         """Setup environment and establish connection."""
         await self.controller.setup_forwarding()
         logger.info(f"Agent for {self.serial} initialized.")
 
-    async def stream_task(self, task: str) -> AsyncIterator[Dict[str, Any]]:
+    async def stream_task(self, task: str, replay_session: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
         """
         Execute task and yield events for real-time monitoring.
+        With `replay_session`, the recorded steps of that session are replayed while the
+        live screen matches them; the planner only decides where it diverges.
         """
         self._is_running = True
         self._abort_requested = False
         self.step_count = 0
         self.history = []
         self.session_id = str(uuid.uuid4())
+        self.controller.screenshots.session_id = self.session_id
         
         # Create session in DB
         self.store.create_session(self.session_id, self.serial, task, self.model_config)
@@ -53,6 +96,29 @@ class TutanAgent:
         
         yield {"type": "status", "data": {"message": "Task started", "session_id": self.session_id}}
 
+        replayer = None
+        if replay_session:
+            recorded = await self.store.get_session_steps_async(replay_session)
+            replayer = TrajectoryReplayer(recorded)
+            yield {"type": "status", "data": {
+                "message": f"Replaying {len(replayer.steps)} recorded steps of session {replay_session}"
+            }}
+
+        try:
+            async for event in self._run_steps(task, replayer):
+                yield event
+        finally:
+            self.perception.cancel()
+            if self.speculator:
+                self.speculator.cancel()
+            self._is_running = False
+            # The task's steps, artifacts and final status are durable once the stream ends
+            await self.store.flush_async()
+            await self.artifacts.flush()
+
+    async def _run_steps(self, task: str, replayer: Optional[TrajectoryReplayer] = None) -> AsyncIterator[Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        sent_lines: Optional[Dict[str, str]] = None
         while self._is_running and self.step_count < self.max_steps:
             if self._abort_requested:
                 self.store.update_session_status(self.session_id, "aborted")
@@ -62,43 +128,72 @@ class TutanAgent:
             self.step_count += 1
             yield {"type": "status", "data": {"message": f"Executing Step {self.step_count}..."}}
 
-            # 1. Perception: Get UI context and screenshot
-            ui_context, mode = await self.controller.get_ui_context()
-            screenshot = await self.controller.get_screenshot()
+            # 1. Perception: Get UI context and screenshot (reuses the prefetch if still valid)
+            snapshot = await self.perception.next_snapshot(self.step_count)
+            ui_context, mode = snapshot.ui_context, snapshot.mode
             
             # Emit UI nodes for visual debugging
             yield {
                 "type": "ui_update",
                 "data": {
-                    "nodes": self.controller.get_current_nodes()
+                    "nodes": snapshot.nodes
                 }
             }
             
-            # 2. Planning: Call LLM
-            plan = await self.planner.plan_next_step(task, ui_context, self.history)
+            # 2. Planning: Replay the recorded step if the screen still matches it, else route to
+            # rules / small model / main model (with only the UI delta when it is smaller)
+            planning_started = loop.time()
+            plan = replayer.next_plan(snapshot.refs) if replayer else None
+            route, planner, escalated = "replay", None, False
+            if plan is None and self.speculator:
+                # A plan made ahead for the predicted screen is used if that screen is what we got
+                plan = await self.speculator.take(ui_context)
+                route, planner = "speculative", self.speculator.planner
+            ui_delta = None
+            if plan is None:
+                if self.incremental_context and sent_lines is not None and mode == "accessibility":
+                    ui_delta = RefSystem.format_delta(RefSystem.compute_delta(sent_lines, snapshot.lines))
+                    if len(ui_delta) >= len(ui_context):
+                        ui_delta = None
+                decision = await self.router.plan_next_step(task, snapshot, self.history, ui_delta=ui_delta)
+                plan, route, planner, escalated = decision.plan, decision.route, decision.planner, decision.escalated
+            plan_latency = loop.time() - planning_started
             
             if "error" in plan:
                 self.store.update_session_status(self.session_id, "failed")
                 yield {"type": "error", "data": {"message": plan["error"]}}
                 break
 
-            thinking = plan.get("thinking", "")
             action = plan.get("action", "")
             params = plan.get("params", {})
 
-            # 3. Execution: Perform action via controller
+            # 3. Execution: Perform action via controller (a streamed plan arrives before its tail)
             success = await self.controller.execute_action(action, params)
+            action_sent = loop.time()
+            if action != "finish":
+                # Overlap the next perception with persistence and the settle wait
+                self.perception.prefetch(self.step_count + 1)
+            if planner is not None:
+                plan = await planner.complete_plan(plan)
+                planner.record_outcome(plan, success)
+            thinking = plan.get("thinking", "")
 
-            # 4. Persistence: Save step to DB
+            # 4. Persistence: Save step to DB (artifacts are written in the background)
             step_data = {
                 "step": self.step_count,
                 "thinking": thinking,
                 "action": action,
                 "params": params,
                 "result": "success" if success else "failed",
-                "mode": mode
+                "mode": mode,
+                "screenshot_path": self.artifacts.put_screenshot(snapshot.screenshot),
+                "tree_path": self.artifacts.put_tree(snapshot.aria_tree),
+                "route": route,
+                "plan_latency": round(plan_latency, 3),
+                "escalated": escalated
             }
-            self.store.add_step(self.session_id, step_data)
+            fingerprint = step_fingerprint(snapshot.refs, params) if snapshot.refs else None
+            self.store.add_step(self.session_id, {**step_data, "fingerprint": fingerprint})
 
             # 5. Emit Step Event
             yield {
@@ -113,6 +208,14 @@ class TutanAgent:
                 break
             
             # 7. Update History
+            if self.incremental_context:
+                # Deltas are relative to this observation, so it must stay in the conversation
+                # A trimmed context is no base for deltas: the model never saw the dropped lines
+                # Replayed and rule-based steps sent nothing, so the next call needs the full context
+                no_base = planner is None or (ui_delta is None and planner.last_context_trimmed)
+                sent_lines = snapshot.lines if mode == "accessibility" and not no_base else None
+                if planner is not None:
+                    self.history.append({"role": "user", "content": planner.last_prompt})
             self.history.append({
                 "role": "assistant", 
                 "content": f"Thinking: {thinking}\nAction: {action}({params})"
@@ -125,15 +228,18 @@ class TutanAgent:
             if not success:
                 logger.warning(f"Step {self.step_count} action failed.")
                 yield {"type": "warning", "data": {"message": f"Action {action} failed, retrying..."}}
+            # execute_action reports wait as not performed, but the screen is what was predicted
+            if self.speculator and (success or action == "wait"):
+                # Plan the next step on the predicted screen while this one settles
+                self.speculator.launch(task, ui_context, action, params, self.history, self.planner.llm_slots)
 
-            await asyncio.sleep(1.5) # Wait for UI to settle
+            # Wait until the UI stops changing, counted from the moment the action was sent
+            await self.settle_detector.wait(action, started=action_sent)
 
         if self.step_count >= self.max_steps:
             self.store.update_session_status(self.session_id, "timeout")
             yield {"type": "error", "data": {"message": "Maximum steps reached"}}
 
-        self._is_running = False
-
     def abort(self):
         """Request task abortion."""
         self._abort_requested = True
@@ -143,3 +249,4 @@ class TutanAgent:
         self._is_running = False
         await self.controller.close()
         await self.planner.close()
+        await self.router.close()
@@ -0,0 +1,120 @@
+import os
+import re
+from typing import List, Dict, Tuple
+from loguru import logger
+
+try:
+    import tiktoken  # Optional: exact counts for OpenAI-style tokenizers
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+_CJK = re.compile(r"[　-鿿가-힯＀-￯]")
+_ACTION = re.compile(r"^Action: (.*)$", re.MULTILINE)
+
+
+def count_tokens(text: str) -> int:
+    """Local token count: tiktoken when installed, else ~4 chars/token (1 per CJK char)."""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def count_message_tokens(messages: List[Dict[str, str]]) -> int:
+    # ~4 tokens of chat-format overhead per message
+    return sum(count_tokens(m["content"]) + 4 for m in messages)
+
+
+class ContextBudget:
+    """
+    Keeps planner prompts at a flat size over long tasks.
+    History is split into steps (each ends with an "Action result" message); at least the
+    last `keep_steps` stay verbatim and older ones are folded into a one-line-per-step digest.
+    Folding happens in blocks of `fold_every` steps so the prompt prefix stays unchanged
+    between folds. The UI context gets whatever remains of `max_tokens`; if it does not
+    fit, clickable/editable elements are kept first, then labelled ones.
+    """
+    def __init__(self, max_tokens: int = None, keep_steps: int = None, fold_every: int = 5,
+                 min_ui_tokens: int = 800):
+        self.max_tokens = max_tokens or int(os.environ.get("TUTAN_PROMPT_BUDGET", "6000"))
+        self.keep_steps = keep_steps if keep_steps is not None else int(os.environ.get("TUTAN_HISTORY_STEPS", "4"))
+        self.fold_every = max(1, fold_every)
+        self.min_ui_tokens = min_ui_tokens
+
+    @staticmethod
+    def split_steps(history: List[Dict[str, str]]) -> List[List[Dict[str, str]]]:
+        steps, current = [], []
+        for message in history:
+            current.append(message)
+            if message["role"] == "user" and message["content"].startswith("Action result:"):
+                steps.append(current)
+                current = []
+        if current:
+            steps.append(current)
+        return steps
+
+    @staticmethod
+    def digest_line(number: int, step: List[Dict[str, str]]) -> str:
+        action, result = "?", "?"
+        for message in step:
+            if message["role"] == "assistant":
+                match = _ACTION.search(message["content"])
+                action = match.group(1) if match else message["content"][:80]
+            elif message["content"].startswith("Action result:"):
+                result = message["content"].split(":", 1)[1].strip()
+        return f"{number}. {action} -> {result}"
+
+    def compact_history(self, history: List[Dict[str, str]]) -> Tuple[List[Dict[str, str]], int]:
+        """Return (messages, number of folded steps): digest of old steps plus recent ones verbatim."""
+        steps = self.split_steps(history)
+        overflow = len(steps) - self.keep_steps
+        if overflow <= 0:
+            return list(history), 0
+
+        # Fold whole blocks only, so the digest text changes every `fold_every` steps;
+        # rounding down keeps at least `keep_steps` steps verbatim
+        folded = overflow // self.fold_every * self.fold_every
+        if folded == 0:
+            return list(history), 0
+        digest = "\n".join(self.digest_line(i + 1, step) for i, step in enumerate(steps[:folded]))
+        messages = [{"role": "user", "content": f"Summary of earlier steps:\n{digest}"}]
+        for step in steps[folded:]:
+            messages.extend(step)
+        return messages, folded
+
+    @staticmethod
+    def _line_priority(line: str) -> int:
+        if "[clickable]" in line or "[editable]" in line:
+            return 0
+        if 'text="' in line or 'label="' in line:
+            return 1
+        return 2
+
+    def fit_ui_context(self, ui_context: str, budget: int) -> str:
+        """Trim the UI context to `budget` tokens, keeping actionable elements in tree order."""
+        if count_tokens(ui_context) <= budget:
+            return ui_context
+
+        lines = ui_context.splitlines()
+        ranked = sorted(range(len(lines)), key=lambda i: (self._line_priority(lines[i]), i))
+        keep, used = set(), 0
+        for i in ranked:
+            cost = count_tokens(lines[i]) + 1
+            if used + cost > budget:
+                break
+            keep.add(i)
+            used += cost
+        omitted = len(lines) - len(keep)
+        kept = [line for i, line in enumerate(lines) if i in keep]
+        kept.append(f"... ({omitted} less relevant elements omitted to fit the context budget)")
+        return "\n".join(kept)
+
+    def ui_budget(self, fixed_tokens: int) -> int:
+        """Tokens left for the UI context after the system prompt, history and task."""
+        remaining = self.max_tokens - fixed_tokens
+        if remaining < self.min_ui_tokens:
+            logger.debug(f"Prompt budget exhausted by history ({fixed_tokens} tokens), using the UI minimum")
+        return max(self.min_ui_tokens, remaining)
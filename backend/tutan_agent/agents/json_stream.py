@@ -0,0 +1,103 @@
+import json
+from typing import Dict, Any, List, Tuple
+
+
+class IncrementalJSONObject:
+    """
+    Push parser for a streamed JSON object.
+    `feed` accepts arbitrary text chunks and returns the top-level `(key, value)` pairs
+    that became complete, so a caller can act on `action`/`params` while the model is
+    still writing the rest. Text before the first `{` (e.g. a ```json fence) is ignored.
+    """
+    def __init__(self):
+        self.buffer = ""
+        self.values: Dict[str, Any] = {}
+        self._pos = 0
+        self._started = False
+        self._done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._key = None
+        self._expect_key = True
+        self._value_start = None
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        self.buffer += chunk
+        completed = []
+        buf = self.buffer
+        i = self._pos
+        while i < len(buf) and not self._done:
+            ch = buf[i]
+            if not self._started:
+                if ch == "{":
+                    self._started = True
+                    self._depth = 1
+                i += 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._expect_key:
+                        self._key = json.loads(buf[self._value_start:i + 1])
+                        self._value_start = None
+                    elif self._depth == 1:
+                        completed.append(self._complete(buf, i + 1))
+                i += 1
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._value_start is None:
+                    self._value_start = i
+            elif ch in "{[":
+                if self._depth == 1 and self._value_start is None:
+                    self._value_start = i
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 1 and self._value_start is not None:
+                    completed.append(self._complete(buf, i + 1))
+                elif self._depth == 0:
+                    # Closing brace also terminates a trailing scalar (number, true, null)
+                    if self._value_start is not None:
+                        completed.append(self._complete(buf, i))
+                    self._done = True
+            elif self._depth == 1:
+                if ch == ":":
+                    self._expect_key = False
+                elif ch == ",":
+                    if self._value_start is not None:
+                        completed.append(self._complete(buf, i))
+                    self._expect_key = True
+                elif not ch.isspace() and self._value_start is None and not self._expect_key:
+                    self._value_start = i
+            i += 1
+        self._pos = i
+        return [item for item in completed if item is not None]
+
+    def _complete(self, buf: str, end: int):
+        raw = buf[self._value_start:end].strip()
+        self._value_start = None
+        key, self._key = self._key, None
+        self._expect_key = True
+        if key is None:
+            return None
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            return None
+        self.values[key] = value
+        return key, value
+
+    def has(self, *keys: str) -> bool:
+        return all(key in self.values for key in keys)
+
+    @property
+    def done(self) -> bool:
+        return self._done
@@ -0,0 +1,180 @@
+import asyncio
+import contextlib
+import os
+import random
+from typing import AsyncIterator, Dict, Any, Optional
+import httpx
+from loguru import logger
+
+try:
+    import h2  # Optional: multiplex all planner calls over few HTTP/2 connections
+except ImportError:
+    h2 = None
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class LLMGateway:
+    """
+    Shared front door for every planner's /chat/completions calls in this process.
+    Keeps one pooled (HTTP/2 when `h2` is installed) client per endpoint, spaces requests
+    to `rate` per second, caps in-flight requests at `max_in_flight`, and retries 429/5xx
+    and connection errors with exponential backoff (honouring Retry-After). With a
+    `batch_window`, a call to an endpoint that is already serving requests is held up to
+    that long so calls arriving together land in the inference server's same batch; a
+    call to an idle endpoint is never delayed. Off by default.
+    """
+    def __init__(self, max_in_flight: Optional[int] = None, rate: Optional[float] = None,
+                 batch_window: Optional[float] = None, max_batch: int = 32, max_retries: int = 3,
+                 backoff: float = 0.5, timeout: float = 60.0,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.max_in_flight = max_in_flight or int(os.environ.get("TUTAN_LLM_MAX_IN_FLIGHT", "16"))
+        self.rate = rate if rate is not None else float(os.environ.get("TUTAN_LLM_RATE", "0"))
+        self.batch_window = batch_window if batch_window is not None else \
+            float(os.environ.get("TUTAN_LLM_BATCH_WINDOW_MS", "0")) / 1000
+        self.max_batch = max_batch
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.transport = transport
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._in_flight: Optional[asyncio.Semaphore] = None
+        # Per endpoint: open batch window, its size, and requests past admission
+        self._windows: Dict[str, asyncio.Future] = {}
+        self._window_sizes: Dict[str, int] = {}
+        self._busy: Dict[str, int] = {}
+        self._next_slot = 0.0
+        self.stats = {"requests": 0, "batches": 0, "batched_requests": 0, "max_batch": 0, "retries": 0,
+                      "throttled": 0, "errors": 0, "in_flight": 0, "max_in_flight_seen": 0}
+
+    def client_for(self, base_url: str) -> httpx.AsyncClient:
+        client = self._clients.get(base_url)
+        if client is None:
+            client = self._clients[base_url] = httpx.AsyncClient(
+                base_url=base_url,
+                http2=h2 is not None,
+                limits=httpx.Limits(max_connections=self.max_in_flight, max_keepalive_connections=self.max_in_flight),
+                timeout=self.timeout,
+                transport=self.transport
+            )
+        return client
+
+    # --- Admission ---
+
+    async def _join_window(self, base_url: str):
+        """Wait for the endpoint's batch window; only when it is already serving requests."""
+        if self.batch_window <= 0 or not self._busy.get(base_url):
+            return
+        loop = asyncio.get_running_loop()
+        window = self._windows.get(base_url)
+        if window is None:
+            window = self._windows[base_url] = loop.create_future()
+            self._window_sizes[base_url] = 0
+            loop.call_later(self.batch_window, self._close_window, base_url, window)
+        self._window_sizes[base_url] += 1
+        if self._window_sizes[base_url] >= self.max_batch:
+            self._close_window(base_url, window)
+        await asyncio.shield(window)
+
+    def _close_window(self, base_url: str, window: asyncio.Future):
+        if window.done():
+            return
+        size = self._window_sizes.pop(base_url, 0)
+        self._windows.pop(base_url, None)
+        self.stats["batches"] += 1
+        self.stats["batched_requests"] += size
+        self.stats["max_batch"] = max(self.stats["max_batch"], size)
+        window.set_result(size)
+
+    async def _throttle(self):
+        if self.rate <= 0:
+            return
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + 1.0 / self.rate
+        if slot > now:
+            self.stats["throttled"] += 1
+            await asyncio.sleep(slot - now)
+
+    @contextlib.asynccontextmanager
+    async def _slot(self, base_url: str):
+        if self._in_flight is None:
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        await self._join_window(base_url)
+        self._busy[base_url] = self._busy.get(base_url, 0) + 1
+        try:
+            await self._throttle()
+            async with self._in_flight:
+                self.stats["requests"] += 1
+                self.stats["in_flight"] += 1
+                self.stats["max_in_flight_seen"] = max(self.stats["max_in_flight_seen"], self.stats["in_flight"])
+                try:
+                    yield
+                finally:
+                    self.stats["in_flight"] -= 1
+        finally:
+            self._busy[base_url] -= 1
+
+    # --- Requests ---
+
+    def _retry_delay(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        if response is not None:
+            try:
+                return float(response.headers["retry-after"])
+            except (KeyError, ValueError):
+                pass
+        return self.backoff * (2 ** attempt) * (0.5 + random.random())
+
+    async def _send(self, base_url: str, api_key: str, body: Dict[str, Any], stream: bool) -> httpx.Response:
+        client = self.client_for(base_url)
+        attempt = 0
+        while True:
+            request = client.build_request("POST", "/chat/completions", json=body,
+                                           headers={"Authorization": f"Bearer {api_key}"})
+            try:
+                response = await client.send(request, stream=stream)
+            except httpx.TransportError as e:
+                if attempt >= self.max_retries:
+                    self.stats["errors"] += 1
+                    raise
+                delay = self._retry_delay(attempt)
+                logger.warning(f"LLM request failed ({e}), retrying in {delay:.1f}s")
+            else:
+                if response.status_code not in RETRY_STATUS or attempt >= self.max_retries:
+                    if response.status_code >= 400:
+                        self.stats["errors"] += 1
+                    return response
+                delay = self._retry_delay(attempt, response)
+                await response.aclose()
+                logger.warning(f"LLM returned {response.status_code}, retrying in {delay:.1f}s")
+            attempt += 1
+            self.stats["retries"] += 1
+            await asyncio.sleep(delay)
+
+    async def post(self, base_url: str, api_key: str, body: Dict[str, Any]) -> httpx.Response:
+        """Non-streaming completion call; the response body is fully read."""
+        async with self._slot(base_url):
+            return await self._send(base_url, api_key, body, stream=False)
+
+    @contextlib.asynccontextmanager
+    async def stream(self, base_url: str, api_key: str, body: Dict[str, Any]) -> AsyncIterator[httpx.Response]:
+        """Streaming completion call; retries only happen before the first byte."""
+        async with self._slot(base_url):
+            response = await self._send(base_url, api_key, body, stream=True)
+            try:
+                yield response
+            finally:
+                await response.aclose()
+
+    def get_stats(self) -> Dict[str, Any]:
+        batches = self.stats["batches"]
+        return dict(self.stats, http2=h2 is not None, endpoints=len(self._clients),
+                    avg_batch=round(self.stats["batched_requests"] / batches, 2) if batches else 0.0)
+
+    async def close(self):
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients = {}
+
+
+llm_gateway = LLMGateway()
@@ -0,0 +1,115 @@
+import re
+from typing import List, Dict, Any, Optional
+from loguru import logger
+
+from tutan_agent.agents.planner import TutanPlanner, SYSTEM_PROMPT
+from tutan_agent.core.ref_system import RefNode
+
+ACTIONS = {"click", "type", "scroll", "back", "home", "wait", "finish"}
+
+# Buttons that only acknowledge or dismiss an interstitial screen
+_CONFIRM = re.compile(r"^(ok|okay|got it|continue|done|close|dismiss|skip|not now|确定|好的|知道了|我知道了|继续|关闭|跳过|完成)$",
+                      re.IGNORECASE)
+
+ROUTED_SYSTEM_PROMPT = SYSTEM_PROMPT + """
+
+Also include "confidence": a number from 0 to 1 for how sure you are that this action is right."""
+
+
+def match_rules(refs: Dict[str, RefNode]) -> Optional[Dict[str, Any]]:
+    """
+    Deterministic plans for screens that leave no choice: a dialog whose only
+    actionable element is an OK/Continue-style button.
+    """
+    actionable = [node for node in refs.values() if node.clickable or node.editable]
+    if len(actionable) != 1 or actionable[0].editable:
+        return None
+    node = actionable[0]
+    label = (node.text or node.content_description).strip()
+    if not _CONFIRM.match(label):
+        return None
+    return {"thinking": f'Only actionable element is "{label}"', "action": "click",
+            "params": {"ref_id": node.ref_id}, "confidence": 1.0}
+
+
+class RouteDecision:
+    """The plan for one step and where it came from."""
+    def __init__(self, plan: Dict[str, Any], route: str, planner: Optional[TutanPlanner], escalated: bool = False):
+        self.plan = plan
+        self.route = route
+        self.planner = planner
+        self.escalated = escalated
+
+
+class ModelRouter:
+    """
+    Tiered planning: rules over the RefSystem nodes first, then a fast small model,
+    and the large model only when neither is sure. The small model's answer is
+    escalated if its JSON is unusable, its action or ref ID is invalid, or its
+    self-reported confidence is below `min_confidence`. After a failed action (other
+    than wait) the next step always goes to the large model, and a rule never fires
+    twice in a row on the same screen.
+    """
+    def __init__(self, large: TutanPlanner, small: Optional[TutanPlanner] = None, rules: bool = True,
+                 min_confidence: float = 0.7):
+        self.large = large
+        self.small = small
+        self.rules = rules
+        self.min_confidence = min_confidence
+        self.stats = {"rules": 0, "small": 0, "large": 0, "escalated": 0}
+        # Screen a rule clicked on in the previous step; a click that left it unchanged
+        # did not work, so the rule must not fire there again
+        self._rule_screen: Optional[str] = None
+
+    @staticmethod
+    def _last_failed(history: List[Dict[str, str]]) -> bool:
+        if not history or history[-1]["content"] != "Action result: Failed":
+            return False
+        # execute_action reports wait as not performed; there is nothing to recover from
+        return not (len(history) >= 2 and "Action: wait(" in history[-2]["content"])
+
+    def _usable(self, plan: Dict[str, Any], refs: Dict[str, RefNode]) -> bool:
+        if "error" in plan or plan.get("action") not in ACTIONS or not isinstance(plan.get("params", {}), dict):
+            return False
+        if plan["action"] in ("click", "type") and plan.get("params", {}).get("ref_id") not in refs:
+            return False
+        try:
+            return float(plan.get("confidence", 0)) >= self.min_confidence
+        except (TypeError, ValueError):
+            return False
+
+    async def plan_next_step(self, task: str, snapshot, history: List[Dict[str, str]],
+                             ui_delta: Optional[str] = None) -> RouteDecision:
+        refs = snapshot.refs
+        simple = not self._last_failed(history)
+        rule_screen, self._rule_screen = self._rule_screen, None
+        if self.rules and simple and snapshot.fingerprint != rule_screen:
+            plan = match_rules(refs)
+            if plan is not None:
+                self.stats["rules"] += 1
+                self._rule_screen = snapshot.fingerprint
+                return RouteDecision(plan, "rules", None)
+
+        escalated = False
+        if self.small is not None and simple:
+            # The small model counts against the same global LLM concurrency cap
+            self.small.llm_slots = self.large.llm_slots
+            plan = await self.small.plan_next_step(task, snapshot.ui_context, history, ui_delta=ui_delta)
+            if self._usable(plan, refs):
+                self.stats["small"] += 1
+                return RouteDecision(plan, "small", self.small)
+            escalated = True
+            self.stats["escalated"] += 1
+            logger.debug(f"Escalating to {self.large.model}: small model plan {plan}")
+
+        plan = await self.large.plan_next_step(task, snapshot.ui_context, history, ui_delta=ui_delta)
+        self.stats["large"] += 1
+        route = "cache" if self.large.last_from_cache else "large"
+        return RouteDecision(plan, route, self.large, escalated)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.stats)
+
+    async def close(self):
+        if self.small is not None:
+            await self.small.close()
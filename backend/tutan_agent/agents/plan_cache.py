@@ -0,0 +1,179 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+from loguru import logger
+
+from tutan_agent.agents.context_budget import ContextBudget
+from tutan_agent.core.session_store import _BatchWriter
+
+# Status-bar clocks and counters change between runs of the same screen
+_VOLATILE = [
+    (re.compile(r"\b\d{1,2}:\d{2}(:\d{2})?\b"), "<time>"),
+    (re.compile(r"\b\d{1,3}%"), "<pct>"),
+]
+
+
+def normalize_ui_context(ui_context: str) -> str:
+    lines = []
+    for line in ui_context.splitlines():
+        line = " ".join(line.split())
+        for pattern, repl in _VOLATILE:
+            line = pattern.sub(repl, line)
+        if line:
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def plan_key(task: str, ui_context: str, history: List[Dict[str, str]], model: str, app_version: str) -> str:
+    """Canonical hash of what the planner decides on; ref IDs stay since cached plans use them."""
+    steps = ContextBudget.split_steps(history)
+    compact = [ContextBudget.digest_line(i + 1, step) for i, step in enumerate(steps)]
+    payload = json.dumps([model, app_version, " ".join(task.split()), normalize_ui_context(ui_context), compact],
+                         ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class PlanCache:
+    """
+    Memoizes planner decisions for screens seen before.
+    An in-memory LRU sits in front of a SQLite table shared by every agent (and every
+    shard process). Only plans whose action succeeded are stored, and a cached plan that
+    fails is dropped, so the cache converges on known-good trajectories. Entries expire
+    after `ttl` seconds and can be invalidated per model or app version.
+    """
+    def __init__(self, db_path: Optional[str] = None, max_entries: int = 2048, ttl: Optional[float] = None):
+        self.db_path = db_path or os.environ.get("TUTAN_PLAN_CACHE_DB", "tutan_plan_cache.db")
+        self.max_entries = max_entries
+        self.ttl = ttl or float(os.environ.get("TUTAN_PLAN_CACHE_TTL_DAYS", "7")) * 86400
+        self._memory: "OrderedDict[str, Tuple[Dict[str, Any], float, str, str]]" = OrderedDict()
+        self._writer: Optional[_BatchWriter] = None
+        self._local = threading.local()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stored": 0, "expired": 0, "invalidated": 0}
+
+    def _init_db(self, conn: sqlite3.Connection):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS plan_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                app_version TEXT,
+                plan TEXT,
+                created_at REAL,
+                hits INTEGER DEFAULT 0
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_plan_cache_scope ON plan_cache (model, app_version)")
+
+    def _get_writer(self) -> _BatchWriter:
+        # Opened lazily so importing the module never touches the disk
+        if self._writer is None or not self._writer.running:
+            self._writer = _BatchWriter.for_path(self.db_path, self._init_db, 256)
+        return self._writer
+
+    def _read_conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self._get_writer()
+            conn = self._local.conn = sqlite3.connect(self.db_path)
+        return conn
+
+    def _remember(self, key: str, entry: Tuple[Dict[str, Any], float, str, str]):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _load(self, key: str) -> Optional[Tuple[Dict[str, Any], float, str, str]]:
+        row = self._read_conn().execute(
+            "SELECT plan, created_at, model, app_version FROM plan_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1] + self.ttl, row[2], row[3]
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._memory.get(key)
+        source = "memory_hits"
+        if entry is None:
+            try:
+                entry = await asyncio.to_thread(self._load, key)
+            except sqlite3.Error as e:
+                logger.warning(f"Plan cache lookup failed: {e}")
+                entry = None
+            source = "disk_hits"
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        if entry[1] < time.time():
+            self.stats["expired"] += 1
+            self.stats["misses"] += 1
+            self.discard(key)
+            return None
+
+        self.stats[source] += 1
+        self._remember(key, entry)
+        self._get_writer().submit("UPDATE plan_cache SET hits = hits + 1 WHERE key = ?", (key,))
+        return dict(entry[0])
+
+    def put(self, key: str, plan: Dict[str, Any], model: str, app_version: str):
+        now = time.time()
+        self._remember(key, (dict(plan), now + self.ttl, model, app_version))
+        self._get_writer().submit(
+            "INSERT OR REPLACE INTO plan_cache (key, model, app_version, plan, created_at) VALUES (?, ?, ?, ?, ?)",
+            (key, model, app_version, json.dumps(plan, ensure_ascii=False), now)
+        )
+        self.stats["stored"] += 1
+
+    def discard(self, key: str):
+        self._memory.pop(key, None)
+        self._get_writer().submit("DELETE FROM plan_cache WHERE key = ?", (key,))
+
+    def forget(self, model: Optional[str] = None, app_version: Optional[str] = None):
+        """
+        Drop matching entries from the memory tier only and wait for this process's
+        queued writes, so a later invalidate of the shared table sees them.
+        """
+        for key, entry in list(self._memory.items()):
+            if (model is None or entry[2] == model) and (app_version is None or entry[3] == app_version):
+                del self._memory[key]
+        if self._writer is not None and self._writer.running:
+            done = threading.Event()
+            self._writer.barrier(done.set)
+            done.wait(10)
+
+    def invalidate(self, model: Optional[str] = None, app_version: Optional[str] = None) -> int:
+        """Drop every entry of `model` and/or `app_version` (everything if both are None)."""
+        clauses, params = [], []
+        for column, value in (("model", model), ("app_version", app_version)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+
+        self.forget(model, app_version)
+        writer = self._get_writer()
+        removed = self._read_conn().execute(f"SELECT COUNT(*) FROM plan_cache{where}", params).fetchone()[0]
+        writer.submit(f"DELETE FROM plan_cache{where}", tuple(params))
+        self.stats["invalidated"] += removed
+        return removed
+
+    async def invalidate_async(self, model: Optional[str] = None, app_version: Optional[str] = None) -> int:
+        return await asyncio.to_thread(self.invalidate, model, app_version)
+
+    async def forget_async(self, model: Optional[str] = None, app_version: Optional[str] = None):
+        await asyncio.to_thread(self.forget, model, app_version)
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"]
+        hits = lookups - self.stats["misses"]
+        return dict(self.stats, memory_entries=len(self._memory),
+                    hit_rate=round(hits / lookups, 3) if lookups else 0.0)
+
+
+plan_cache = PlanCache()
@@ -1,24 +1,18 @@
+import asyncio
+import contextlib
 import json
-from typing import List, Dict, Any, Optional
+import textwrap
+from typing import List, Dict, Any, Optional, Tuple
 import httpx
 from loguru import logger
 
-class TutanPlanner:
-    """
-    Advanced LLM reasoning engine for TUTAN_AGENT.
-    Integrates OpenClaw's prompt strategies and Ref System.
-    """
-    def __init__(self, api_key: str, base_url: str, model: str):
-        self.api_key = api_key
-        self.base_url = base_url
-        self.model = model
-        self.client = httpx.AsyncClient(
-            headers={"Authorization": f"Bearer {api_key}"},
-            timeout=60.0
-        )
+from tutan_agent.agents.context_budget import ContextBudget, count_tokens, count_message_tokens
+from tutan_agent.agents.json_stream import IncrementalJSONObject
+from tutan_agent.agents.plan_cache import PlanCache, plan_key
+from tutan_agent.agents.llm_gateway import LLMGateway
 
-    def _get_system_prompt(self) -> str:
-        return """
+# Built once and sent byte-identical on every call so provider prefix caches can hit
+SYSTEM_PROMPT = textwrap.dedent("""
         You are an expert Android GUI Agent. Your goal is to complete the user's task by interacting with the device.
         You are provided with a 'UI Context' which lists elements with semantic IDs like [e1], [e2], etc.
         
@@ -48,30 +42,114 @@ class TutanPlanner:
                 "message": "final result"
             }
         }
-        """
+""").strip()
+
 
-    async def plan_next_step(self, task: str, ui_context: str, history: List[Dict[str, str]]) -> Dict[str, Any]:
+class TutanPlanner:
+    """
+    Advanced LLM reasoning engine for TUTAN_AGENT.
+    Integrates OpenClaw's prompt strategies and Ref System.
+    """
+    def __init__(self, api_key: str, base_url: str, model: str, budget: Optional[ContextBudget] = None,
+                 stream: bool = False, cache: Optional[PlanCache] = None, app_version: str = "",
+                 gateway: Optional[LLMGateway] = None, system_prompt: Optional[str] = None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.system_prompt = system_prompt or SYSTEM_PROMPT
+        # Plans for already-seen (task, screen, history) are reused; scoped by model and app version
+        self.cache = cache
+        self.app_version = app_version
+        self._cache_entry: Optional[Tuple[str, bool]] = None
+        # Stream the completion and hand back the action as soon as it is parsed
+        self.stream = stream
+        self._completion: Optional[asyncio.Task] = None
+        self.stream_stats = {"calls": 0, "early_actions": 0, "time_to_action_total": 0.0, "completion_total": 0.0}
+        self.budget = budget or ContextBudget()
+        self.last_prompt: Optional[str] = None
+        # True when the last full UI context was trimmed to fit the budget
+        self.last_context_trimmed = False
+        self.context_stats = {"calls": 0, "prompt_tokens": 0, "last_prompt_tokens": 0, "max_prompt_tokens": 0,
+                              "folded_steps": 0, "trimmed_contexts": 0, "delta_fallbacks": 0}
+        # Shared limit on in-flight LLM calls across agents (set by the TaskScheduler)
+        self.llm_slots: Optional[asyncio.Semaphore] = None
+        # With a shared gateway, connections, batching, rate limits and retries are pooled
+        # across all planners; otherwise this planner talks to the endpoint on its own
+        self.gateway = gateway
+        self.client = None if gateway else httpx.AsyncClient(
+            headers={"Authorization": f"Bearer {api_key}"},
+            timeout=60.0
+        )
+
+    def _get_system_prompt(self) -> str:
+        return self.system_prompt
+
+    @property
+    def last_from_cache(self) -> bool:
+        """Whether the last plan was served by the plan cache."""
+        return bool(self._cache_entry and self._cache_entry[1])
+
+    async def plan_next_step(self, task: str, ui_context: str, history: List[Dict[str, str]],
+                             ui_delta: Optional[str] = None) -> Dict[str, Any]:
         """
         Call LLM to decide the next step.
+        If `ui_delta` is given, it replaces the full UI context; the caller must keep the
+        previous observation in `history` (see `last_prompt`).
+        History and UI context are compacted to the planner's ContextBudget; a delta whose
+        base observation was folded out of the history is replaced by the full context.
         """
-        prompt = f"User Task: {task}\n\nUI Context (Ref System):\n{ui_context}\n\nDecide the next step."
+        system_prompt = self._get_system_prompt()
+        full_history = history
+        history, folded = self.budget.compact_history(history)
+        if ui_delta is not None and not any(
+                m["role"] == "user" and m["content"].startswith("User Task:") and "UI Context (Ref System)" in m["content"]
+                for m in history):
+            # The full observation the delta chain starts from was folded away
+            ui_delta = None
+            self.context_stats["delta_fallbacks"] += 1
+
+        self.last_context_trimmed = False
+        if ui_delta is not None:
+            prompt = (
+                f"User Task: {task}\n\nUI Context changes since the last observation "
+                f"(Ref IDs are stable; + added, - removed, ~ changed):\n{ui_delta}\n\nDecide the next step."
+            )
+        else:
+            fixed = count_tokens(system_prompt) + count_message_tokens(history) + count_tokens(task) + 40
+            fitted = self.budget.fit_ui_context(ui_context, self.budget.ui_budget(fixed))
+            if fitted is not ui_context:
+                self.last_context_trimmed = True
+                self.context_stats["trimmed_contexts"] += 1
+            prompt = f"User Task: {task}\n\nUI Context (Ref System):\n{fitted}\n\nDecide the next step."
+        self.last_prompt = prompt
+
+        self._cache_entry = None
+        if self.cache is not None:
+            key = plan_key(task, ui_context, full_history, self.model, self.app_version)
+            cached = await self.cache.get(key)
+            self._cache_entry = (key, cached is not None)
+            if cached is not None:
+                return cached
 
         messages = [
-            {"role": "system", "content": self._get_system_prompt()},
+            {"role": "system", "content": system_prompt},
             *history,
             {"role": "user", "content": prompt}
         ]
+        self._record_prompt(count_message_tokens(messages), folded)
+
+        body = {
+            "model": self.model,
+            "messages": messages,
+            "response_format": {"type": "json_object"},
+            "temperature": 0.0 # Deterministic for GUI actions
+        }
+        if self.stream:
+            return await self._plan_streaming(body)
 
         try:
-            response = await self.client.post(
-                f"{self.base_url}/chat/completions",
-                json={
-                    "model": self.model,
-                    "messages": messages,
-                    "response_format": {"type": "json_object"},
-                    "temperature": 0.0 # Deterministic for GUI actions
-                }
-            )
+            async with self.llm_slots or contextlib.nullcontext():
+                response = await self._post(body)
             
             if response.status_code == 200:
                 result = response.json()
@@ -84,5 +162,112 @@ class TutanPlanner:
             logger.exception(f"Failed to call LLM: {e}")
             return {"error": str(e)}
 
+    async def _post(self, body: Dict[str, Any]) -> httpx.Response:
+        if self.gateway:
+            return await self.gateway.post(self.base_url, self.api_key, body)
+        return await self.client.post(f"{self.base_url}/chat/completions", json=body)
+
+    def _stream(self, body: Dict[str, Any]):
+        if self.gateway:
+            return self.gateway.stream(self.base_url, self.api_key, body)
+        return self.client.stream("POST", f"{self.base_url}/chat/completions", json=body)
+
+    async def _plan_streaming(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Streamed request. Returns as soon as `action` and `params` are complete; the rest
+        of the completion keeps streaming in the background (see `complete_plan`).
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        parser = IncrementalJSONObject()
+        ready = loop.create_future()
+
+        async def consume() -> Dict[str, Any]:
+            try:
+                async with self.llm_slots or contextlib.nullcontext():
+                    async with self._stream({**body, "stream": True}) as response:
+                        if response.status_code != 200:
+                            text = (await response.aread()).decode("utf-8", "replace")
+                            logger.error(f"LLM API Error: {text}")
+                            return {"error": f"API returned {response.status_code}"}
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[5:].strip()
+                            if data == "[DONE]":
+                                break
+                            delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                            if not delta:
+                                continue
+                            parser.feed(delta)
+                            if not ready.done() and parser.has("action", "params"):
+                                ready.set_result(dict(parser.values))
+                if not parser.values:
+                    return {"error": "LLM returned no JSON object"}
+                return dict(parser.values)
+            except Exception as e:
+                logger.exception(f"Failed to call LLM: {e}")
+                return {"error": str(e)}
+            finally:
+                self.stream_stats["completion_total"] += loop.time() - started
+
+        self.stream_stats["calls"] += 1
+        completion = asyncio.create_task(consume())
+        await asyncio.wait([ready, completion], return_when=asyncio.FIRST_COMPLETED)
+        self.stream_stats["time_to_action_total"] += loop.time() - started
+        if not ready.done():
+            return completion.result()
+        if completion.done():
+            # Finished in the same read as the action: the full plan includes the trailing fields
+            return self._merge(ready.result(), completion.result())
+        self.stream_stats["early_actions"] += 1
+        self._completion = completion
+        return ready.result()
+
+    @staticmethod
+    def _merge(plan: Dict[str, Any], rest: Dict[str, Any]) -> Dict[str, Any]:
+        return plan if "error" in rest else {**rest, **plan}
+
+    async def complete_plan(self, plan: Dict[str, Any]) -> Dict[str, Any]:
+        """Wait for the rest of a streamed completion (e.g. a trailing `thinking`) and merge it in."""
+        completion, self._completion = self._completion, None
+        if completion is None:
+            return plan
+        return self._merge(plan, await completion)
+
+    def record_outcome(self, plan: Dict[str, Any], success: bool):
+        """Feed the result of executing the last plan back to the cache."""
+        entry, self._cache_entry = self._cache_entry, None
+        if entry is None or self.cache is None:
+            return
+        key, hit = entry
+        if hit and not success:
+            # A cached plan that no longer works on this screen must not be replayed again
+            self.cache.discard(key)
+        elif not hit and success and "error" not in plan:
+            self.cache.put(key, plan, self.model, self.app_version)
+
+    def _record_prompt(self, tokens: int, folded: int):
+        stats = self.context_stats
+        stats["calls"] += 1
+        stats["prompt_tokens"] += tokens
+        stats["last_prompt_tokens"] = tokens
+        stats["max_prompt_tokens"] = max(stats["max_prompt_tokens"], tokens)
+        stats["folded_steps"] = folded
+
+    def get_context_stats(self) -> Dict[str, Any]:
+        stats = dict(self.context_stats)
+        stats["avg_prompt_tokens"] = round(stats["prompt_tokens"] / stats["calls"]) if stats["calls"] else 0
+        stats["budget"] = self.budget.max_tokens
+        stream = self.stream_stats
+        if stream["calls"]:
+            stats["avg_time_to_action"] = round(stream["time_to_action_total"] / stream["calls"], 3)
+            stats["avg_completion_time"] = round(stream["completion_total"] / stream["calls"], 3)
+            stats["early_actions"] = stream["early_actions"]
+        return stats
+
     async def close(self):
-        await self.client.aclose()
+        if self._completion:
+            self._completion.cancel()
+        if self.client:
+            await self.client.aclose()
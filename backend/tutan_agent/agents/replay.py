@@ -0,0 +1,112 @@
+import hashlib
+import json
+from typing import List, Dict, Any, Optional, Tuple
+from loguru import logger
+
+from tutan_agent.core.ref_system import RefNode
+
+
+def element_key(node: RefNode) -> Tuple[str, str, str, str]:
+    """Identity of an element across runs: its eN ref ID is not stable, this is."""
+    return node.resource_id, node.role, node.text, node.content_description
+
+
+def _digest(key: Tuple[str, ...]) -> str:
+    return hashlib.sha1("\x1f".join(key).encode("utf-8")).hexdigest()[:12]
+
+
+def screen_signature(refs: Dict[str, RefNode]) -> List[str]:
+    """Sorted short hashes of the actionable elements on screen."""
+    return sorted(_digest(element_key(node)) for node in refs.values() if node.clickable or node.editable)
+
+
+def similarity(a: List[str], b: List[str]) -> float:
+    if not a and not b:
+        return 1.0
+    sa, sb = set(a), set(b)
+    return len(sa & sb) / len(sa | sb)
+
+
+def step_fingerprint(refs: Dict[str, RefNode], params: Dict[str, Any]) -> Dict[str, Any]:
+    """What a replay has to find again: the screen, and the element the step acted on."""
+    fingerprint: Dict[str, Any] = {"screen": screen_signature(refs)}
+    node = refs.get((params or {}).get("ref_id"))
+    if node is not None:
+        fingerprint["target"] = {
+            "resource_id": node.resource_id,
+            "role": node.role,
+            "text": node.text,
+            "label": node.content_description,
+            "center": list(node.center())
+        }
+    return fingerprint
+
+
+# execute_action reports these as not performed, so their steps are recorded as "failed"
+UNREPORTED_ACTIONS = {"scroll", "wait", "finish"}
+
+
+class TrajectoryReplayer:
+    """
+    Re-runs the successful steps (and scroll/wait/finish steps) of a recorded session
+    without the planner.
+    Each recorded step is checked against the live screen: the actionable-element
+    signature must be at least `min_similarity` alike, and the element it acted on must
+    be found again by resource id, role, text and label (nearest to its recorded
+    position if several match), whose current ref ID then replaces the recorded one.
+    When the screen diverges the caller plans that step itself; the replayer then looks
+    `lookahead` steps ahead to pick the recording up again.
+    """
+    def __init__(self, steps: List[Dict[str, Any]], min_similarity: float = 0.8, lookahead: int = 2):
+        self.steps = [step for step in steps if step.get("fingerprint")
+                      and (step.get("result") == "success" or step.get("action") in UNREPORTED_ACTIONS)]
+        self.min_similarity = min_similarity
+        self.lookahead = lookahead
+        self.cursor = 0
+        self.stats = {"replayed": 0, "diverged": 0, "recorded": len(self.steps)}
+
+    @property
+    def exhausted(self) -> bool:
+        return self.cursor >= len(self.steps)
+
+    @staticmethod
+    def _resolve(target: Dict[str, Any], refs: Dict[str, RefNode]) -> Optional[str]:
+        key = (target["resource_id"], target["role"], target["text"], target["label"])
+        candidates = [node for node in refs.values() if element_key(node) == key]
+        if not candidates:
+            return None
+        cx, cy = target.get("center") or (0, 0)
+        best = min(candidates, key=lambda n: (n.center()[0] - cx) ** 2 + (n.center()[1] - cy) ** 2)
+        return best.ref_id
+
+    def _match(self, step: Dict[str, Any], refs: Dict[str, RefNode], signature: List[str]) -> Optional[Dict[str, Any]]:
+        fingerprint = step["fingerprint"]
+        if isinstance(fingerprint, str):
+            fingerprint = json.loads(fingerprint)
+        if similarity(fingerprint["screen"], signature) < self.min_similarity:
+            return None
+        params = step["params"]
+        params = dict(json.loads(params) if isinstance(params, str) else params or {})
+        if "target" in fingerprint:
+            ref_id = self._resolve(fingerprint["target"], refs)
+            if ref_id is None:
+                return None
+            params["ref_id"] = ref_id
+        return {"action": step["action"], "params": params, "thinking": step.get("thinking") or ""}
+
+    def next_plan(self, refs: Dict[str, RefNode]) -> Optional[Dict[str, Any]]:
+        """The recorded plan for the current screen, or None if the planner must decide."""
+        if self.exhausted or not refs:
+            return None
+        signature = screen_signature(refs)
+        for offset in range(min(self.lookahead + 1, len(self.steps) - self.cursor)):
+            step = self.steps[self.cursor + offset]
+            plan = self._match(step, refs, signature)
+            if plan is not None:
+                self.cursor += offset + 1
+                self.stats["replayed"] += 1
+                plan["replayed_step"] = step["step_number"]
+                return plan
+        self.stats["diverged"] += 1
+        logger.info(f"Screen diverged from recorded step {self.steps[self.cursor]['step_number']}, planning")
+        return None
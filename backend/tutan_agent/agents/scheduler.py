@@ -0,0 +1,275 @@
+import asyncio
+import bisect
+import itertools
+import os
+import time
+import uuid
+from collections import deque
+from typing import Callable, Awaitable, Dict, Any, List, Optional
+from loguru import logger
+
+from tutan_agent.core.session_store import SessionStore
+
+# Terminal task states
+FINISHED_STATES = ("completed", "failed", "aborted", "timeout", "cancelled")
+
+
+class ScheduledTask:
+    """One queued agent task and its placement constraints."""
+    def __init__(self, task: str, priority: int = 0, device_serial: Optional[str] = None,
+                 device_model: Optional[str] = None, task_id: Optional[str] = None,
+                 submitted_at: Optional[float] = None, replay_session: Optional[str] = None):
+        self.id = task_id or str(uuid.uuid4())
+        self.task = task
+        # Recorded session to replay instead of planning every step
+        self.replay_session = replay_session
+        self.priority = priority
+        self.device_serial = device_serial
+        self.device_model = device_model
+        self.status = "pending"
+        self.assigned_serial: Optional[str] = None
+        self.session_id: Optional[str] = None
+        self.error: Optional[str] = None
+        self.submitted_at = submitted_at or time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def matches(self, device) -> bool:
+        if self.device_serial and device.serial != self.device_serial:
+            return False
+        if self.device_model and device.model != self.device_model:
+            return False
+        return True
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "task": self.task,
+            "priority": self.priority,
+            "device_serial": self.device_serial,
+            "device_model": self.device_model,
+            "status": self.status,
+            "assigned_serial": self.assigned_serial,
+            "session_id": self.session_id,
+            "error": self.error,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "replay_session": self.replay_session
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ScheduledTask":
+        task = cls(data["task"], data.get("priority") or 0, data.get("device_serial"),
+                   data.get("device_model"), data["id"], data["submitted_at"], data.get("replay_session"))
+        task.session_id = data.get("session_id")
+        return task
+
+
+class TaskScheduler:
+    """
+    Queue and worker pool for agent tasks across devices.
+    Tasks are persisted in the SessionStore and dispatched highest priority first (FIFO
+    within a priority) onto any idle, online device that matches their serial/model
+    constraints. Each device runs at most one task at a time, and all agents share a
+    global limit on concurrent LLM calls.
+    """
+    def __init__(self, agent_factory: Callable[[str], Awaitable[Any]], devices_provider: Callable[[], List[Any]],
+                 store: Optional[SessionStore] = None, on_event: Optional[Callable[[ScheduledTask, Dict[str, Any]], Awaitable[None]]] = None,
+                 max_llm_concurrency: Optional[int] = None, poll_interval: float = 2.0):
+        self.agent_factory = agent_factory
+        self.devices_provider = devices_provider
+        self.store = store or SessionStore()
+        self.on_event = on_event
+        self.max_llm_concurrency = max_llm_concurrency or int(os.environ.get("TUTAN_MAX_LLM_CONCURRENCY", "8"))
+        self.poll_interval = poll_interval
+        self.llm_slots: Optional[asyncio.Semaphore] = None
+        self._pending: List[tuple] = []  # sorted (-priority, submitted_at, seq, task)
+        self._seq = itertools.count()
+        self._tasks: Dict[str, ScheduledTask] = {}
+        self._running: Dict[str, ScheduledTask] = {}  # serial -> task
+        self._agents: Dict[str, Any] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._aborting: set = set()
+        self._stopping = False
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._wait_times: deque = deque(maxlen=1000)
+        self.stats = {"submitted": 0, "started": 0, "finished": 0}
+
+    # --- Lifecycle ---
+
+    def start(self):
+        """Recover unfinished tasks from the store and start dispatching."""
+        self.llm_slots = asyncio.Semaphore(self.max_llm_concurrency)
+        self._wakeup = asyncio.Event()
+        recovered = self.store.get_tasks(["pending", "running"], limit=-1)
+        for data in recovered:
+            # Tasks that were running when the process died start over
+            self._enqueue(ScheduledTask.from_dict(data))
+        if recovered:
+            logger.info(f"Recovered {len(recovered)} queued tasks")
+        self._loop_task = asyncio.create_task(self._dispatch_loop())
+
+    async def stop(self):
+        """Stop dispatching; running tasks are interrupted and requeued for the next start."""
+        self._stopping = True
+        if self._loop_task:
+            self._loop_task.cancel()
+        for worker in list(self._workers.values()):
+            worker.cancel()
+        await asyncio.gather(*self._workers.values(), return_exceptions=True)
+
+    def notify(self):
+        """Re-run placement now (e.g. after a device connected)."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    # --- Queue ---
+
+    def _enqueue(self, task: ScheduledTask):
+        task.status = "pending"
+        task.assigned_serial = None
+        self._tasks[task.id] = task
+        bisect.insort(self._pending, (-task.priority, task.submitted_at, next(self._seq), task),
+                      key=lambda entry: entry[:3])
+        self.store.save_task(task.to_dict())
+
+    def submit(self, task: str, priority: int = 0, device_serial: Optional[str] = None,
+               device_model: Optional[str] = None, replay_session: Optional[str] = None) -> ScheduledTask:
+        scheduled = ScheduledTask(task, priority, device_serial, device_model, replay_session=replay_session)
+        self._enqueue(scheduled)
+        self.stats["submitted"] += 1
+        self.notify()
+        return scheduled
+
+    async def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        task = self._tasks.get(task_id)
+        return task.to_dict() if task else await self.store.get_task_async(task_id)
+
+    def cancel(self, task_id: str) -> bool:
+        """Drop a pending task or abort a running one."""
+        task = self._tasks.get(task_id)
+        if task is None or task.status in FINISHED_STATES:
+            return False
+        if task.status == "pending":
+            self._pending = [entry for entry in self._pending if entry[3] is not task]
+            self._finish(task, "cancelled")
+        else:
+            self._aborting.add(task.id)
+            agent = self._agents.get(task.assigned_serial)
+            if agent is not None:
+                agent.abort()
+            else:
+                self._workers[task.id].cancel()
+        return True
+
+    # --- Dispatch ---
+
+    async def _dispatch_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if not self._pending:
+                continue
+            try:
+                await self._dispatch()
+            except Exception as e:
+                logger.error(f"Task dispatch failed: {e}")
+
+    async def _dispatch(self):
+        devices = await asyncio.to_thread(self.devices_provider)
+        idle = [d for d in devices if d.status == "device" and d.serial not in self._running]
+        if not idle:
+            return
+
+        remaining = []
+        for entry in self._pending:
+            task = entry[3]
+            device = next((d for d in idle if task.matches(d)), None)
+            if device is None:
+                remaining.append(entry)
+                continue
+            idle.remove(device)
+            self._launch(task, device.serial)
+        self._pending = remaining
+
+    def _launch(self, task: ScheduledTask, serial: str):
+        task.status = "running"
+        task.assigned_serial = serial
+        task.started_at = time.time()
+        self._running[serial] = task
+        self._wait_times.append(task.started_at - task.submitted_at)
+        self.stats["started"] += 1
+        self.store.save_task(task.to_dict())
+        self._workers[task.id] = asyncio.create_task(self._run(task, serial))
+
+    async def _run(self, task: ScheduledTask, serial: str):
+        status, error = "failed", None
+        try:
+            agent = await self.agent_factory(serial)
+            agent.planner.llm_slots = self.llm_slots
+            self._agents[serial] = agent
+            events = agent.stream_task(task.task, replay_session=task.replay_session) if task.replay_session \
+                else agent.stream_task(task.task)
+            async for event in events:
+                if event["type"] == "status" and "session_id" in event["data"]:
+                    task.session_id = event["data"]["session_id"]
+                elif event["type"] == "done":
+                    status = "completed"
+                elif event["type"] == "error":
+                    error = event["data"].get("message")
+                    status = "timeout" if error == "Maximum steps reached" else "failed"
+                if self.on_event:
+                    await self.on_event(task, event)
+        except asyncio.CancelledError:
+            status = "pending" if self._stopping else "aborted"
+        except Exception as e:
+            logger.exception(f"Task {task.id} crashed on {serial}: {e}")
+            error = str(e)
+        finally:
+            self._running.pop(serial, None)
+            self._agents.pop(serial, None)
+            self._workers.pop(task.id, None)
+            if task.id in self._aborting:
+                self._aborting.discard(task.id)
+                status = "aborted"
+            task.error = error
+            if status == "pending":
+                task.status = "pending"
+                self.store.save_task(task.to_dict())
+            else:
+                self._finish(task, status)
+                self.notify()
+
+    def _finish(self, task: ScheduledTask, status: str):
+        task.status = status
+        task.finished_at = time.time()
+        self.stats["finished"] += 1
+        self.store.save_task(task.to_dict())
+        # Finished tasks are served from the store
+        self._tasks.pop(task.id, None)
+
+    def running_task(self, serial: str) -> Optional[ScheduledTask]:
+        return self._running.get(serial)
+
+    def get_stats(self) -> Dict[str, Any]:
+        now = time.time()
+        by_priority: Dict[int, int] = {}
+        for entry in self._pending:
+            by_priority[-entry[0]] = by_priority.get(-entry[0], 0) + 1
+        waits = list(self._wait_times)
+        return {
+            "queue_depth": len(self._pending),
+            "queue_by_priority": by_priority,
+            "oldest_wait": round(now - min(e[3].submitted_at for e in self._pending), 3) if self._pending else 0.0,
+            "avg_wait": round(sum(waits) / len(waits), 3) if waits else 0.0,
+            "max_wait": round(max(waits), 3) if waits else 0.0,
+            "running": {serial: task.id for serial, task in self._running.items()},
+            "llm_limit": self.max_llm_concurrency,
+            "llm_in_flight": self.max_llm_concurrency - self.llm_slots._value if self.llm_slots else 0,
+            **self.stats
+        }
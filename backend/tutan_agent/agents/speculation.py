@@ -0,0 +1,99 @@
+import asyncio
+import hashlib
+import re
+from typing import List, Dict, Any, Optional
+from loguru import logger
+
+from tutan_agent.agents.plan_cache import normalize_ui_context
+
+_TEXT_ATTR = re.compile(r' text="(?:[^"\\]|\\.)*"')
+
+
+def context_fingerprint(ui_context: str) -> str:
+    return hashlib.sha1(normalize_ui_context(ui_context).encode("utf-8")).hexdigest()
+
+
+def predict_next_context(ui_context: str, action: str, params: Dict[str, Any]) -> Optional[str]:
+    """
+    The UI context expected after `action`, for actions whose effect on the tree is
+    known in advance: typing only changes the field's text, and focusing a field or
+    waiting leaves the screen as it is. None when the next screen can't be predicted.
+    """
+    if action == "wait":
+        return ui_context
+    ref_id = (params or {}).get("ref_id")
+    if not ref_id:
+        return None
+    prefix = f"[{ref_id}] "
+    lines = ui_context.split("\n")
+    for i, line in enumerate(lines):
+        if not line.startswith(prefix) or "[editable]" not in line:
+            continue
+        if action == "click":
+            return ui_context
+        if action == "type":
+            text = f' text="{params.get("text", "")}"'
+            if _TEXT_ATTR.search(line):
+                lines[i] = _TEXT_ATTR.sub(lambda _: text, line, count=1)
+            else:
+                # Role is the second token; text follows it (see RefSystem.format_node)
+                head, _, tail = line.partition(" ")
+                role, _, rest = tail.partition(" ")
+                lines[i] = f"{head} {role}{text}" + (f" {rest}" if rest else "")
+            return "\n".join(lines)
+        return None
+    return None
+
+
+class Speculator:
+    """
+    Plans step N+1 while step N is still settling.
+    After a successful action with a predictable effect, a second planner is asked for
+    the next step on the predicted screen, with the history as it will be by then. The
+    result is only used if the screen actually perceived next has the predicted
+    fingerprint; otherwise the request is cancelled and the step is planned normally.
+    """
+    def __init__(self, planner):
+        self.planner = planner
+        self._task: Optional[asyncio.Task] = None
+        self._expected: Optional[str] = None
+        self.stats = {"launched": 0, "hits": 0, "misses": 0, "errors": 0}
+
+    def launch(self, task: str, ui_context: str, action: str, params: Dict[str, Any],
+               history: List[Dict[str, str]], llm_slots: Optional[asyncio.Semaphore] = None) -> bool:
+        self.cancel()
+        predicted = predict_next_context(ui_context, action, params)
+        if predicted is None:
+            return False
+        self.planner.llm_slots = llm_slots
+        self._expected = context_fingerprint(predicted)
+        self._task = asyncio.create_task(self.planner.plan_next_step(task, predicted, list(history)))
+        self.stats["launched"] += 1
+        return True
+
+    async def take(self, ui_context: str) -> Optional[Dict[str, Any]]:
+        """The speculative plan if `ui_context` is the predicted screen, else None."""
+        pending, expected = self._task, self._expected
+        self._task = self._expected = None
+        if pending is None:
+            return None
+        if context_fingerprint(ui_context) != expected:
+            pending.cancel()
+            self.stats["misses"] += 1
+            return None
+        plan = await pending
+        if "error" in plan:
+            self.stats["errors"] += 1
+            return None
+        self.stats["hits"] += 1
+        logger.debug(f"Speculative plan used: {plan.get('action')}")
+        return plan
+
+    def cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = self._expected = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        settled = self.stats["hits"] + self.stats["misses"]
+        return dict(self.stats, hit_rate=round(self.stats["hits"] / settled, 3) if settled else 0.0)
@@ -0,0 +1,180 @@
+import asyncio
+import gzip
+import hashlib
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Any, Optional, Set, Tuple
+from loguru import logger
+
+try:
+    import zstandard as zstd  # Optional: smaller and faster than gzip for aria trees
+except ImportError:
+    zstd = None
+
+KIND_SCREENSHOT = "screenshots"
+KIND_TREE = "trees"
+
+MEDIA_TYPES = {
+    ".jpg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+    ".json.zst": "application/json",
+    ".json.gz": "application/json",
+}
+
+_ARTIFACT_ID = re.compile(r"^(screenshots|trees)/[0-9a-f]{64}(\.jpg|\.png|\.webp|\.json\.zst|\.json\.gz)$")
+
+# Artifact writes are disk-bound and never on the agent's critical path
+_write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="artifacts")
+
+
+def _image_ext(data: bytes) -> str:
+    if data.startswith(b"\x89PNG"):
+        return ".png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return ".webp"
+    return ".jpg"
+
+
+class ArtifactStore:
+    """
+    Content-addressed store for step screenshots and raw aria trees.
+    Artifacts are named by the SHA-256 of their content, so an unchanged screen is
+    stored once no matter how many steps reference it. `put_*` returns the artifact id
+    right away and writes on a background thread; trees are compressed with zstd (gzip
+    without the zstandard package). Retention drops artifacts past `max_age_days`, then
+    the least recently written ones until the store fits in `max_bytes`.
+    """
+    def __init__(self, root: Optional[str] = None, max_bytes: Optional[int] = None,
+                 max_age_days: Optional[float] = None, retention_every: int = 500):
+        self.root = root or os.environ.get("TUTAN_ARTIFACT_DIR", "tutan_artifacts")
+        self.max_bytes = max_bytes or int(os.environ.get("TUTAN_ARTIFACT_MAX_MB", "2048")) * 1024 * 1024
+        self.max_age_days = max_age_days or float(os.environ.get("TUTAN_ARTIFACT_MAX_AGE_DAYS", "30"))
+        self.retention_every = retention_every
+        # Futures are added on the loop and discarded by done-callbacks on the writer thread
+        self._pending: Set[Future] = set()
+        self._pending_lock = threading.Lock()
+        self._writes_since_retention = 0
+        self.stats = {"written": 0, "deduplicated": 0, "bytes_written": 0, "evicted": 0, "errors": 0}
+
+    def _path(self, artifact_id: str) -> str:
+        return os.path.join(self.root, *artifact_id.split("/"))
+
+    def _submit(self, kind: str, data: bytes, ext: str, compress: bool) -> str:
+        artifact_id = f"{kind}/{hashlib.sha256(data).hexdigest()}{ext}"
+        future = _write_executor.submit(self._write, artifact_id, data, compress)
+        with self._pending_lock:
+            self._pending.add(future)
+        future.add_done_callback(self._written)
+        return artifact_id
+
+    def _written(self, future: Future):
+        with self._pending_lock:
+            self._pending.discard(future)
+
+    def put_screenshot(self, data: Optional[bytes]) -> Optional[str]:
+        """Queue an encoded screenshot; returns its artifact id."""
+        if not data:
+            return None
+        return self._submit(KIND_SCREENSHOT, data, _image_ext(data), compress=False)
+
+    def put_tree(self, data: Optional[bytes]) -> Optional[str]:
+        """Queue a raw /aria-tree JSON body; returns its artifact id."""
+        if not data:
+            return None
+        return self._submit(KIND_TREE, data, ".json.zst" if zstd else ".json.gz", compress=True)
+
+    def _write(self, artifact_id: str, data: bytes, compress: bool):
+        path = self._path(artifact_id)
+        try:
+            if os.path.exists(path):
+                # Refresh the mtime so retention treats it as recently used
+                os.utime(path)
+                self.stats["deduplicated"] += 1
+                return
+            if compress:
+                data = zstd.ZstdCompressor(level=3).compress(data) if zstd else gzip.compress(data, 6)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            self.stats["written"] += 1
+            self.stats["bytes_written"] += len(data)
+        except OSError as e:
+            self.stats["errors"] += 1
+            logger.warning(f"Failed to write artifact {artifact_id}: {e}")
+            return
+
+        self._writes_since_retention += 1
+        if self._writes_since_retention >= self.retention_every:
+            self._writes_since_retention = 0
+            self.enforce_retention()
+
+    async def flush(self):
+        """Wait until every queued artifact is on disk."""
+        with self._pending_lock:
+            pending = list(self._pending)
+        if pending:
+            await asyncio.gather(*(asyncio.wrap_future(f) for f in pending), return_exceptions=True)
+
+    def enforce_retention(self) -> int:
+        """Apply the age and size limits; returns the number of artifacts removed."""
+        files = []
+        for kind in (KIND_SCREENSHOT, KIND_TREE):
+            for dirpath, _, names in os.walk(os.path.join(self.root, kind)):
+                for name in names:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((st.st_mtime, st.st_size, path))
+
+        cutoff = time.time() - self.max_age_days * 86400
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for mtime, size, path in sorted(files):
+            if mtime >= cutoff and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        self.stats["evicted"] += removed
+        if removed:
+            logger.info(f"Artifact retention removed {removed} files ({total / 1024 / 1024:.1f} MB kept)")
+        return removed
+
+    def read(self, artifact_id: str) -> Optional[Tuple[bytes, str]]:
+        """Load an artifact (trees decompressed); returns (data, media type) or None."""
+        match = _ARTIFACT_ID.match(artifact_id)
+        if not match:
+            raise ValueError(f"Invalid artifact id {artifact_id}")
+        ext = match.group(2)
+        try:
+            with open(self._path(artifact_id), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if ext == ".json.zst":
+            if zstd is None:
+                raise RuntimeError("Reading .zst artifacts requires the zstandard package")
+            data = zstd.ZstdDecompressor().decompress(data)
+        elif ext == ".json.gz":
+            data = gzip.decompress(data)
+        return data, MEDIA_TYPES[ext]
+
+    async def read_async(self, artifact_id: str) -> Optional[Tuple[bytes, str]]:
+        return await asyncio.to_thread(self.read, artifact_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.stats, queued=len(self._pending), root=os.path.abspath(self.root))
+
+
+artifact_store = ArtifactStore()
@@ -1,29 +1,63 @@
 import httpx
 import asyncio
+import os
+import shlex
 from typing import Dict, Any, Optional, Tuple
 from loguru import logger
 from PIL import Image
 import io
 
-from tutan_agent.core.ref_system import RefSystem, RefNode
+from tutan_agent.core.ref_system import RefSystem, RefNode, AriaTreeStreamParser
+from tutan_agent.core.scrcpy import ANDROID_KEYCODES
+from tutan_agent.core.screenshot import ScreenshotPipeline, ScreenshotFrame
 
 class DeviceController:
     """
     Hybrid Device Controller for TUTAN_AGENT.
     Implements intelligent fallback: Accessibility Service -> ADB shell -> Vision (VLM).
     """
-    def __init__(self, serial: str, port: int = 8080):
+    def __init__(self, serial: str, port: int = 8080, incremental_refs: bool = False,
+                 streaming_parse: Optional[bool] = None):
         self.serial = serial
         self.base_url = f"http://localhost:{port}"
-        self.ref_system = RefSystem()
+        self.ref_system = RefSystem(incremental=incremental_refs)
         self.client = httpx.AsyncClient(timeout=15.0)
         self._use_accessibility = True
+        if streaming_parse is None:
+            streaming_parse = os.environ.get("TUTAN_STREAMING_PARSE", "0") == "1"
+        if streaming_parse and not AriaTreeStreamParser.available():
+            logger.warning("Streaming aria-tree parse requested but ijson is not installed; using buffered parse")
+            streaming_parse = False
+        self.streaming_parse = streaming_parse
+        # "scrcpy" injects input through an attached ScrcpyStreamer's control socket
+        self.input_mode = os.environ.get("TUTAN_INPUT_MODE", "shell")
+        self.scrcpy = None
+        self.screenshots = ScreenshotPipeline(serial)
+        # Raw /aria-tree body behind the last UI context, kept for the artifact store
+        self.last_aria_tree: Optional[bytes] = None
+
+    def attach_scrcpy(self, streamer):
+        """
+        Attach a running ScrcpyStreamer: its screen monitor drives settle detection, and
+        it injects input when input_mode is "scrcpy".
+        """
+        self.scrcpy = streamer
+
+    @property
+    def screen_monitor(self):
+        """ScreenChangeMonitor of the attached stream, if it is live."""
+        if self.scrcpy is not None and self.scrcpy.monitor.live:
+            return self.scrcpy.monitor
+        return None
+
+    def _scrcpy_input(self) -> bool:
+        return self.input_mode == "scrcpy" and self.scrcpy is not None and self.scrcpy.control_ready
 
     async def setup_forwarding(self):
         """Setup ADB port forwarding for the Helper App."""
         from tutan_agent.adb.manager import ADBManager
         adb = ADBManager()
-        code, stdout, stderr = adb._execute(["-s", self.serial, "forward", f"tcp:8080", "tcp:8080"])
+        code, stdout, stderr = await adb.execute_async(["-s", self.serial, "forward", f"tcp:8080", "tcp:8080"])
         if code == 0:
             logger.info(f"Port forwarding established for {self.serial}")
         else:
@@ -37,13 +71,20 @@ class DeviceController:
         # 1. Try Accessibility Service (Aria Tree)
         if self._use_accessibility:
             try:
-                response = await self.client.get(f"{self.base_url}/aria-tree")
-                if response.status_code == 200:
-                    tree_json = response.json()
-                    context = self.ref_system.parse_aria_tree(tree_json)
-                    
+                if self.streaming_parse:
+                    context = await self._stream_aria_tree()
+                else:
+                    context = None
+                    response = await self.client.get(f"{self.base_url}/aria-tree")
+                    if response.status_code == 200:
+                        self.last_aria_tree = response.content
+                        tree_json = response.json()
+                        context = self.ref_system.parse_aria_tree(tree_json)
+
+                if context is not None:
                     # Store current nodes for visual debugging
                     self.current_nodes = self.ref_system.current_refs
+                    self.current_lines = dict(self.ref_system.current_lines)
                     
                     return context, "accessibility"
             except Exception as e:
@@ -53,8 +94,36 @@ class DeviceController:
         # 2. Fallback to ADB + Vision (Placeholder)
         logger.info("Falling back to ADB/Vision for context")
         self.current_nodes = {}
+        self.current_lines = {}
+        self.last_aria_tree = None
         return "UI Context unavailable via Accessibility. Please use visual reasoning.", "vision"
 
+    async def _stream_aria_tree(self) -> Optional[str]:
+        """Parse /aria-tree while the body is still arriving over the ADB forward."""
+        async with self.client.stream("GET", f"{self.base_url}/aria-tree") as response:
+            if response.status_code != 200:
+                return None
+            parser = AriaTreeStreamParser(self.ref_system)
+            chunks = []
+            async for chunk in response.aiter_bytes():
+                parser.feed(chunk)
+                chunks.append(chunk)
+            context = parser.close()
+            self.last_aria_tree = b"".join(chunks)
+            return context
+
+    async def get_aria_tree_raw(self) -> Optional[bytes]:
+        """Fetch the raw /aria-tree body without parsing it (used for cheap change detection)."""
+        if not self._use_accessibility:
+            return None
+        try:
+            response = await self.client.get(f"{self.base_url}/aria-tree")
+            if response.status_code == 200:
+                return response.content
+        except Exception as e:
+            logger.debug(f"Raw aria tree fetch failed: {e}")
+        return None
+
     def get_current_nodes(self) -> Dict[str, Any]:
         """Return serialized current nodes for frontend overlay."""
         return {
@@ -66,6 +135,10 @@ class DeviceController:
             } for ref_id, node in getattr(self, "current_nodes", {}).items()
         }
 
+    def get_current_lines(self) -> Dict[str, str]:
+        """Return the ref_id -> context line map of the last parse (for delta computation)."""
+        return getattr(self, "current_lines", {})
+
     async def execute_action(self, action: str, params: Dict[str, Any]) -> bool:
         """Execute action with intelligent fallback."""
         if action == "click":
@@ -93,9 +166,7 @@ class DeviceController:
             logger.error(f"Ref ID {ref_id} not found")
             return False
         
-        bounds = node.bounds
-        x = (bounds["left"] + bounds["right"]) // 2
-        y = (bounds["top"] + bounds["bottom"]) // 2
+        x, y = node.center()
         
         # Try Accessibility Tap first
         if self._use_accessibility:
@@ -114,10 +185,12 @@ class DeviceController:
             return False
 
     async def adb_tap(self, x: int, y: int) -> bool:
-        """Tap via ADB Shell."""
+        """Tap via scrcpy control socket or the device's persistent ADB shell."""
+        if self._scrcpy_input() and await self.scrcpy.inject_tap(x, y):
+            return True
         from tutan_agent.adb.manager import ADBManager
         adb = ADBManager()
-        code, _, _ = adb._execute(["-s", self.serial, "shell", "input", "tap", str(x), str(y)])
+        code, _ = await adb.run_shell(self.serial, f"input tap {x} {y}")
         return code == 0
 
     async def type_text(self, ref_id: Optional[str], text: str) -> bool:
@@ -125,30 +198,36 @@ class DeviceController:
         if ref_id:
             await self.click_ref(ref_id) # Focus the element
             await asyncio.sleep(0.5)
-        
+
+        # scrcpy can only inject characters that map to key events
+        if self._scrcpy_input() and text.isascii():
+            await self.scrcpy.inject_text(text)
+            return True
+
         from tutan_agent.adb.manager import ADBManager
         adb = ADBManager()
         # Use ADB for typing (more reliable for now)
         escaped_text = text.replace(" ", "%s")
-        code, _, _ = adb._execute(["-s", self.serial, "shell", "input", "text", escaped_text])
+        code, _ = await adb.run_shell(self.serial, f"input text {shlex.quote(escaped_text)}")
         return code == 0
 
     async def send_key(self, key: str) -> bool:
         """Send system key event."""
+        if self._scrcpy_input() and key in ANDROID_KEYCODES:
+            await self.scrcpy.inject_keycode(ANDROID_KEYCODES[key])
+            return True
         from tutan_agent.adb.manager import ADBManager
         adb = ADBManager()
-        code, _, _ = adb._execute(["-s", self.serial, "shell", "input", "keyevent", key])
+        code, _ = await adb.run_shell(self.serial, f"input keyevent {shlex.quote(key)}")
         return code == 0
 
-    async def get_screenshot(self) -> Optional[bytes]:
-        """Get screenshot via ADB."""
-        from tutan_agent.adb.manager import ADBManager
-        adb = ADBManager()
-        # Simplified: use adb exec-out for speed
-        cmd = [adb.adb_path, "-s", self.serial, "exec-out", "screencap", "-p"]
-        process = await asyncio.create_subprocess_exec(*cmd, stdout=subprocess.PIPE)
-        stdout, _ = await process.communicate()
-        return stdout if process.returncode == 0 else None
+    async def get_screenshot(self, step: Optional[int] = None) -> Optional[bytes]:
+        """Get a downscaled, re-encoded screenshot (see ScreenshotPipeline)."""
+        frame = await self.get_screenshot_frame(step)
+        return frame.data if frame else None
+
+    async def get_screenshot_frame(self, step: Optional[int] = None) -> Optional[ScreenshotFrame]:
+        return await self.screenshots.capture(step)
 
     async def close(self):
         await self.client.aclose()
@@ -0,0 +1,156 @@
+import asyncio
+import os
+from typing import Callable, Awaitable, Dict, Any, Optional, Tuple
+from loguru import logger
+
+from tutan_agent.agents.base import TutanAgent
+from tutan_agent.agents.plan_cache import plan_cache
+from tutan_agent.agents.llm_gateway import llm_gateway
+from tutan_agent.core.scrcpy import ScrcpyStreamer
+from tutan_agent.core.screenshot import ScreenshotPipeline, frame_cache
+
+
+def default_model_config() -> Dict[str, str]:
+    """Model config from the environment (can be overridden per agent via the API)."""
+    return {
+        "api_key": os.environ.get("OPENAI_API_KEY", "EMPTY"),
+        "base_url": os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+        "model_name": os.environ.get("OPENAI_MODEL", "gpt-4o"),
+        "stream": os.environ.get("TUTAN_LLM_STREAM", "0"),
+        "plan_cache": os.environ.get("TUTAN_PLAN_CACHE", "0"),
+        "app_version": os.environ.get("TUTAN_APP_VERSION", ""),
+        "speculative": os.environ.get("TUTAN_SPECULATIVE", "0"),
+        "rule_routing": os.environ.get("TUTAN_RULE_ROUTING", "0"),
+        # Optional fast model tried before OPENAI_MODEL (same endpoint and key unless set)
+        "small_model_name": os.environ.get("TUTAN_SMALL_MODEL", ""),
+        "small_base_url": os.environ.get("TUTAN_SMALL_BASE_URL", ""),
+        "small_api_key": os.environ.get("TUTAN_SMALL_API_KEY", "")
+    }
+
+
+class DeviceHost:
+    """
+    Owns the TutanAgent, DeviceController and ScrcpyStreamer of every device served by
+    this process. The API process uses one directly; in sharded mode each worker process
+    runs one and the ShardRouter exposes the same interface over IPC.
+    """
+    def __init__(self, hub, emit: Callable[[str, Dict[str, Any]], Awaitable[None]],
+                 model_config: Optional[Dict[str, str]] = None, port_base: int = 27183, port_count: int = 1000):
+        self.hub = hub
+        self.emit = emit
+        self.model_config = model_config or default_model_config()
+        self.ports = range(port_base, port_base + port_count)
+        self.agents: Dict[str, TutanAgent] = {}
+        self.streams: Dict[str, ScrcpyStreamer] = {}
+
+    # --- Agents ---
+
+    async def start_agent(self, serial: str, overrides: Optional[Dict[str, str]] = None,
+                          incremental: bool = False) -> bool:
+        """Create and initialize the agent for `serial`; False if it already exists."""
+        if serial in self.agents:
+            return False
+        config = self.model_config.copy()
+        config.update({k: v for k, v in (overrides or {}).items() if v})
+        agent = TutanAgent(serial, config, incremental_context=incremental)
+        await agent.initialize()
+        if serial in self.streams:
+            agent.controller.attach_scrcpy(self.streams[serial])
+        self.agents[serial] = agent
+        return True
+
+    async def get_or_create_agent(self, serial: str) -> TutanAgent:
+        """Agent for a device, created with the default model config on first use."""
+        await self.start_agent(serial)
+        return self.agents[serial]
+
+    async def has_agent(self, serial: str) -> bool:
+        return serial in self.agents
+
+    async def abort(self, serial: str) -> bool:
+        if serial not in self.agents:
+            return False
+        self.agents[serial].abort()
+        return True
+
+    async def settle_stats(self, serial: Optional[str] = None) -> Dict[str, Any]:
+        agents = {serial: self.agents[serial]} if serial in self.agents else ({} if serial else self.agents)
+        return {s: agent.settle_detector.get_stats() for s, agent in agents.items()}
+
+    async def planner_stats(self, serial: Optional[str] = None) -> Dict[str, Any]:
+        agents = {serial: self.agents[serial]} if serial in self.agents else ({} if serial else self.agents)
+        return {
+            s: dict(agent.planner.get_context_stats(), routes=agent.router.get_stats(),
+                    speculation=agent.speculator.get_stats() if agent.speculator else None)
+            for s, agent in agents.items()
+        }
+
+    async def plan_cache_stats(self) -> Dict[str, Any]:
+        return plan_cache.get_stats()
+
+    async def gateway_stats(self) -> Dict[str, Any]:
+        return llm_gateway.get_stats()
+
+    async def invalidate_plan_cache(self, model: Optional[str] = None, app_version: Optional[str] = None,
+                                    memory_only: bool = False) -> int:
+        if memory_only:
+            await plan_cache.forget_async(model, app_version)
+            return 0
+        return await plan_cache.invalidate_async(model, app_version)
+
+    # --- Streams ---
+
+    async def start_stream(self, serial: str) -> bool:
+        """Start the scrcpy stream of `serial`; False if already running, RuntimeError on failure."""
+        if serial in self.streams:
+            return False
+
+        used_ports = {streamer.local_port for streamer in self.streams.values()}
+        port = next(p for p in self.ports if p not in used_ports)
+        streamer = ScrcpyStreamer(serial, self.hub, local_port=port)
+        await streamer.start()
+        if streamer.frame_size is None:
+            raise RuntimeError("Failed to start scrcpy stream")
+
+        def emit_screen_event(serial: str, state: str):
+            asyncio.create_task(self.emit("screen_event", {"serial": serial, "state": state}))
+        streamer.monitor.add_listener(emit_screen_event)
+
+        self.streams[serial] = streamer
+        if serial in self.agents:
+            self.agents[serial].controller.attach_scrcpy(streamer)
+        return True
+
+    async def stop_stream(self, serial: str) -> bool:
+        streamer = self.streams.pop(serial, None)
+        if not streamer:
+            return False
+        streamer.stop()
+        self.hub.clear(serial)
+        if serial in self.agents:
+            self.agents[serial].controller.attach_scrcpy(None)
+        return True
+
+    async def screen_stats(self) -> Dict[str, Any]:
+        return {serial: streamer.monitor.get_stats() for serial, streamer in self.streams.items()}
+
+    # --- Screenshots ---
+
+    async def screenshot(self, serial: str, step: Optional[int] = None,
+                         session_id: Optional[str] = None) -> Optional[Tuple[bytes, str]]:
+        """Cached frame for an agent step (of the latest or a given session), or a fresh capture."""
+        if step is not None:
+            frame = frame_cache.get(serial, step, session_id)
+        elif serial in self.agents:
+            frame = await self.agents[serial].controller.get_screenshot_frame()
+        else:
+            frame = await ScreenshotPipeline(serial).capture()
+        return (frame.data, frame.media_type) if frame else None
+
+    async def close(self):
+        for agent in self.agents.values():
+            await agent.stop()
+        for streamer in self.streams.values():
+            streamer.stop()
+        await llm_gateway.close()
+        logger.info(f"Device host closed ({len(self.agents)} agents, {len(self.streams)} streams)")
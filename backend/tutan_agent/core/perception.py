@@ -0,0 +1,108 @@
+import asyncio
+import hashlib
+import time
+from typing import Dict, Any, Optional
+from loguru import logger
+
+
+class UISnapshot:
+    """
+    One perception result: UI context text, the nodes it was built from and the screencap.
+    """
+    def __init__(self, ui_context: str, mode: str, nodes: Dict[str, Any], screenshot: Optional[bytes],
+                 lines: Optional[Dict[str, str]] = None, aria_tree: Optional[bytes] = None,
+                 refs: Optional[Dict[str, Any]] = None):
+        self.ui_context = ui_context
+        self.mode = mode
+        self.nodes = nodes
+        self.lines = lines or {}
+        # ref_id -> RefNode of this parse (the controller builds a new dict per parse)
+        self.refs = refs or {}
+        self.screenshot = screenshot
+        self.aria_tree = aria_tree
+        self.taken_at = time.time()
+        # Loop time the capture started, for comparison with screen-change timestamps
+        self.started: Optional[float] = None
+        self.fingerprint = hashlib.sha1(ui_context.encode("utf-8")).hexdigest()
+
+
+class PerceptionPipeline:
+    """
+    Pipelined perception for TutanAgent.
+    Fetches the aria tree and the screencap concurrently and can prefetch the next
+    snapshot while the agent is still busy with the previous step. A prefetched
+    snapshot is only reused if the UI has not changed since it was taken; with a live
+    scrcpy stream that is decided by the screen monitor without touching the device.
+    """
+    def __init__(self, controller):
+        self.controller = controller
+        self._pending: Optional[asyncio.Task] = None
+        self.stats = {"captured": 0, "reused": 0, "discarded": 0}
+
+    async def capture(self, step: Optional[int] = None) -> UISnapshot:
+        """Fetch UI context and screenshot at the same time."""
+        started = asyncio.get_running_loop().time()
+        (ui_context, mode), screenshot = await asyncio.gather(
+            self.controller.get_ui_context(),
+            self.controller.get_screenshot(step)
+        )
+        self.stats["captured"] += 1
+        snapshot = UISnapshot(ui_context, mode, self.controller.get_current_nodes(), screenshot,
+                              self.controller.get_current_lines(),
+                              getattr(self.controller, "last_aria_tree", None),
+                              getattr(self.controller, "current_nodes", None))
+        snapshot.started = started
+        return snapshot
+
+    def prefetch(self, step: Optional[int] = None):
+        """Start capturing the next snapshot in the background."""
+        self.cancel()
+        self._pending = asyncio.create_task(self.capture(step))
+
+    async def next_snapshot(self, step: Optional[int] = None) -> UISnapshot:
+        """
+        Return a snapshot of the current UI.
+        Reuses the prefetched snapshot when the UI context is unchanged; otherwise the
+        stale screenshot is thrown away and a fresh one is taken.
+        """
+        pending, self._pending = self._pending, None
+        if pending is None:
+            return await self.capture(step)
+
+        try:
+            prefetched = await pending
+        except Exception as e:
+            logger.warning(f"Prefetched perception failed, recapturing: {e}")
+            return await self.capture(step)
+
+        # The video stream saw no change since the capture began: the snapshot is current.
+        monitor = getattr(self.controller, "screen_monitor", None)
+        if monitor is not None and not monitor.changed_since(prefetched.started):
+            self.stats["reused"] += 1
+            return prefetched
+
+        # Cheap validation: re-read the aria tree only and compare fingerprints.
+        if prefetched.mode != "accessibility":
+            self.stats["discarded"] += 1
+            return await self.capture(step)
+
+        ui_context, mode = await self.controller.get_ui_context()
+        current = UISnapshot(ui_context, mode, self.controller.get_current_nodes(), None,
+                             self.controller.get_current_lines(),
+                             getattr(self.controller, "last_aria_tree", None),
+                             getattr(self.controller, "current_nodes", None))
+        if current.fingerprint == prefetched.fingerprint:
+            self.stats["reused"] += 1
+            current.screenshot = prefetched.screenshot
+            return current
+
+        logger.debug(f"UI changed since prefetch for {self.controller.serial}, discarding snapshot")
+        self.stats["discarded"] += 1
+        current.screenshot = await self.controller.get_screenshot(step)
+        return current
+
+    def cancel(self):
+        """Drop any in-flight prefetch."""
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
@@ -1,76 +1,256 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from dataclasses import dataclass
 
-@dataclass
+try:
+    import ijson  # Optional: enables AriaTreeStreamParser
+except ImportError:
+    ijson = None
+
+@dataclass(slots=True)
 class RefNode:
     ref_id: str
     role: str
     text: str
     content_description: str
     resource_id: str
-    bounds: Dict[str, int]
+    left: int
+    top: int
+    right: int
+    bottom: int
     clickable: bool
     editable: bool
 
+    @property
+    def bounds(self) -> Dict[str, int]:
+        return {"left": self.left, "top": self.top, "right": self.right, "bottom": self.bottom}
+
+    def center(self) -> Tuple[int, int]:
+        return (self.left + self.right) // 2, (self.top + self.bottom) // 2
+
 class RefSystem:
     """
     Semantic Reference System inspired by OpenClaw.
     Assigns stable IDs (e1, e2...) to UI elements for LLM reasoning.
+
+    In incremental mode, ref IDs survive across parses: nodes are keyed by a structural
+    fingerprint (resource_id, class path, bounds) and keep their ID while unchanged.
     """
-    def __init__(self):
+    def __init__(self, incremental: bool = False):
+        self.incremental = incremental
         self.current_refs: Dict[str, RefNode] = {}
+        self.current_lines: Dict[str, str] = {}
         self._ref_counter = 0
+        self._fingerprint_ids: Dict[Tuple, str] = {}
+        self._next_fingerprint_ids: Dict[Tuple, str] = {}
 
     def reset(self):
         self.current_refs = {}
+        self.current_lines = {}
         self._ref_counter = 0
+        self._fingerprint_ids = {}
+        self._next_fingerprint_ids = {}
 
     def parse_aria_tree(self, tree_json: Dict[str, Any]) -> str:
         """
         Convert raw Aria Tree JSON to a flattened reference map and return a text representation for LLM.
         """
-        self.reset()
-        flattened_nodes = []
-        self._traverse(tree_json, flattened_nodes)
-        
-        # Build text representation
-        lines = []
-        for node in flattened_nodes:
-            # Only include potentially interactive or informative nodes
-            if node.text or node.content_description or node.clickable or node.editable:
-                self.current_refs[node.ref_id] = node
-                desc = f"[{node.ref_id}] {node.role}"
-                if node.text:
-                    desc += f' text="{node.text}"'
-                if node.content_description:
-                    desc += f' label="{node.content_description}"'
-                if node.clickable:
-                    desc += " [clickable]"
-                if node.editable:
-                    desc += " [editable]"
-                lines.append(desc)
-        
+        self._begin_parse()
+        lines = self._walk(tree_json)
+        self._end_parse()
         return "\n".join(lines)
 
-    def _traverse(self, node: Dict[str, Any], result: List[RefNode]):
-        self._ref_counter += 1
-        ref_id = f"e{self._ref_counter}"
-        
+    def _begin_parse(self):
+        if self.incremental:
+            self.current_refs = {}
+            self.current_lines = {}
+            self._next_fingerprint_ids = {}
+        else:
+            self.reset()
+
+    def _end_parse(self):
+        if self.incremental:
+            self._fingerprint_ids = self._next_fingerprint_ids
+
+    @staticmethod
+    def format_node(node: RefNode) -> str:
+        desc = f"[{node.ref_id}] {node.role}"
+        if node.text:
+            desc += f' text="{node.text}"'
+        if node.content_description:
+            desc += f' label="{node.content_description}"'
+        if node.clickable:
+            desc += " [clickable]"
+        if node.editable:
+            desc += " [editable]"
+        return desc
+
+    def _assign_ref_id(self, node: Dict[str, Any], class_path: str, bounds: Tuple[int, int, int, int]) -> str:
+        if not self.incremental:
+            self._ref_counter += 1
+            return f"e{self._ref_counter}"
+
+        fingerprint = (node.get("id", ""), class_path, bounds)
+        # Disambiguate structurally identical siblings by occurrence
+        key = (fingerprint, 0)
+        while key in self._next_fingerprint_ids:
+            key = (fingerprint, key[1] + 1)
+
+        ref_id = self._fingerprint_ids.get(key)
+        if ref_id is None:
+            self._ref_counter += 1
+            ref_id = f"e{self._ref_counter}"
+        self._next_fingerprint_ids[key] = ref_id
+        return ref_id
+
+    def _walk(self, root: Dict[str, Any]) -> List[str]:
+        """
+        Iterative pre-order walk with an explicit stack (safe on arbitrarily deep trees).
+        Nodes are filtered during the walk, so RefNodes are only built for the
+        interactive or informative nodes that end up in the context.
+        """
+        lines = []
+        stack = [(root, "")]
+        while stack:
+            node, parent_path = stack.pop()
+            class_path = self._visit(node, parent_path, lines)
+            children = node.get("children")
+            if children:
+                stack.extend((child, class_path) for child in reversed(children))
+        return lines
+
+    def _visit(self, node: Dict[str, Any], parent_path: str, lines: List[str]) -> str:
+        """
+        Filter a single node (children are ignored) and register it if it is kept.
+        Returns the node's class path, which its children need in incremental mode.
+        """
+        class_name = node.get("class", "unknown")
+        class_path = f"{parent_path}/{class_name}" if self.incremental else ""
+        text = node.get("text", "")
+        content_description = node.get("contentDescription", "")
+        clickable = node.get("clickable", False)
+        editable = node.get("editable", False)
+
+        if not (text or content_description or clickable or editable):
+            if not self.incremental:
+                # Layout nodes still consume an ID so numbering matches the full tree
+                self._ref_counter += 1
+            return class_path
+
+        b = node.get("bounds") or {}
+        bounds = (b.get("left", 0), b.get("top", 0), b.get("right", 0), b.get("bottom", 0))
         ref_node = RefNode(
-            ref_id=ref_id,
-            role=node.get("class", "unknown").split(".")[-1], # Shorten class name
-            text=node.get("text", ""),
-            content_description=node.get("contentDescription", ""),
-            resource_id=node.get("id", ""),
-            bounds=node.get("bounds", {}),
-            clickable=node.get("clickable", False),
-            editable=node.get("editable", False)
+            self._assign_ref_id(node, class_path, bounds),
+            class_name.rsplit(".", 1)[-1], # Shorten class name
+            text,
+            content_description,
+            node.get("id", ""),
+            *bounds,
+            clickable,
+            editable
         )
-        
-        result.append(ref_node)
-        
-        for child in node.get("children", []):
-            self._traverse(child, result)
+        self.current_refs[ref_node.ref_id] = ref_node
+        desc = self.format_node(ref_node)
+        self.current_lines[ref_node.ref_id] = desc
+        lines.append(desc)
+        return class_path
 
     def get_node(self, ref_id: str) -> Optional[RefNode]:
         return self.current_refs.get(ref_id)
+
+    @staticmethod
+    def compute_delta(old_lines: Dict[str, str], new_lines: Dict[str, str]) -> Dict[str, List[str]]:
+        """
+        Diff two ref_id -> line maps (see `current_lines`).
+        Only meaningful in incremental mode, where ref IDs are stable across parses.
+        """
+        added = [line for ref_id, line in new_lines.items() if ref_id not in old_lines]
+        removed = [ref_id for ref_id in old_lines if ref_id not in new_lines]
+        changed = [
+            line for ref_id, line in new_lines.items()
+            if ref_id in old_lines and old_lines[ref_id] != line
+        ]
+        return {"added": added, "removed": removed, "changed": changed}
+
+    @staticmethod
+    def format_delta(delta: Dict[str, List[str]]) -> str:
+        """Compact text form of a delta: '+' added, '-' removed, '~' changed."""
+        lines = [f"+ {line}" for line in delta["added"]]
+        lines += [f"- [{ref_id}]" for ref_id in delta["removed"]]
+        lines += [f"~ {line}" for line in delta["changed"]]
+        return "\n".join(lines) if lines else "(no changes)"
+
+
+class AriaTreeStreamParser:
+    """
+    Incremental /aria-tree parser: feed raw body chunks as they arrive and RefNodes are
+    registered in the RefSystem while the transfer is still running. Only the attributes
+    of the nodes on the current path are held, never the full tree dict.
+
+    A node is emitted when its "children" key starts (the helper serializes it last) or
+    when its object ends, so context order matches `parse_aria_tree` for helper output.
+    Requires the optional `ijson` package.
+    """
+    def __init__(self, ref_system: RefSystem):
+        if ijson is None:
+            raise ImportError("AriaTreeStreamParser requires the 'ijson' package")
+        self.ref_system = ref_system
+        self.lines: List[str] = []
+        self._events = ijson.sendable_list()
+        self._coro = ijson.basic_parse_coro(self._events)
+        # Container stack entries: [kind, attrs, class_path, current_key, emitted]
+        self._stack: List[list] = []
+        ref_system._begin_parse()
+
+    @staticmethod
+    def available() -> bool:
+        return ijson is not None
+
+    def feed(self, chunk: bytes):
+        self._coro.send(chunk)
+        self._drain()
+
+    def close(self) -> str:
+        """Finish parsing and return the context text (same format as `parse_aria_tree`)."""
+        self._coro.close()
+        self._drain()
+        self.ref_system._end_parse()
+        return "\n".join(self.lines)
+
+    def _emit(self, frame: list):
+        if not frame[4]:
+            frame[4] = True
+            frame[2] = self.ref_system._visit(frame[1], frame[2], self.lines)
+
+    def _drain(self):
+        stack = self._stack
+        for event, value in self._events:
+            top = stack[-1] if stack else None
+            kind = top[0] if top else None
+
+            if event == "map_key":
+                if kind in ("node", "bounds"):
+                    top[3] = value
+            elif event == "start_map":
+                if top is None or kind == "children":
+                    parent_path = top[2] if top else ""
+                    stack.append(["node", {}, parent_path, None, False])
+                elif kind == "node" and top[3] == "bounds":
+                    bounds = top[1]["bounds"] = {}
+                    stack.append(["bounds", bounds, None, None, False])
+                else:
+                    stack.append(["skip", None, None, None, False])
+            elif event == "end_map":
+                frame = stack.pop()
+                if frame[0] == "node":
+                    self._emit(frame)
+            elif event == "start_array":
+                if kind == "node" and top[3] == "children":
+                    self._emit(top)
+                    stack.append(["children", None, top[2], None, False])
+                else:
+                    stack.append(["skip", None, None, None, False])
+            elif event == "end_array":
+                stack.pop()
+            elif kind in ("node", "bounds"):
+                top[1][top[3]] = value
+        del self._events[:]
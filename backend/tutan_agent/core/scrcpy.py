@@ -3,20 +3,115 @@ import socket
 import struct
 import subprocess
 import threading
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 from loguru import logger
 
+from tutan_agent.core.screen_monitor import ScreenChangeMonitor
+
+# scrcpy control message types and constants (scrcpy 3.x)
+CONTROL_MSG_INJECT_KEYCODE = 0
+CONTROL_MSG_INJECT_TEXT = 1
+CONTROL_MSG_INJECT_TOUCH_EVENT = 2
+ACTION_DOWN = 0
+ACTION_UP = 1
+POINTER_ID_GENERIC_FINGER = -2
+INJECT_TEXT_MAX_LENGTH = 300
+
+# Video packet header: 8-byte PTS with flags in the two high bits, 4-byte payload size
+PACKET_HEADER_SIZE = 12
+PACKET_FLAG_CONFIG = 1 << 63
+PACKET_FLAG_KEY_FRAME = 1 << 62
+PACKET_PTS_MASK = PACKET_FLAG_KEY_FRAME - 1
+
+ANDROID_KEYCODES = {
+    "HOME": 3,
+    "BACK": 4,
+    "ENTER": 66,
+    "DEL": 67,
+    "MENU": 82,
+    "APP_SWITCH": 187,
+}
+
+class VideoPacket:
+    """One complete scrcpy video packet (a config packet with SPS/PPS, or a frame's NAL units)."""
+    __slots__ = ("pts", "config", "keyframe", "data")
+
+    def __init__(self, pts: Optional[int], config: bool, keyframe: bool, data: bytes):
+        self.pts = pts
+        self.config = config
+        self.keyframe = keyframe
+        self.data = data
+
+
+class PacketReader:
+    """
+    Reassembles framed scrcpy video packets from a non-blocking socket.
+    Bytes are received with `sock_recv_into` straight into a reusable ring buffer, and
+    headers are parsed from memoryview slices; the only copy is the payload handed out.
+    """
+    def __init__(self, sock: socket.socket, capacity: int = 1 << 20):
+        self.sock = sock
+        self._buf = bytearray(capacity)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+
+    async def _fill(self, needed: int):
+        """Make sure at least `needed` unread bytes are buffered."""
+        loop = asyncio.get_running_loop()
+        while self._end - self._start < needed:
+            if self._start + needed > len(self._buf):
+                unread = self._end - self._start
+                if needed > len(self._buf):
+                    # Packet larger than the ring: grow it
+                    buf = bytearray(max(needed, len(self._buf) * 2))
+                    buf[:unread] = self._view[self._start:self._end]
+                    self._buf, self._view = buf, memoryview(buf)
+                else:
+                    self._view[:unread] = self._view[self._start:self._end]
+                self._start, self._end = 0, unread
+            n = await loop.sock_recv_into(self.sock, self._view[self._end:])
+            if n == 0:
+                raise EOFError("scrcpy video socket closed")
+            self._end += n
+
+    async def read_packet(self) -> VideoPacket:
+        await self._fill(PACKET_HEADER_SIZE)
+        pts_flags, size = struct.unpack_from(">QI", self._buf, self._start)
+        self._start += PACKET_HEADER_SIZE
+
+        await self._fill(size)
+        data = bytes(self._view[self._start:self._start + size])
+        self._start += size
+
+        config = bool(pts_flags & PACKET_FLAG_CONFIG)
+        return VideoPacket(
+            None if config else pts_flags & PACKET_PTS_MASK,
+            config,
+            bool(pts_flags & PACKET_FLAG_KEY_FRAME),
+            data
+        )
+
+
 class ScrcpyStreamer:
     """
     Manages scrcpy-server on the device and streams video data.
     Aligns with the ya-webadb / openclaw protocol for frame parsing.
     """
-    def __init__(self, serial: str, sio_server, local_port: int = 27183):
+    def __init__(self, serial: str, hub, local_port: int = 27183):
         self.serial = serial
-        self.sio = sio_server
+        self.hub = hub
         self.local_port = local_port
         self.process: Optional[subprocess.Popen] = None
         self.socket: Optional[socket.socket] = None
+        self.control_socket: Optional[socket.socket] = None
+        self.device_name: Optional[str] = None
+        self.frame_size: Optional[Tuple[int, int]] = None
+        self.device_size: Optional[Tuple[int, int]] = None
+        # A config packet after the first means the encoder restarted (rotation or resize),
+        # so `frame_size` from the codec header no longer matches the video
+        self._config_packets = 0
+        self.monitor = ScreenChangeMonitor(serial)
         self._stop_event = asyncio.Event()
         self.server_path = self._find_server_jar()
 
@@ -35,16 +130,17 @@ class ScrcpyStreamer:
 
     async def start(self):
         self._stop_event.clear()
+        self._config_packets = 0
         logger.info(f"Starting Scrcpy for {self.serial} on port {self.local_port}")
 
         try:
             # 1. Push server to device
             from tutan_agent.adb.manager import ADBManager
             adb = ADBManager()
-            adb._execute(["-s", self.serial, "push", self.server_path, "/data/local/tmp/scrcpy-server.jar"])
+            await adb.execute_async(["-s", self.serial, "push", self.server_path, "/data/local/tmp/scrcpy-server.jar"], timeout=30)
 
             # 2. Setup port forward
-            adb._execute(["-s", self.serial, "forward", f"tcp:{self.local_port}", "localabstract:scrcpy"])
+            await adb.execute_async(["-s", self.serial, "forward", f"tcp:{self.local_port}", "localabstract:scrcpy"])
 
             # 3. Start server on device
             # Note: Version 3.3.3 arguments
@@ -57,11 +153,24 @@ class ScrcpyStreamer:
             ]
             self.process = subprocess.Popen(server_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
-            # 4. Wait for server to initialize and connect socket
+            # 4. Wait for server to initialize and connect sockets.
+            # The server accepts the video socket (answering with a dummy byte), then the
+            # control socket, and only then sends the device and codec metadata.
             await asyncio.sleep(1)
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.connect(("127.0.0.1", self.local_port))
             self.socket.setblocking(False)
+            await self._recv_exactly(self.socket, 1)
+
+            self.control_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.control_socket.connect(("127.0.0.1", self.local_port))
+            self.control_socket.setblocking(False)
+
+            name = await self._recv_exactly(self.socket, 64)
+            self.device_name = name.rstrip(b"\0").decode("utf-8", errors="ignore")
+            _codec, width, height = struct.unpack(">III", await self._recv_exactly(self.socket, 12))
+            self.frame_size = (width, height)
+            await self._load_device_size(adb)
 
             # 5. Start streaming loop
             asyncio.create_task(self._stream_loop())
@@ -71,24 +180,84 @@ class ScrcpyStreamer:
             logger.error(f"Failed to start scrcpy: {e}")
             self.stop()
 
+    async def _recv_exactly(self, sock: socket.socket, n: int) -> bytes:
+        loop = asyncio.get_running_loop()
+        data = bytearray()
+        while len(data) < n:
+            chunk = await loop.sock_recv(sock, n - len(data))
+            if not chunk:
+                raise ConnectionResetError("scrcpy socket closed")
+            data += chunk
+        return bytes(data)
+
+    async def _load_device_size(self, adb):
+        """Physical display size, used to map device coordinates onto the video frame."""
+        code, output = await adb.run_shell(self.serial, "wm size")
+        sizes = [line.split(":")[-1].strip() for line in output.splitlines() if "size" in line]
+        if code == 0 and sizes:
+            # "Override size" (listed last) wins over "Physical size"
+            width, height = sizes[-1].split("x")
+            self.device_size = (int(width), int(height))
+
+    @property
+    def frame_size_stale(self) -> bool:
+        return self._config_packets > 1
+
+    @property
+    def control_ready(self) -> bool:
+        return self.control_socket is not None and self.frame_size is not None and not self._stop_event.is_set()
+
+    async def _send_control(self, message: bytes):
+        await asyncio.get_running_loop().sock_sendall(self.control_socket, message)
+
+    async def inject_keycode(self, keycode: int):
+        """Press and release an Android keycode through the control socket."""
+        for action in (ACTION_DOWN, ACTION_UP):
+            await self._send_control(struct.pack(">BBiii", CONTROL_MSG_INJECT_KEYCODE, action, keycode, 0, 0))
+
+    async def inject_text(self, text: str):
+        data = text.encode("utf-8")
+        for i in range(0, len(data), INJECT_TEXT_MAX_LENGTH):
+            chunk = data[i:i + INJECT_TEXT_MAX_LENGTH]
+            await self._send_control(struct.pack(">BI", CONTROL_MSG_INJECT_TEXT, len(chunk)) + chunk)
+
+    async def inject_tap(self, x: int, y: int) -> bool:
+        """
+        Tap at device coordinates (scaled to the video frame the server expects).
+        Returns False without sending anything when the frame size may not match the
+        current video: the server ignores touches whose screen size differs from it.
+        """
+        if self.frame_size_stale:
+            return False
+        width, height = self.frame_size
+        if self.device_size:
+            # `wm size` is the natural orientation; one factor fits either orientation
+            scale = max(width, height) / max(self.device_size)
+            x, y = int(x * scale), int(y * scale)
+        if not (0 <= x < width and 0 <= y < height):
+            return False
+        for action, pressure in ((ACTION_DOWN, 0xFFFF), (ACTION_UP, 0)):
+            await self._send_control(struct.pack(
+                ">BBqiiHHHII", CONTROL_MSG_INJECT_TOUCH_EVENT, action, POINTER_ID_GENERIC_FINGER,
+                x, y, width, height, pressure, 0, 0
+            ))
+        return True
+
     async def _stream_loop(self):
         """
-        Read raw video packets from the socket and emit via Socket.IO.
-        This is a simplified version; a full implementation would parse H.264 NAL units.
+        Read framed video packets from the socket and publish them to the StreamHub,
+        which fans them out to subscribed viewers as binary Socket.IO attachments.
         """
-        loop = asyncio.get_running_loop()
+        reader = PacketReader(self.socket)
         try:
-            # Skip dummy byte and metadata if sent by server
-            # (Simplified: just read and forward chunks)
             while not self._stop_event.is_set():
-                data = await loop.sock_recv(self.socket, 1024 * 16)
-                if not data:
-                    break
-                
-                # Emit raw video data to the frontend
-                # The frontend would use a decoder (like Broadway.js or WebCodecs)
-                await self.sio.emit("screen_data", {"serial": self.serial, "data": data.hex()})
-                
+                packet = await reader.read_packet()
+                if packet.config:
+                    self._config_packets += 1
+                self.monitor.observe(packet)
+                self.hub.publish(self.serial, packet)
+        except EOFError:
+            logger.info(f"Scrcpy video stream ended for {self.serial}")
         except Exception as e:
             logger.error(f"Stream loop error: {e}")
         finally:
@@ -96,8 +265,12 @@ class ScrcpyStreamer:
 
     def stop(self):
         self._stop_event.set()
+        self.monitor.close()
         if self.socket:
             self.socket.close()
+        if self.control_socket:
+            self.control_socket.close()
+            self.control_socket = None
         if self.process:
             self.process.terminate()
         logger.info(f"Scrcpy stream stopped for {self.serial}")
@@ -0,0 +1,110 @@
+import asyncio
+from typing import Callable, Dict, Any, List, Optional
+from loguru import logger
+
+# (serial, state) with state "changed" or "stable"
+ScreenListener = Callable[[str, str], None]
+
+
+class ScreenChangeMonitor:
+    """
+    Screen-change detection from the live scrcpy stream, without decoding it.
+    The encoder only emits sizeable packets when pixels change (a static screen yields
+    tiny repeat frames), so packet sizes are a cheap activity signal. Periodic keyframes
+    are only counted when their size differs from the previous keyframe. The screen is
+    "stable" once no activity was seen for `quiet_window` seconds.
+    """
+    def __init__(self, serial: str, quiet_window: float = 0.3, min_change_bytes: int = 1024,
+                 keyframe_tolerance: float = 0.05):
+        self.serial = serial
+        self.quiet_window = quiet_window
+        self.min_change_bytes = min_change_bytes
+        self.keyframe_tolerance = keyframe_tolerance
+        self.last_change: Optional[float] = None
+        self.stable = False
+        self.closed = False
+        self._last_keyframe_size: Optional[int] = None
+        self._stable_timer: Optional[asyncio.TimerHandle] = None
+        self._listeners: List[ScreenListener] = []
+        self.stats = {"packets": 0, "changes": 0, "stable": 0}
+
+    @property
+    def live(self) -> bool:
+        """True once packets are flowing and the stream has not stopped."""
+        return not self.closed and self.last_change is not None
+
+    def add_listener(self, listener: ScreenListener):
+        self._listeners.append(listener)
+
+    def _emit(self, state: str):
+        for listener in self._listeners:
+            try:
+                listener(self.serial, state)
+            except Exception as e:
+                logger.warning(f"Screen listener failed for {self.serial}: {e}")
+
+    def _is_change(self, packet) -> bool:
+        if packet.config:
+            # New SPS/PPS: rotation, resize or encoder restart
+            return True
+        if packet.keyframe:
+            previous, self._last_keyframe_size = self._last_keyframe_size, len(packet.data)
+            if previous is None:
+                return True
+            return abs(len(packet.data) - previous) > previous * self.keyframe_tolerance
+        return len(packet.data) >= self.min_change_bytes
+
+    def observe(self, packet):
+        """Feed one video packet; called from the stream read loop and never blocks."""
+        self.stats["packets"] += 1
+        if self.closed or not self._is_change(packet):
+            return
+
+        loop = asyncio.get_running_loop()
+        self.last_change = loop.time()
+        if self.stable:
+            self.stable = False
+            self.stats["changes"] += 1
+            self._emit("changed")
+        if self._stable_timer is not None:
+            self._stable_timer.cancel()
+        self._stable_timer = loop.call_later(self.quiet_window, self._mark_stable)
+
+    def _mark_stable(self):
+        self._stable_timer = None
+        self.stable = True
+        self.stats["stable"] += 1
+        self._emit("stable")
+
+    def changed_since(self, since: float) -> bool:
+        """Whether the screen changed after loop time `since`."""
+        return self.last_change is not None and self.last_change > since
+
+    async def wait_stable(self, since: Optional[float] = None, timeout: float = 3.0) -> bool:
+        """
+        Wait until no change was seen for `quiet_window` seconds after loop time `since`
+        (an action that changes nothing resolves `quiet_window` after it was sent).
+        Returns False on timeout or when the stream stops.
+        """
+        loop = asyncio.get_running_loop()
+        if since is None:
+            since = loop.time()
+        deadline = since + timeout
+        while not self.closed:
+            quiet_from = max(since, self.last_change or since)
+            now = loop.time()
+            if now - quiet_from >= self.quiet_window:
+                return True
+            if now >= deadline:
+                return False
+            await asyncio.sleep(min(quiet_from + self.quiet_window, deadline) - now)
+        return False
+
+    def close(self):
+        self.closed = True
+        if self._stable_timer is not None:
+            self._stable_timer.cancel()
+            self._stable_timer = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.stats, stable_now=self.stable, live=self.live)
@@ -0,0 +1,178 @@
+import asyncio
+import io
+import os
+import struct
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Tuple
+from loguru import logger
+from PIL import Image
+
+try:
+    import numpy as np  # Optional: enables RawFrame.to_array()
+except ImportError:
+    np = None
+
+# Pixel formats reported in the raw screencap header (android.graphics.PixelFormat)
+PIXEL_FORMAT_RGBA_8888 = 1
+PIXEL_FORMAT_RGBX_8888 = 2
+
+# Re-encoding is CPU-bound; keep it off the event loop and bounded across devices
+_encode_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("TUTAN_SCREENSHOT_WORKERS", "2")),
+                                      thread_name_prefix="screenshot")
+
+
+class RawFrame:
+    """A framebuffer from `screencap` without -p: RGBA pixels plus dimensions."""
+    def __init__(self, width: int, height: int, pixels: memoryview):
+        self.width = width
+        self.height = height
+        self.pixels = pixels
+
+    @classmethod
+    def parse(cls, data: bytes) -> "RawFrame":
+        """
+        Parse raw screencap output: a little-endian (width, height, format) header, plus a
+        dataspace word on Android 9+, followed by width * height * 4 bytes of pixels.
+        """
+        if len(data) < 12:
+            raise ValueError("Raw screencap output too short")
+        width, height, pixel_format = struct.unpack_from("<III", data)
+        header = len(data) - width * height * 4
+        if header not in (12, 16):
+            raise ValueError(f"Unexpected raw screencap size for {width}x{height}")
+        if pixel_format not in (PIXEL_FORMAT_RGBA_8888, PIXEL_FORMAT_RGBX_8888):
+            raise ValueError(f"Unsupported raw screencap pixel format {pixel_format}")
+        return cls(width, height, memoryview(data)[header:])
+
+    def to_image(self) -> Image.Image:
+        # Zero-copy view over the pixel buffer
+        return Image.frombuffer("RGBA", (self.width, self.height), self.pixels, "raw", "RGBA", 0, 1)
+
+    def to_array(self):
+        if np is None:
+            raise ImportError("RawFrame.to_array requires numpy")
+        return np.frombuffer(self.pixels, dtype=np.uint8).reshape(self.height, self.width, 4)
+
+
+class ScreenshotFrame:
+    """An encoded, downscaled screenshot ready for vision prompts or the frontend."""
+    def __init__(self, serial: str, step: Optional[int], data: bytes, image_format: str,
+                 size: Tuple[int, int], source_size: Tuple[int, int], session_id: Optional[str] = None):
+        self.serial = serial
+        self.step = step
+        self.session_id = session_id
+        self.data = data
+        self.image_format = image_format
+        self.size = size
+        self.source_size = source_size
+        self.captured_at = time.time()
+
+    @property
+    def media_type(self) -> str:
+        return f"image/{self.image_format.lower()}"
+
+
+class FrameCache:
+    """
+    LRU of recent screenshot frames keyed by (serial, session, step).
+    Step numbers restart with every task, so the session tells frames of different
+    tasks apart.
+    """
+    def __init__(self, max_frames: int = 64):
+        self.max_frames = max_frames
+        self._frames: "OrderedDict[Tuple[str, Optional[str], int], ScreenshotFrame]" = OrderedDict()
+
+    def put(self, frame: ScreenshotFrame):
+        key = (frame.serial, frame.session_id, frame.step)
+        self._frames[key] = frame
+        self._frames.move_to_end(key)
+        while len(self._frames) > self.max_frames:
+            self._frames.popitem(last=False)
+
+    def get(self, serial: str, step: Optional[int] = None, session_id: Optional[str] = None) -> Optional[ScreenshotFrame]:
+        """
+        Frame of `step` in `session_id`. Without a session, the step of the most recent
+        session that has it; without a step, the most recent frame.
+        """
+        for key, frame in reversed(self._frames.items()):
+            frame_serial, frame_session, frame_step = key
+            if frame_serial != serial or (step is not None and frame_step != step) \
+                    or (session_id is not None and frame_session != session_id):
+                continue
+            self._frames.move_to_end(key)
+            return frame
+        return None
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+
+frame_cache = FrameCache()
+
+
+class ScreenshotPipeline:
+    """
+    Screenshot subsystem for one device.
+    Captures the raw framebuffer (no on-device PNG compression, falling back to
+    `screencap -p`), then downscales to `max_side` and re-encodes on a worker thread.
+    """
+    def __init__(self, serial: str, max_side: Optional[int] = None, image_format: Optional[str] = None,
+                 quality: int = 80, raw: bool = True, cache: Optional[FrameCache] = None):
+        self.serial = serial
+        self.max_side = max_side or int(os.environ.get("TUTAN_SCREENSHOT_MAX_SIDE", "1024"))
+        self.image_format = (image_format or os.environ.get("TUTAN_SCREENSHOT_FORMAT", "JPEG")).upper()
+        self.quality = quality
+        self.raw = raw
+        self.cache = cache if cache is not None else frame_cache
+        # Session of the running task; cached frames are filed under it
+        self.session_id: Optional[str] = None
+        self.stats: Dict[str, Any] = {"captures": 0, "raw_failures": 0, "capture_time": 0.0, "encode_time": 0.0}
+
+    async def _capture_bytes(self, png: bool) -> Optional[bytes]:
+        from tutan_agent.adb.manager import ADBManager
+        adb = ADBManager()
+        args = ["-s", self.serial, "exec-out", "screencap"] + (["-p"] if png else [])
+        code, stdout, _ = await adb.execute_async(args, binary=True)
+        return stdout if code == 0 and stdout else None
+
+    def _encode(self, data: bytes, png: bool) -> Tuple[bytes, Tuple[int, int], Tuple[int, int]]:
+        started = time.perf_counter()
+        image = Image.open(io.BytesIO(data)) if png else RawFrame.parse(data).to_image()
+        source_size = image.size
+        if max(source_size) > self.max_side:
+            image.thumbnail((self.max_side, self.max_side), Image.BILINEAR)
+        if self.image_format == "JPEG":
+            image = image.convert("RGB")
+        out = io.BytesIO()
+        image.save(out, format=self.image_format, quality=self.quality)
+        self.stats["encode_time"] += time.perf_counter() - started
+        return out.getvalue(), image.size, source_size
+
+    async def capture(self, step: Optional[int] = None) -> Optional[ScreenshotFrame]:
+        """Capture, downscale and encode a screenshot; cached under (serial, session, step) when step is given."""
+        started = time.perf_counter()
+        png = not self.raw
+        data = await self._capture_bytes(png=png)
+        if data is None:
+            return None
+        try:
+            encoded = await asyncio.get_running_loop().run_in_executor(_encode_executor, self._encode, data, png)
+        except (ValueError, OSError) as e:
+            if png:
+                logger.error(f"Failed to decode screenshot of {self.serial}: {e}")
+                return None
+            logger.warning(f"Raw screencap unusable on {self.serial} ({e}), switching to PNG capture")
+            self.stats["raw_failures"] += 1
+            self.raw = False
+            return await self.capture(step)
+
+        image_data, size, source_size = encoded
+        frame = ScreenshotFrame(self.serial, step, image_data, self.image_format, size, source_size,
+                                self.session_id)
+        self.stats["captures"] += 1
+        self.stats["capture_time"] += time.perf_counter() - started
+        if step is not None:
+            self.cache.put(frame)
+        return frame
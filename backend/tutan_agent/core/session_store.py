@@ -1,98 +1,455 @@
+import asyncio
+import atexit
+import base64
+import queue
 import sqlite3
 import json
+import threading
 import time
-from typing import List, Dict, Any, Optional
+from typing import Callable, List, Dict, Any, Optional, Tuple
 from loguru import logger
 import os
 
+_BARRIER = object()
+_STOP = object()
+
+
+class _BatchWriter:
+    """
+    The single writer of one database file.
+    Owns one long-lived WAL-mode connection on a background thread; statements are
+    queued without blocking and committed in batches (everything queued while the
+    previous commit ran goes into the next transaction).
+    """
+    _writers: Dict[str, "_BatchWriter"] = {}
+    _registry_lock = threading.Lock()
+
+    @classmethod
+    def for_path(cls, db_path: str, init: Callable[[sqlite3.Connection], None], batch_size: int) -> "_BatchWriter":
+        key = os.path.abspath(db_path)
+        with cls._registry_lock:
+            writer = cls._writers.get(key)
+            if writer is None or not writer.running:
+                writer = cls._writers[key] = cls(db_path, init, batch_size)
+            return writer
+
+    @classmethod
+    def close_all(cls):
+        with cls._registry_lock:
+            writers, cls._writers = list(cls._writers.values()), {}
+        for writer in writers:
+            writer.close()
+
+    def __init__(self, db_path: str, init: Callable[[sqlite3.Connection], None], batch_size: int):
+        self.batch_size = batch_size
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL only fsyncs on checkpoints and stays consistent after a crash
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        init(self.conn)
+        self.queue: "queue.Queue" = queue.Queue()
+        self.stats = {"statements": 0, "batches": 0, "errors": 0, "max_batch": 0}
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="session-store-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, sql: str, params: Tuple = ()):
+        self.queue.put((sql, params))
+
+    def barrier(self, callback: Callable[[], None]):
+        """Run `callback` on the writer thread once everything queued so far is committed."""
+        self.queue.put((_BARRIER, callback))
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            statements = [item for item in batch if isinstance(item[0], str)]
+            if statements:
+                self._commit(statements)
+            for item in batch:
+                if item[0] is _BARRIER:
+                    try:
+                        item[1]()
+                    except Exception as e:
+                        # e.g. the event loop waiting on flush_async() is already closed
+                        logger.debug(f"Session store flush callback failed: {e}")
+            if any(item[0] is _STOP for item in batch):
+                self.conn.close()
+                return
+
+    def _commit(self, statements: List[Tuple[str, Tuple]]):
+        try:
+            self.conn.execute("BEGIN")
+            for sql, params in statements:
+                self.conn.execute(sql, params)
+            self.conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            if self.conn.in_transaction:
+                self.conn.execute("ROLLBACK")
+            logger.warning(f"Batch of {len(statements)} writes failed ({e}), retrying one by one")
+            for sql, params in statements:
+                try:
+                    self.conn.execute(sql, params)
+                except sqlite3.Error as e:
+                    self.stats["errors"] += 1
+                    logger.error(f"Dropped session store write: {e}")
+        self.stats["statements"] += len(statements)
+        self.stats["batches"] += 1
+        self.stats["max_batch"] = max(self.stats["max_batch"], len(statements))
+
+    def close(self):
+        if self.running:
+            self.running = False
+            self.queue.put((_STOP, None))
+            self.thread.join(timeout=10)
+
+
+atexit.register(_BatchWriter.close_all)
+
+
 class SessionStore:
     """
     SQLite-based persistence for TUTAN_AGENT sessions and steps.
+    Writes never block the caller: they are queued to a shared background writer that
+    commits them in batches over one WAL connection. Reads flush pending writes first,
+    so callers always see their own writes; `*_async` variants run off the event loop.
     """
-    def __init__(self, db_path: str = "tutan_sessions.db"):
+    def __init__(self, db_path: str = "tutan_sessions.db", batch_size: int = 512):
         self.db_path = db_path
-        self._init_db()
-
-    def _init_db(self):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            # Sessions table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS sessions (
-                    id TEXT PRIMARY KEY,
-                    device_serial TEXT,
-                    task TEXT,
-                    status TEXT,
-                    start_time REAL,
-                    end_time REAL,
-                    model_config TEXT
-                )
-            """)
-            # Steps table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS steps (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    session_id TEXT,
-                    step_number INTEGER,
-                    thinking TEXT,
-                    action TEXT,
-                    params TEXT,
-                    result TEXT,
-                    screenshot_path TEXT,
-                    timestamp REAL,
-                    FOREIGN KEY (session_id) REFERENCES sessions (id)
-                )
-            """)
-            conn.commit()
+        self._writer = _BatchWriter.for_path(db_path, self._init_db, batch_size)
+        self._local = threading.local()
 
-    def create_session(self, session_id: str, serial: str, task: str, model_config: Dict[str, Any]):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO sessions (id, device_serial, task, status, start_time, model_config) VALUES (?, ?, ?, ?, ?, ?)",
-                (session_id, serial, task, "running", time.time(), json.dumps(model_config))
+    def _init_db(self, conn: sqlite3.Connection):
+        cursor = conn.cursor()
+        # Sessions table
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                device_serial TEXT,
+                task TEXT,
+                status TEXT,
+                start_time REAL,
+                end_time REAL,
+                model_config TEXT
+            )
+        """)
+        # Steps table
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS steps (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT,
+                step_number INTEGER,
+                thinking TEXT,
+                action TEXT,
+                params TEXT,
+                result TEXT,
+                screenshot_path TEXT,
+                timestamp REAL,
+                FOREIGN KEY (session_id) REFERENCES sessions (id)
             )
-            conn.commit()
+        """)
+        # Scheduler task queue
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                id TEXT PRIMARY KEY,
+                task TEXT,
+                device_serial TEXT,
+                device_model TEXT,
+                priority INTEGER,
+                status TEXT,
+                assigned_serial TEXT,
+                session_id TEXT,
+                error TEXT,
+                submitted_at REAL,
+                started_at REAL,
+                finished_at REAL
+            )
+        """)
+        # Raw aria tree of each step in the ArtifactStore (added after screenshot_path)
+        columns = {row[1] for row in cursor.execute("PRAGMA table_info(steps)").fetchall()}
+        if "tree_path" not in columns:
+            cursor.execute("ALTER TABLE steps ADD COLUMN tree_path TEXT")
+        # Screen/target fingerprint for trajectory replay, and the session a task replays
+        if "fingerprint" not in columns:
+            cursor.execute("ALTER TABLE steps ADD COLUMN fingerprint TEXT")
+        # Which planning route produced each step (rules/small/large/cache/replay/speculative)
+        for column, kind in (("route", "TEXT"), ("plan_latency", "REAL"), ("escalated", "INTEGER")):
+            if column not in columns:
+                cursor.execute(f"ALTER TABLE steps ADD COLUMN {column} {kind}")
+        task_columns = {row[1] for row in cursor.execute("PRAGMA table_info(tasks)").fetchall()}
+        if "replay_session" not in task_columns:
+            cursor.execute("ALTER TABLE tasks ADD COLUMN replay_session TEXT")
+        # History queries page by start time and filter by device/status; steps are read per session
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_start_time ON sessions (start_time)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_device_status ON sessions (device_serial, status)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_steps_session ON steps (session_id, step_number)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status, submitted_at)")
+
+    def _read_conn(self) -> sqlite3.Connection:
+        """Per-thread read connection; WAL readers never block the writer."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.db_path)
+            conn.row_factory = sqlite3.Row
+        return conn
+
+    def _query(self, sql: str, params: Tuple = ()) -> List[Dict[str, Any]]:
+        self.flush()
+        return [dict(row) for row in self._read_conn().execute(sql, params).fetchall()]
+
+    async def _to_thread(self, fn: Callable, *args):
+        await self.flush_async()
+        return await asyncio.to_thread(fn, *args)
+
+    # --- Flushing ---
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Block until every write queued so far is committed."""
+        done = threading.Event()
+        self._writer.barrier(done.set)
+        return done.wait(timeout)
+
+    async def flush_async(self):
+        """Wait, without blocking the event loop, until queued writes are committed."""
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+
+        def resolve():
+            if not done.done():
+                done.set_result(True)
+        self._writer.barrier(lambda: loop.call_soon_threadsafe(resolve))
+        await done
+
+    def get_writer_stats(self) -> Dict[str, Any]:
+        return dict(self._writer.stats, queued=self._writer.queue.qsize())
+
+    # --- Writes (queued) ---
+
+    def create_session(self, session_id: str, serial: str, task: str, model_config: Dict[str, Any]):
+        self._writer.submit(
+            "INSERT INTO sessions (id, device_serial, task, status, start_time, model_config) VALUES (?, ?, ?, ?, ?, ?)",
+            (session_id, serial, task, "running", time.time(), json.dumps(model_config))
+        )
 
     def add_step(self, session_id: str, step_data: Dict[str, Any]):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                """INSERT INTO steps 
-                   (session_id, step_number, thinking, action, params, result, screenshot_path, timestamp) 
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-                (
-                    session_id,
-                    step_data.get("step"),
-                    step_data.get("thinking"),
-                    step_data.get("action"),
-                    json.dumps(step_data.get("params")),
-                    step_data.get("result", "success"),
-                    step_data.get("screenshot_path"),
-                    time.time()
-                )
+        self._writer.submit(
+            """INSERT INTO steps
+               (session_id, step_number, thinking, action, params, result, screenshot_path, tree_path,
+                fingerprint, route, plan_latency, escalated, timestamp)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (
+                session_id,
+                step_data.get("step"),
+                step_data.get("thinking"),
+                step_data.get("action"),
+                json.dumps(step_data.get("params")),
+                step_data.get("result", "success"),
+                step_data.get("screenshot_path"),
+                step_data.get("tree_path"),
+                json.dumps(step_data["fingerprint"]) if step_data.get("fingerprint") else None,
+                step_data.get("route"),
+                step_data.get("plan_latency"),
+                int(bool(step_data.get("escalated"))),
+                time.time()
             )
-            conn.commit()
+        )
 
     def update_session_status(self, session_id: str, status: str):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE sessions SET status = ?, end_time = ? WHERE id = ?",
-                (status, time.time(), session_id)
+        self._writer.submit(
+            "UPDATE sessions SET status = ?, end_time = ? WHERE id = ?",
+            (status, time.time(), session_id)
+        )
+
+    def save_task(self, task: Dict[str, Any]):
+        """Insert or replace a scheduler task record."""
+        self._writer.submit(
+            """INSERT OR REPLACE INTO tasks
+               (id, task, device_serial, device_model, priority, status, assigned_serial,
+                session_id, error, submitted_at, started_at, finished_at, replay_session)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (
+                task["id"], task["task"], task.get("device_serial"), task.get("device_model"),
+                task.get("priority", 0), task["status"], task.get("assigned_serial"),
+                task.get("session_id"), task.get("error"), task["submitted_at"],
+                task.get("started_at"), task.get("finished_at"), task.get("replay_session")
             )
-            conn.commit()
+        )
+
+    # --- Reads ---
 
     def get_all_sessions(self) -> List[Dict[str, Any]]:
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM sessions ORDER BY start_time DESC")
-            return [dict(row) for row in cursor.fetchall()]
+        return self._query("SELECT * FROM sessions ORDER BY start_time DESC")
 
-    def get_session_steps(self, session_id: str) -> List[Dict[str, Any]]:
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM steps WHERE session_id = ? ORDER BY step_number ASC", (session_id,))
-            return [dict(row) for row in cursor.fetchall()]
+    @staticmethod
+    def _session_filters(serial: Optional[str], status: Optional[str], since: Optional[float],
+                         until: Optional[float]) -> Tuple[List[str], List[Any]]:
+        clauses, params = [], []
+        for clause, value in (("device_serial = ?", serial), ("status = ?", status),
+                              ("start_time >= ?", since), ("start_time < ?", until)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        return clauses, params
+
+    @staticmethod
+    def _encode_cursor(start_time: float, session_id: str) -> str:
+        return base64.urlsafe_b64encode(f"{start_time!r}|{session_id}".encode()).decode()
+
+    @staticmethod
+    def _decode_cursor(cursor: str) -> Tuple[float, str]:
+        start_time, session_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return float(start_time), session_id
+
+    def list_sessions(self, serial: Optional[str] = None, status: Optional[str] = None,
+                      since: Optional[float] = None, until: Optional[float] = None,
+                      limit: int = 50, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        One page of sessions, newest first, and the cursor of the next page (None at the end).
+        Keyset pagination on (start_time, id), so deep pages cost the same as the first.
+        """
+        clauses, params = self._session_filters(serial, status, since, until)
+        if cursor:
+            start_time, session_id = self._decode_cursor(cursor)
+            clauses.append("(start_time < ? OR (start_time = ? AND id < ?))")
+            params += [start_time, start_time, session_id]
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._query(
+            f"SELECT * FROM sessions {where} ORDER BY start_time DESC, id DESC LIMIT ?",
+            (*params, limit + 1)
+        )
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self._encode_cursor(rows[-1]["start_time"], rows[-1]["id"])
+        return rows, next_cursor
+
+    def get_session_stats(self, serial: Optional[str] = None, status: Optional[str] = None,
+                          since: Optional[float] = None, until: Optional[float] = None) -> Dict[str, Any]:
+        """Counts and durations of matching sessions, aggregated in SQL."""
+        clauses, params = self._session_filters(serial, status, since, until)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        duration = "CASE WHEN end_time IS NOT NULL THEN end_time - start_time END"
+        by_status = self._query(
+            f"""SELECT status, COUNT(*) AS count, AVG({duration}) AS avg_duration,
+                       SUM({duration}) AS total_duration
+                FROM sessions {where} GROUP BY status""",
+            tuple(params)
+        )
+        by_device = self._query(
+            f"""SELECT device_serial, COUNT(*) AS count, AVG({duration}) AS avg_duration
+                FROM sessions {where} GROUP BY device_serial""",
+            tuple(params)
+        )
+        steps = self._query(
+            f"""SELECT COUNT(*) AS steps,
+                       SUM(CASE WHEN result = 'success' THEN 0 ELSE 1 END) AS failed_steps
+                FROM steps WHERE session_id IN (SELECT id FROM sessions {where})""",
+            tuple(params)
+        )[0]
+        total = sum(row["count"] for row in by_status)
+        finished = [row for row in by_status if row["total_duration"] is not None]
+        total_duration = sum(row["total_duration"] for row in finished)
+        finished_count = sum(row["count"] for row in finished)
+        return {
+            "total": total,
+            "by_status": {row["status"]: {k: row[k] for k in ("count", "avg_duration", "total_duration")}
+                          for row in by_status},
+            "by_device": {row["device_serial"]: {"count": row["count"], "avg_duration": row["avg_duration"]}
+                          for row in by_device},
+            "avg_duration": total_duration / finished_count if finished_count else None,
+            "steps": steps["steps"],
+            "failed_steps": steps["failed_steps"] or 0,
+            "avg_steps": steps["steps"] / total if total else None
+        }
+
+    def get_session_steps(self, session_id: str, after_step: Optional[int] = None,
+                          limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Steps of a session in order; page with `after_step` (the last step number seen)."""
+        sql = "SELECT * FROM steps WHERE session_id = ?"
+        params: List[Any] = [session_id]
+        if after_step is not None:
+            sql += " AND step_number > ?"
+            params.append(after_step)
+        sql += " ORDER BY step_number ASC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return self._query(sql, tuple(params))
+
+    def get_route_stats(self, serial: Optional[str] = None, since: Optional[float] = None) -> Dict[str, Any]:
+        """Per planning route: step count, planning latency, action success rate and escalations."""
+        sql = """SELECT st.route AS route, COUNT(*) AS steps, AVG(st.plan_latency) AS avg_latency,
+                        MAX(st.plan_latency) AS max_latency, SUM(st.result = 'success') AS succeeded,
+                        SUM(st.escalated) AS escalated
+                 FROM steps st"""
+        clauses, params = ["st.route IS NOT NULL"], []
+        if serial:
+            sql += " JOIN sessions s ON s.id = st.session_id"
+            clauses.append("s.device_serial = ?")
+            params.append(serial)
+        if since is not None:
+            clauses.append("st.timestamp >= ?")
+            params.append(since)
+        sql += f" WHERE {' AND '.join(clauses)} GROUP BY st.route"
+        stats = {}
+        for row in self._query(sql, tuple(params)):
+            route = row.pop("route")
+            row["success_rate"] = round(row["succeeded"] / row["steps"], 3)
+            row["avg_latency"] = round(row["avg_latency"] or 0.0, 3)
+            stats[route] = row
+        return stats
+
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._query("SELECT * FROM sessions WHERE id = ?", (session_id,))
+        return rows[0] if rows else None
+
+    def get_task(self, task_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._query("SELECT * FROM tasks WHERE id = ?", (task_id,))
+        return rows[0] if rows else None
+
+    def get_tasks(self, statuses: Optional[List[str]] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        if statuses:
+            placeholders = ",".join("?" * len(statuses))
+            return self._query(
+                f"SELECT * FROM tasks WHERE status IN ({placeholders}) ORDER BY submitted_at DESC LIMIT ?",
+                (*statuses, limit)
+            )
+        return self._query("SELECT * FROM tasks ORDER BY submitted_at DESC LIMIT ?", (limit,))
+
+    async def get_all_sessions_async(self) -> List[Dict[str, Any]]:
+        return await self._to_thread(self.get_all_sessions)
+
+    async def list_sessions_async(self, serial: Optional[str] = None, status: Optional[str] = None,
+                                  since: Optional[float] = None, until: Optional[float] = None,
+                                  limit: int = 50, cursor: Optional[str] = None):
+        return await self._to_thread(self.list_sessions, serial, status, since, until, limit, cursor)
+
+    async def get_session_stats_async(self, serial: Optional[str] = None, status: Optional[str] = None,
+                                      since: Optional[float] = None, until: Optional[float] = None) -> Dict[str, Any]:
+        return await self._to_thread(self.get_session_stats, serial, status, since, until)
+
+    async def get_session_steps_async(self, session_id: str, after_step: Optional[int] = None,
+                                      limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        return await self._to_thread(self.get_session_steps, session_id, after_step, limit)
+
+    async def get_route_stats_async(self, serial: Optional[str] = None, since: Optional[float] = None) -> Dict[str, Any]:
+        return await self._to_thread(self.get_route_stats, serial, since)
+
+    async def get_session_async(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return await self._to_thread(self.get_session, session_id)
+
+    async def get_task_async(self, task_id: str) -> Optional[Dict[str, Any]]:
+        return await self._to_thread(self.get_task, task_id)
+
+    async def get_tasks_async(self, statuses: Optional[List[str]] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        return await self._to_thread(self.get_tasks, statuses, limit)
+
+    def close(self):
+        """Commit everything queued and stop the writer shared by this database file."""
+        self._writer.close()
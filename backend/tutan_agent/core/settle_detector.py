@@ -0,0 +1,108 @@
+import asyncio
+import hashlib
+from typing import Dict, Any, List, Optional
+from loguru import logger
+
+
+class SettleHistogram:
+    """Bucketed histogram of settle times (seconds) for one action type."""
+    BUCKETS = [0.1, 0.25, 0.5, 1.0, 1.5, 2.0, 3.0, 5.0]
+
+    def __init__(self):
+        self.counts: List[int] = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.timeouts = 0
+
+    def observe(self, seconds: float, timed_out: bool = False):
+        for i, bound in enumerate(self.BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.total += seconds
+        if timed_out:
+            self.timeouts += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        labels = [f"le_{b}" for b in self.BUCKETS] + ["le_inf"]
+        return {
+            "buckets": dict(zip(labels, self.counts)),
+            "count": self.count,
+            "sum": round(self.total, 4),
+            "avg": round(self.total / self.count, 4) if self.count else 0.0,
+            "timeouts": self.timeouts
+        }
+
+
+class SettleDetector:
+    """
+    Adaptive UI-settle detection.
+    With a live scrcpy stream it waits on the controller's screen monitor; otherwise it
+    polls the helper's /aria-tree (falling back to hashing screenshots). Either way it
+    returns once the UI has not changed for `quiet_window` seconds, or when `timeout`
+    expires. Without any change signal it waits the fixed `fallback_delay` instead.
+    """
+    def __init__(self, controller, quiet_window: float = 0.3, poll_interval: float = 0.1,
+                 timeout: float = 3.0, fallback_delay: float = 1.5):
+        self.controller = controller
+        self.quiet_window = quiet_window
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.fallback_delay = fallback_delay
+        self.histograms: Dict[str, SettleHistogram] = {}
+
+    async def _digest(self) -> Optional[str]:
+        data = await self.controller.get_aria_tree_raw()
+        if data is None:
+            data = await self.controller.get_screenshot()
+        if data is None:
+            return None
+        return hashlib.sha1(data).hexdigest()
+
+    async def wait(self, action: str, started: Optional[float] = None) -> float:
+        """
+        Wait for the UI to settle after `action`.
+        `started` is the loop time the action was sent; returns the settle time in seconds.
+        """
+        loop = asyncio.get_running_loop()
+        if started is None:
+            started = loop.time()
+        deadline = started + self.timeout
+
+        monitor = getattr(self.controller, "screen_monitor", None)
+        if monitor is not None:
+            timed_out = not await monitor.wait_stable(since=started, timeout=self.timeout)
+            return self._observe(action, loop.time() - started, timed_out)
+
+        last_digest = await self._digest()
+        stable_since = loop.time()
+        timed_out = False
+        if last_digest is None:
+            await asyncio.sleep(max(0.0, started + self.fallback_delay - loop.time()))
+        while last_digest is not None:
+            now = loop.time()
+            if now - stable_since >= self.quiet_window:
+                break
+            if now >= deadline:
+                timed_out = True
+                break
+            await asyncio.sleep(min(self.poll_interval, max(0.0, deadline - now)))
+            digest = await self._digest()
+            if digest is None or digest != last_digest:
+                last_digest = digest
+                stable_since = loop.time()
+
+        return self._observe(action, loop.time() - started, timed_out)
+
+    def _observe(self, action: str, elapsed: float, timed_out: bool) -> float:
+        self.histograms.setdefault(action or "unknown", SettleHistogram()).observe(elapsed, timed_out)
+        if timed_out:
+            logger.debug(f"UI did not settle within {self.timeout}s after {action} on {self.controller.serial}")
+        return elapsed
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Per-action settle-time histograms."""
+        return {action: hist.to_dict() for action, hist in self.histograms.items()}
@@ -0,0 +1,164 @@
+import asyncio
+from collections import deque
+from typing import Dict, Any, List, Optional, Deque
+from loguru import logger
+
+from tutan_agent.core.scrcpy import VideoPacket
+
+
+class StreamSubscriber:
+    """
+    One viewer of one device stream with its own bounded queue.
+    Socket.IO's emit only appends to engine.io's unbounded per-client queue, so packets
+    are held here while that queue has more than `max_backlog` packets not yet written to
+    the viewer. When the viewer falls behind, non-key frames are dropped and delivery
+    resumes at the next keyframe, so a slow client never blocks the device read loop or
+    other viewers.
+    """
+    def __init__(self, sid: str, serial: str, sio_server, max_queue: int = 60, max_backlog: int = 8,
+                 backlog_poll: float = 0.01):
+        self.sid = sid
+        self.serial = serial
+        self.sio = sio_server
+        self.max_queue = max_queue
+        self.max_backlog = max_backlog
+        self.backlog_poll = backlog_poll
+        self._queue: Deque[VideoPacket] = deque()
+        self._ready = asyncio.Event()
+        self._need_keyframe = False
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.dropped = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self._send_loop())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    def prime(self, packets: List[VideoPacket]):
+        """Queue cached config/GOP packets for a new viewer, bypassing the queue limit."""
+        self._queue.extend(packets)
+        self._need_keyframe = not any(p.keyframe for p in packets)
+        self._ready.set()
+
+    def offer(self, packet: VideoPacket):
+        """Queue a packet without blocking, applying the drop policy."""
+        if packet.config:
+            self._queue.append(packet)
+        elif packet.keyframe:
+            if len(self._queue) >= self.max_queue:
+                # Everything still queued is obsolete once a keyframe arrives
+                self.dropped += len(self._queue)
+                self._queue = deque(p for p in self._queue if p.config)
+            self._need_keyframe = False
+            self._queue.append(packet)
+        elif self._need_keyframe or len(self._queue) >= self.max_queue:
+            # Later delta frames depend on the dropped one; skip until the next keyframe
+            self._need_keyframe = True
+            self.dropped += 1
+            return
+        else:
+            self._queue.append(packet)
+        self._ready.set()
+
+    def client_backlog(self) -> int:
+        """engine.io packets queued for this viewer but not yet sent (0 without engine.io)."""
+        try:
+            eio_sid = self.sio.manager.eio_sid_from_sid(self.sid, "/")
+            return self.sio.eio.sockets[eio_sid].queue.qsize()
+        except (AttributeError, KeyError):
+            return 0
+
+    async def _send_loop(self):
+        try:
+            while True:
+                await self._ready.wait()
+                while self._queue:
+                    while self.client_backlog() > self.max_backlog:
+                        # Keep packets here, where the drop policy applies
+                        await asyncio.sleep(self.backlog_poll)
+                    packet = self._queue.popleft()
+                    await self.sio.emit("screen_data", {
+                        "serial": self.serial,
+                        "pts": packet.pts,
+                        "config": packet.config,
+                        "keyframe": packet.keyframe,
+                        "data": packet.data
+                    }, to=self.sid)
+                    self.sent += 1
+                self._ready.clear()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning(f"Stream subscriber {self.sid} for {self.serial} failed: {e}")
+
+
+class StreamHub:
+    """
+    Fan-out of device video streams to Socket.IO viewers.
+    Each device is read once by its ScrcpyStreamer and published here; the hub keeps the
+    last config packet and the current GOP so new viewers can start decoding right away.
+    """
+    def __init__(self, sio_server, max_queue: int = 60, max_gop_packets: int = 300, max_backlog: int = 8):
+        self.sio = sio_server
+        self.max_queue = max_queue
+        self.max_backlog = max_backlog
+        self.max_gop_packets = max_gop_packets
+        self._subscribers: Dict[str, Dict[str, StreamSubscriber]] = {}
+        self._config: Dict[str, VideoPacket] = {}
+        self._gop: Dict[str, List[VideoPacket]] = {}
+
+    def publish(self, serial: str, packet: VideoPacket):
+        """Called by the device read loop for every packet; never blocks."""
+        if packet.config:
+            self._config[serial] = packet
+        elif packet.keyframe:
+            self._gop[serial] = [packet]
+        else:
+            gop = self._gop.get(serial)
+            if gop is not None:
+                if len(gop) < self.max_gop_packets:
+                    gop.append(packet)
+                else:
+                    # GOP too long to replay; new viewers wait for the next keyframe
+                    self._gop.pop(serial)
+
+        for subscriber in self._subscribers.get(serial, {}).values():
+            subscriber.offer(packet)
+
+    def subscribe(self, sid: str, serial: str) -> StreamSubscriber:
+        subscribers = self._subscribers.setdefault(serial, {})
+        if sid in subscribers:
+            return subscribers[sid]
+
+        subscriber = StreamSubscriber(sid, serial, self.sio, self.max_queue, self.max_backlog)
+        cached = [self._config[serial]] if serial in self._config else []
+        subscriber.prime(cached + self._gop.get(serial, []))
+        subscribers[sid] = subscriber
+        subscriber.start()
+        logger.info(f"Viewer {sid} subscribed to {serial}")
+        return subscriber
+
+    def unsubscribe(self, sid: str, serial: Optional[str] = None):
+        """Remove a viewer from one device stream, or from all of them."""
+        serials = [serial] if serial else list(self._subscribers)
+        for s in serials:
+            subscriber = self._subscribers.get(s, {}).pop(sid, None)
+            if subscriber:
+                subscriber.stop()
+
+    def clear(self, serial: str):
+        """Forget cached packets when a device stream stops."""
+        self._config.pop(serial, None)
+        self._gop.pop(serial, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            serial: {
+                sid: {"queued": len(sub._queue), "backlog": sub.client_backlog(), "sent": sub.sent,
+                      "dropped": sub.dropped}
+                for sid, sub in subscribers.items()
+            } for serial, subscribers in self._subscribers.items()
+        }
@@ -1,14 +1,18 @@
 import os
 import asyncio
-from typing import Dict, List, Any
-from fastapi import FastAPI, HTTPException
+from typing import Dict, List, Any, Optional
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
 from loguru import logger
 import socketio
 
 from tutan_agent.adb.manager import ADBManager
-from tutan_agent.agents.base import TutanAgent
+from tutan_agent.agents.scheduler import TaskScheduler
+from tutan_agent.core.artifact_store import artifact_store
+from tutan_agent.core.device_host import DeviceHost
 from tutan_agent.core.session_store import SessionStore
+from tutan_agent.core.stream_hub import StreamHub
+from tutan_agent.shard.router import ShardRouter
 
 # Initialize FastAPI
 app = FastAPI(title="TUTAN_AGENT API", version="0.1.0")
@@ -32,35 +36,105 @@ socket_app = socketio.ASGIApp(sio, app)
 # Initialize Managers
 adb_manager = ADBManager()
 store = SessionStore()
-active_agents: Dict[str, TutanAgent] = {}
+stream_hub = StreamHub(sio)
+device_tracker: Optional[asyncio.Task] = None
 
-# Default model config (can be overridden via API)
-default_model_config = {
-    "api_key": os.environ.get("OPENAI_API_KEY", "EMPTY"),
-    "base_url": os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1"),
-    "model_name": os.environ.get("OPENAI_MODEL", "gpt-4o")
-}
+# Agents and streams live in this process, or in TUTAN_SHARDS worker processes
+shard_count = int(os.environ.get("TUTAN_SHARDS", "0"))
+devices = ShardRouter(shard_count, stream_hub, sio.emit) if shard_count > 0 else DeviceHost(stream_hub, sio.emit)
+
+async def emit_agent_event(task, event: Dict[str, Any]):
+    await sio.emit("agent_event", {
+        "serial": task.assigned_serial,
+        "task_id": task.id,
+        "type": event["type"],
+        "data": event["data"]
+    })
+
+scheduler = TaskScheduler(devices.get_or_create_agent, adb_manager.scan_devices, store=store, on_event=emit_agent_event)
 
 @app.on_event("startup")
 async def startup_event():
+    global device_tracker
     logger.info("TUTAN_AGENT Backend starting up...")
+    if isinstance(devices, ShardRouter):
+        await devices.start()
+    scheduler.start()
+    asyncio.get_running_loop().run_in_executor(None, artifact_store.enforce_retention)
+    if os.environ.get("ADB_TRACK_DEVICES", "1") == "1":
+        async def emit_device_event(event: Dict[str, Any]):
+            scheduler.notify()
+            await sio.emit("device_event", event)
+        device_tracker = asyncio.create_task(adb_manager.track_devices(emit_device_event))
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("TUTAN_AGENT Backend shutting down...")
-    for agent in active_agents.values():
-        await agent.stop()
+    if device_tracker:
+        device_tracker.cancel()
+    await scheduler.stop()
+    await devices.close()
+    store.close()
+    await adb_manager.close_shell_sessions()
     adb_manager.stop()
 
 # --- API Routes ---
 
 @app.get("/api/sessions")
-async def list_sessions():
-    return {"success": True, "sessions": store.get_all_sessions()}
+async def list_sessions(serial: str = None, status: str = None, since: float = None, until: float = None,
+                        limit: int = 50, cursor: str = None):
+    """One page of sessions, newest first; pass `next_cursor` back as `cursor` for the next page."""
+    limit = max(1, min(limit, 500))
+    try:
+        sessions, next_cursor = await store.list_sessions_async(serial, status, since, until, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"success": True, "sessions": sessions, "next_cursor": next_cursor}
+
+@app.get("/api/sessions/stats")
+async def session_stats(serial: str = None, status: str = None, since: float = None, until: float = None):
+    return {"success": True, "stats": await store.get_session_stats_async(serial, status, since, until)}
 
 @app.get("/api/sessions/{session_id}/steps")
-async def get_steps(session_id: str):
-    return {"success": True, "steps": store.get_session_steps(session_id)}
+async def get_steps(session_id: str, after: int = None, limit: int = None):
+    return {"success": True, "steps": await store.get_session_steps_async(session_id, after, limit)}
+
+@app.post("/api/sessions/{session_id}/replay")
+async def replay_session(session_id: str, serial: str = None, priority: int = 0):
+    """Queue the session's task again, replaying its recorded steps where the screen matches."""
+    session = await store.get_session_async(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    scheduled = scheduler.submit(session["task"], priority=priority,
+                                 device_serial=serial or session["device_serial"], replay_session=session_id)
+    return {"success": True, "task": scheduled.to_dict()}
+
+@app.get("/api/sessions/route-stats")
+async def route_stats(serial: str = None, since: float = None):
+    """Planning latency and success rate per route (rules, small/large model, cache, replay)."""
+    return {"success": True, "stats": await store.get_route_stats_async(serial, since)}
+
+@app.get("/api/sessions/store-stats")
+async def session_store_stats():
+    return {"success": True, "stats": store.get_writer_stats()}
+
+@app.get("/api/artifacts/stats")
+async def artifact_stats():
+    return {"success": True, "stats": artifact_store.get_stats()}
+
+@app.get("/api/artifacts/{kind}/{name}")
+async def get_artifact(kind: str, name: str):
+    """Screenshot or decompressed aria tree referenced by a step's screenshot_path / tree_path."""
+    try:
+        artifact = await artifact_store.read_async(f"{kind}/{name}")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid artifact id")
+    if artifact is None:
+        raise HTTPException(status_code=404, detail="Artifact not found (possibly expired)")
+    data, media_type = artifact
+    # Content-addressed: an id always names the same bytes
+    return Response(content=data, media_type=media_type,
+                    headers={"Cache-Control": "public, max-age=31536000, immutable"})
 
 @app.get("/api/health")
 async def health_check():
@@ -68,7 +142,8 @@ async def health_check():
 
 @app.get("/api/devices")
 async def list_devices():
-    devices = adb_manager.scan_devices()
+    # Served from memory while device tracking is active
+    devices = await asyncio.to_thread(adb_manager.scan_devices)
     return {
         "success": True,
         "devices": [
@@ -82,57 +157,145 @@ async def list_devices():
 
 @app.post("/api/devices/connect")
 async def connect_device(address: str):
-    success, message = adb_manager.connect_wireless(address)
+    success, message = await asyncio.to_thread(adb_manager.connect_wireless, address)
     if not success:
         raise HTTPException(status_code=400, detail=message)
     return {"success": True, "message": message}
 
+@app.get("/api/devices/{serial}/screenshot")
+async def get_screenshot(serial: str, step: int = None, session_id: str = None):
+    """Cached frame for an agent step (of `session_id`, else the latest task), or a fresh capture."""
+    shot = await devices.screenshot(serial, step, session_id)
+    if shot is None:
+        raise HTTPException(status_code=404, detail="Screenshot not available")
+    data, media_type = shot
+    return Response(content=data, media_type=media_type)
+
+@app.post("/api/devices/stream/start")
+async def start_stream(serial: str):
+    try:
+        started = await devices.start_stream(serial)
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if not started:
+        return {"success": True, "message": "Stream already running"}
+    return {"success": True, "message": f"Stream started for {serial}"}
+
+@app.post("/api/devices/stream/stop")
+async def stop_stream(serial: str):
+    if not await devices.stop_stream(serial):
+        raise HTTPException(status_code=404, detail="Stream not found")
+    return {"success": True, "message": f"Stream stopped for {serial}"}
+
+@app.get("/api/devices/stream/stats")
+async def stream_stats():
+    return {
+        "success": True,
+        "stats": stream_hub.get_stats(),
+        "screen": await devices.screen_stats()
+    }
+
 @app.post("/api/agents/start")
-async def start_agent(serial: str, api_key: str = None, base_url: str = None, model: str = None):
-    if serial in active_agents:
+async def start_agent(serial: str, api_key: str = None, base_url: str = None, model: str = None,
+                      incremental: bool = False, app_version: str = None, speculative: bool = None,
+                      small_model: str = None):
+    overrides = {"api_key": api_key, "base_url": base_url, "model_name": model, "app_version": app_version,
+                 "speculative": None if speculative is None else str(int(speculative)),
+                 "small_model_name": small_model}
+    if not await devices.start_agent(serial, overrides, incremental=incremental):
         return {"success": True, "message": "Agent already running"}
-    
-    config = default_model_config.copy()
-    if api_key: config["api_key"] = api_key
-    if base_url: config["base_url"] = base_url
-    if model: config["model_name"] = model
-
-    agent = TutanAgent(serial, config)
-    await agent.initialize()
-    active_agents[serial] = agent
     return {"success": True, "message": f"Agent started for {serial}"}
 
 @app.post("/api/agents/run")
-async def run_task(serial: str, task: str):
-    if serial not in active_agents:
+async def run_task(serial: str, task: str, priority: int = 0):
+    if not await devices.has_agent(serial):
         raise HTTPException(status_code=404, detail="Agent not found for this device")
-    
-    agent = active_agents[serial]
-    
-    # Run task in background and stream events via Socket.IO
-    async def run_and_stream():
-        async for event in agent.stream_task(task):
-            await sio.emit("agent_event", {
-                "serial": serial,
-                "type": event["type"],
-                "data": event["data"]
-            })
-    
-    asyncio.create_task(run_and_stream())
-    return {"success": True, "message": "Task started and streaming"}
+
+    # Queued behind any task already running on this device; events stream via Socket.IO
+    scheduled = scheduler.submit(task, priority=priority, device_serial=serial)
+    message = "Task queued" if scheduler.running_task(serial) else "Task started and streaming"
+    return {"success": True, "message": message, "task_id": scheduled.id}
+
+@app.post("/api/tasks")
+async def submit_task(task: str, serial: str = None, model: str = None, priority: int = 0):
+    """Queue a task for `serial`, any device of `model`, or any idle device."""
+    scheduled = scheduler.submit(task, priority=priority, device_serial=serial, device_model=model)
+    return {"success": True, "task": scheduled.to_dict()}
+
+@app.get("/api/tasks")
+async def list_tasks(status: str = None, limit: int = 100):
+    statuses = status.split(",") if status else None
+    return {"success": True, "tasks": await store.get_tasks_async(statuses, limit)}
+
+@app.get("/api/tasks/stats")
+async def task_stats():
+    return {"success": True, "stats": scheduler.get_stats()}
+
+@app.get("/api/tasks/{task_id}")
+async def get_task(task_id: str):
+    task = await scheduler.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return {"success": True, "task": task}
+
+@app.delete("/api/tasks/{task_id}")
+async def cancel_task(task_id: str):
+    if not scheduler.cancel(task_id):
+        raise HTTPException(status_code=404, detail="No pending or running task with this id")
+    return {"success": True, "message": "Cancellation requested"}
 
 @app.post("/api/agents/abort")
 async def abort_task(serial: str):
-    if serial in active_agents:
-        active_agents[serial].abort()
+    running = scheduler.running_task(serial)
+    if running:
+        scheduler.cancel(running.id)
+        return {"success": True, "message": "Abort requested"}
+    if await devices.abort(serial):
         return {"success": True, "message": "Abort requested"}
     raise HTTPException(status_code=404, detail="Agent not found")
 
+@app.get("/api/agents/settle-stats")
+async def settle_stats(serial: str = None):
+    if serial and not await devices.has_agent(serial):
+        raise HTTPException(status_code=404, detail="Agent not found")
+    return {"success": True, "stats": await devices.settle_stats(serial)}
+
+@app.get("/api/llm/gateway-stats")
+async def gateway_stats():
+    return {"success": True, "stats": await devices.gateway_stats()}
+
+@app.get("/api/plan-cache/stats")
+async def plan_cache_stats():
+    return {"success": True, "stats": await devices.plan_cache_stats()}
+
+@app.post("/api/plan-cache/invalidate")
+async def invalidate_plan_cache(model: str = None, app_version: str = None):
+    """Drop cached plans of `model` and/or `app_version` (all of them if neither is given)."""
+    removed = await devices.invalidate_plan_cache(model, app_version)
+    return {"success": True, "removed": removed}
+
+@app.get("/api/agents/planner-stats")
+async def planner_stats(serial: str = None):
+    """Prompt sizes, streaming latency and speculation hit rate per agent."""
+    if serial and not await devices.has_agent(serial):
+        raise HTTPException(status_code=404, detail="Agent not found")
+    return {"success": True, "stats": await devices.planner_stats(serial)}
+
 @app.post("/api/adb/restart")
 async def restart_adb():
-    adb_manager.restart_server()
+    await asyncio.to_thread(adb_manager.restart_server)
     return {"success": True, "message": "ADB server restarted"}
 
+@app.get("/api/shards")
+async def shard_stats():
+    if not isinstance(devices, ShardRouter):
+        return {"success": True, "shards": 0}
+    return {"success": True, **devices.get_stats()}
+
+@app.get("/api/adb/metrics")
+async def adb_metrics():
+    return {"success": True, "metrics": adb_manager.get_exec_metrics()}
+
 # --- Socket.IO Events ---
 
 @sio.event
@@ -141,8 +304,18 @@ async def connect(sid, environ):
 
 @sio.event
 async def disconnect(sid):
+    stream_hub.unsubscribe(sid)
     logger.info(f"Client disconnected: {sid}")
 
+@sio.event
+async def subscribe_screen(sid, data):
+    """Start receiving 'screen_data' packets for one device."""
+    stream_hub.subscribe(sid, data["serial"])
+
+@sio.event
+async def unsubscribe_screen(sid, data):
+    stream_hub.unsubscribe(sid, data.get("serial"))
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(socket_app, host="0.0.0.0", port=18888)
@@ -0,0 +1,124 @@
+import asyncio
+import itertools
+import json
+import struct
+from typing import Callable, Awaitable, Dict, Any, Optional, Tuple
+from loguru import logger
+
+# Frame: 4-byte JSON header length, 4-byte binary payload length, header, payload.
+# Video packets and screenshots travel as raw payload bytes, never inside the JSON.
+FRAME_HEADER = struct.Struct(">II")
+
+Handler = Callable[[Dict[str, Any], bytes], Awaitable[Any]]
+
+
+class IPCError(Exception):
+    """A remote handler failed; carries the remote error message."""
+
+
+class IPCChannel:
+    """
+    Bidirectional RPC between the API process and a shard worker over a local stream.
+    Either side can `call` a named handler on the other and await its result, or
+    `notify` it without waiting. Handlers returning `(result, bytes)` send the bytes as
+    the binary payload.
+    """
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, name: str = "ipc"):
+        self.reader = reader
+        self.writer = writer
+        self.name = name
+        self.handlers: Dict[str, Handler] = {}
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._write_lock = asyncio.Lock()
+        self._reader_task: Optional[asyncio.Task] = None
+        self.closed = asyncio.Event()
+
+    def on(self, method: str, handler: Handler):
+        self.handlers[method] = handler
+
+    def start(self):
+        self._reader_task = asyncio.create_task(self._read_loop())
+
+    async def _send(self, header: Dict[str, Any], payload: bytes = b""):
+        data = json.dumps(header).encode("utf-8")
+        async with self._write_lock:
+            self.writer.write(FRAME_HEADER.pack(len(data), len(payload)))
+            self.writer.write(data)
+            if payload:
+                self.writer.write(payload)
+            await self.writer.drain()
+
+    async def _recv(self) -> Tuple[Dict[str, Any], bytes]:
+        header_size, payload_size = FRAME_HEADER.unpack(await self.reader.readexactly(FRAME_HEADER.size))
+        header = json.loads(await self.reader.readexactly(header_size))
+        payload = await self.reader.readexactly(payload_size) if payload_size else b""
+        return header, payload
+
+    async def call(self, method: str, params: Optional[Dict[str, Any]] = None, payload: bytes = b"",
+                   timeout: Optional[float] = None) -> Tuple[Any, bytes]:
+        """Invoke `method` on the other side; returns (result, payload)."""
+        if self.closed.is_set():
+            raise ConnectionResetError(f"{self.name} channel closed")
+        call_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[call_id] = future
+        try:
+            await self._send({"kind": "call", "id": call_id, "method": method, "params": params or {}}, payload)
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(call_id, None)
+
+    async def notify(self, method: str, params: Optional[Dict[str, Any]] = None, payload: bytes = b""):
+        """Fire-and-forget message to the other side."""
+        if not self.closed.is_set():
+            await self._send({"kind": "notify", "method": method, "params": params or {}}, payload)
+
+    async def _handle(self, header: Dict[str, Any], payload: bytes):
+        handler = self.handlers.get(header["method"])
+        try:
+            if handler is None:
+                raise IPCError(f"Unknown method {header['method']}")
+            result = await handler(header["params"], payload)
+            out = b""
+            if isinstance(result, tuple):
+                result, out = result
+            if header["kind"] == "call":
+                await self._send({"kind": "result", "id": header["id"], "result": result}, out or b"")
+        except Exception as e:
+            if header["kind"] == "call" and not self.closed.is_set():
+                await self._send({"kind": "error", "id": header["id"], "error": str(e)})
+            else:
+                logger.warning(f"{self.name}: {header['method']} failed: {e}")
+
+    async def _read_loop(self):
+        try:
+            while True:
+                header, payload = await self._recv()
+                kind = header["kind"]
+                if kind in ("call", "notify"):
+                    # Handlers may call back into this channel, so never await them here
+                    asyncio.create_task(self._handle(header, payload))
+                    continue
+                future = self._pending.get(header["id"])
+                if future is None or future.done():
+                    continue
+                if kind == "result":
+                    future.set_result((header["result"], payload))
+                else:
+                    future.set_exception(IPCError(header["error"]))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error(f"{self.name}: read loop failed: {e}")
+        finally:
+            self.closed.set()
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionResetError(f"{self.name} channel closed"))
+
+    async def close(self):
+        if self._reader_task:
+            self._reader_task.cancel()
+        self.writer.close()
+        self.closed.set()
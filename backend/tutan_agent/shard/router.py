@@ -0,0 +1,311 @@
+import asyncio
+import os
+import secrets
+import sys
+import uuid
+from typing import Callable, Awaitable, Dict, Any, List, Optional, Set, Tuple
+from loguru import logger
+
+from tutan_agent.core.scrcpy import VideoPacket
+from tutan_agent.shard.ipc import IPCChannel, IPCError
+
+
+class RemotePlanner:
+    """Stands in for the worker's planner so the scheduler can hand out its LLM limit."""
+    def __init__(self):
+        self.llm_slots: Optional[asyncio.Semaphore] = None
+
+
+class RemoteAgent:
+    """TutanAgent proxy for a device owned by a shard worker."""
+    def __init__(self, router: "ShardRouter", serial: str):
+        self.router = router
+        self.serial = serial
+        self.planner = RemotePlanner()
+
+    async def stream_task(self, task: str, replay_session: Optional[str] = None):
+        """Run `task` on the worker and yield its events as they are relayed back."""
+        run_id = str(uuid.uuid4())
+        queue: asyncio.Queue = asyncio.Queue()
+        shard = self.router.shard_for(self.serial)
+        self.router._runs[run_id] = (shard, queue)
+        try:
+            await self.router.call(self.serial, "run_task", task=task, run_id=run_id, replay_session=replay_session)
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                yield event
+        finally:
+            self.router._runs.pop(run_id, None)
+
+    def abort(self):
+        asyncio.create_task(self.router.abort(self.serial))
+
+
+class ShardRouter:
+    """
+    Sharded deployment: the API process keeps HTTP, Socket.IO, the StreamHub and the
+    scheduler, and routes every device to one of N worker processes that own its agent,
+    controller and scrcpy stream. Devices stick to the least-loaded shard they were first
+    routed to. Calls, events, video packets and LLM-slot requests travel over one local
+    IPCChannel per worker. Exposes the DeviceHost interface.
+    """
+    def __init__(self, shards: int, hub, emit: Callable[[str, Dict[str, Any]], Awaitable[None]],
+                 ready_timeout: float = 30.0):
+        self.shards = shards
+        self.hub = hub
+        self.emit = emit
+        self.ready_timeout = ready_timeout
+        self.token = secrets.token_hex(16)
+        self.port: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._processes: Dict[int, asyncio.subprocess.Process] = {}
+        self._channels: Dict[int, IPCChannel] = {}
+        self._ready: Dict[int, asyncio.Event] = {}
+        self._supervisors: List[asyncio.Task] = []
+        self._assignments: Dict[str, int] = {}
+        self._agents: Dict[str, RemoteAgent] = {}
+        self._runs: Dict[str, Tuple[int, asyncio.Queue]] = {}
+        # shard -> slot id -> semaphore of LLM slots held by that shard's planners
+        self._held_slots: Dict[int, Dict[str, asyncio.Semaphore]] = {}
+        # Acquires still waiting, and those the worker gave up on (cancelled caller)
+        self._acquiring: Set[str] = set()
+        self._abandoned: Set[str] = set()
+        self._stopping = False
+        self.restarts = 0
+
+    # --- Worker processes ---
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._on_connect, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        for shard in range(self.shards):
+            self._ready[shard] = asyncio.Event()
+            await self._spawn(shard)
+            self._supervisors.append(asyncio.create_task(self._supervise(shard)))
+        await asyncio.wait_for(asyncio.gather(*(e.wait() for e in self._ready.values())), self.ready_timeout)
+        logger.info(f"{self.shards} shard workers ready")
+
+    async def _spawn(self, shard: int):
+        self._ready[shard].clear()
+        self._processes[shard] = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "tutan_agent.shard.worker",
+            "--shard", str(shard), "--shards", str(self.shards), "--port", str(self.port),
+            env={**os.environ, "TUTAN_SHARD_TOKEN": self.token}
+        )
+
+    async def _supervise(self, shard: int):
+        """Restart a worker that died; its devices are re-routed on next use."""
+        backoff = 1.0
+        while not self._stopping:
+            code = await self._processes[shard].wait()
+            if self._stopping:
+                return
+            logger.error(f"Shard {shard} exited with {code}, restarting in {backoff:.0f}s")
+            self._drop_shard(shard)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+            self.restarts += 1
+            await self._spawn(shard)
+
+    def _drop_shard(self, shard: int):
+        self._ready[shard].clear()
+        self._channels.pop(shard, None)
+        for serial in [s for s, owner in self._assignments.items() if owner == shard]:
+            del self._assignments[serial]
+            self.hub.clear(serial)
+        for semaphore in self._held_slots.pop(shard, {}).values():
+            semaphore.release()
+        for run_shard, queue in self._runs.values():
+            if run_shard == shard:
+                queue.put_nowait({"type": "error", "data": {"message": f"Shard {shard} worker died"}})
+                queue.put_nowait(None)
+
+    async def _on_connect(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        channel = IPCChannel(reader, writer, "front")
+        state: Dict[str, int] = {}
+
+        async def hello(params, payload):
+            if not secrets.compare_digest(params.get("token", ""), self.token):
+                raise IPCError("Bad shard token")
+            shard = params["shard"]
+            state["shard"] = shard
+            channel.name = f"front<-shard-{shard}"
+            self._channels[shard] = channel
+            self._held_slots.setdefault(shard, {})
+            self._ready[shard].set()
+            return True
+
+        async def emit(params, payload):
+            data = params["data"]
+            if params["event"] == "screen_data":
+                self.hub.publish(data["serial"], VideoPacket(data["pts"], data["config"], data["keyframe"], payload))
+            else:
+                await self.emit(params["event"], data)
+
+        async def task_event(params, payload):
+            run = self._runs.get(params["run_id"])
+            if run:
+                run[1].put_nowait(params["event"])
+
+        async def task_end(params, payload):
+            run = self._runs.get(params["run_id"])
+            if run:
+                run[1].put_nowait(None)
+
+        async def llm_acquire(params, payload):
+            agent = self._agents.get(params["serial"])
+            semaphore = agent.planner.llm_slots if agent else None
+            if semaphore is None:
+                return True
+            slot = params["slot"]
+            self._acquiring.add(slot)
+            try:
+                await semaphore.acquire()
+            finally:
+                self._acquiring.discard(slot)
+            if slot in self._abandoned:
+                # The worker gave up waiting: hand the slot straight back
+                self._abandoned.discard(slot)
+                semaphore.release()
+                return False
+            self._held_slots[state["shard"]][slot] = semaphore
+            return True
+
+        async def llm_release(params, payload):
+            slot = params["slot"]
+            semaphore = self._held_slots.get(state.get("shard"), {}).pop(slot, None)
+            if semaphore is not None:
+                semaphore.release()
+            elif slot in self._acquiring:
+                self._abandoned.add(slot)
+
+        for method, handler in (("hello", hello), ("emit", emit), ("task_event", task_event),
+                                ("task_end", task_end), ("llm_acquire", llm_acquire),
+                                ("llm_release", llm_release)):
+            channel.on(method, handler)
+        channel.start()
+
+    async def close(self):
+        self._stopping = True
+        for supervisor in self._supervisors:
+            supervisor.cancel()
+        for channel in list(self._channels.values()):
+            await channel.notify("shutdown")
+        for process in self._processes.values():
+            try:
+                await asyncio.wait_for(process.wait(), 10)
+            except asyncio.TimeoutError:
+                process.kill()
+        if self._server:
+            self._server.close()
+
+    # --- Routing ---
+
+    def shard_for(self, serial: str) -> int:
+        """Sticky assignment of a device to the shard with the fewest devices."""
+        if serial not in self._assignments:
+            load = {shard: 0 for shard in range(self.shards)}
+            for owner in self._assignments.values():
+                load[owner] += 1
+            self._assignments[serial] = min(load, key=lambda shard: (load[shard], shard))
+        return self._assignments[serial]
+
+    async def call(self, serial: str, method: str, **params) -> Any:
+        """Call `method` for `serial` on the shard that owns the device."""
+        result, _ = await self._call_shard(self.shard_for(serial), method, {"serial": serial, **params})
+        return result
+
+    async def _call_shard(self, shard: int, method: str, params: Dict[str, Any]) -> Tuple[Any, bytes]:
+        await asyncio.wait_for(self._ready[shard].wait(), self.ready_timeout)
+        try:
+            return await self._channels[shard].call(method, params)
+        except IPCError as e:
+            raise RuntimeError(str(e))
+
+    async def _call_all(self, method: str, **params) -> Dict[str, Any]:
+        merged: Dict[str, Any] = {}
+        results = await asyncio.gather(*(self._call_shard(s, method, params) for s in range(self.shards)),
+                                       return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning(f"Shard {method} failed: {result}")
+            else:
+                merged.update(result[0])
+        return merged
+
+    # --- DeviceHost interface ---
+
+    async def start_agent(self, serial: str, overrides: Optional[Dict[str, str]] = None,
+                          incremental: bool = False) -> bool:
+        return await self.call(serial, "start_agent", overrides=overrides, incremental=incremental)
+
+    async def get_or_create_agent(self, serial: str) -> RemoteAgent:
+        await self.start_agent(serial)
+        return self._agents.setdefault(serial, RemoteAgent(self, serial))
+
+    async def has_agent(self, serial: str) -> bool:
+        return serial in self._assignments and await self.call(serial, "has_agent")
+
+    async def abort(self, serial: str) -> bool:
+        return serial in self._assignments and await self.call(serial, "abort")
+
+    async def settle_stats(self, serial: Optional[str] = None) -> Dict[str, Any]:
+        if serial:
+            return await self.call(serial, "settle_stats") if serial in self._assignments else {}
+        return await self._call_all("settle_stats")
+
+    async def planner_stats(self, serial: Optional[str] = None) -> Dict[str, Any]:
+        if serial:
+            return await self.call(serial, "planner_stats") if serial in self._assignments else {}
+        return await self._call_all("planner_stats")
+
+    async def _stats_per_shard(self, method: str) -> Dict[str, Any]:
+        results = await asyncio.gather(*(self._call_shard(s, method, {}) for s in range(self.shards)),
+                                       return_exceptions=True)
+        return {f"shard-{s}": r[0] for s, r in enumerate(results) if not isinstance(r, Exception)}
+
+    async def plan_cache_stats(self) -> Dict[str, Any]:
+        # Each worker has its own memory tier in front of the shared SQLite table
+        return await self._stats_per_shard("plan_cache_stats")
+
+    async def gateway_stats(self) -> Dict[str, Any]:
+        return await self._stats_per_shard("gateway_stats")
+
+    async def invalidate_plan_cache(self, model: Optional[str] = None, app_version: Optional[str] = None) -> int:
+        # The SQLite table is shared: other shards only drop their memory tier (and flush
+        # queued writes), then one shard deletes from the table and reports the count
+        params = {"model": model, "app_version": app_version}
+        await asyncio.gather(*(self._call_shard(s, "invalidate_plan_cache", {**params, "memory_only": True})
+                               for s in range(1, self.shards)), return_exceptions=True)
+        result, _ = await self._call_shard(0, "invalidate_plan_cache", params)
+        return result
+
+    async def start_stream(self, serial: str) -> bool:
+        return await self.call(serial, "start_stream")
+
+    async def stop_stream(self, serial: str) -> bool:
+        if serial not in self._assignments:
+            return False
+        stopped = await self.call(serial, "stop_stream")
+        self.hub.clear(serial)
+        return stopped
+
+    async def screen_stats(self) -> Dict[str, Any]:
+        return await self._call_all("screen_stats")
+
+    async def screenshot(self, serial: str, step: Optional[int] = None,
+                         session_id: Optional[str] = None) -> Optional[Tuple[bytes, str]]:
+        media_type, data = await self._call_shard(self.shard_for(serial), "screenshot",
+                                                  {"serial": serial, "step": step, "session_id": session_id})
+        return (data, media_type) if media_type is not None else None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "shards": self.shards,
+            "restarts": self.restarts,
+            "pids": {shard: process.pid for shard, process in self._processes.items()},
+            "assignments": dict(self._assignments),
+            "llm_slots_held": {shard: len(held) for shard, held in self._held_slots.items()}
+        }
@@ -0,0 +1,169 @@
+import argparse
+import asyncio
+import contextvars
+import os
+import uuid
+from typing import Dict, Any, Optional
+from loguru import logger
+
+from tutan_agent.adb.manager import ADBManager
+from tutan_agent.core.device_host import DeviceHost
+from tutan_agent.core.stream_hub import StreamHub
+from tutan_agent.shard.ipc import IPCChannel
+
+
+class ChannelEmitter:
+    """Socket.IO-like `emit` that forwards events to the API process; video data travels as payload."""
+    def __init__(self, channel: IPCChannel):
+        self.channel = channel
+
+    async def emit(self, event: str, data: Dict[str, Any], to: Optional[str] = None):
+        payload = b""
+        if event == "screen_data":
+            data = dict(data)
+            payload = data.pop("data")
+        await self.channel.notify("emit", {"event": event, "data": data}, payload)
+
+
+class RelayHub(StreamHub):
+    """
+    StreamHub of a worker process with the API process as its only viewer.
+    Packets reach the front hub through a per-device subscriber, so a slow IPC link
+    drops delta frames exactly like a slow browser would.
+    """
+    FRONT = "front"
+
+    def publish(self, serial: str, packet):
+        if serial not in self._subscribers:
+            self.subscribe(self.FRONT, serial)
+        super().publish(serial, packet)
+
+    def clear(self, serial: str):
+        super().clear(serial)
+        self.unsubscribe(self.FRONT, serial)
+        self._subscribers.pop(serial, None)
+
+
+# Id of the slot held by the current task (each planner call runs in its own task context)
+_slot_id: contextvars.ContextVar = contextvars.ContextVar("llm_slot_id")
+
+
+class RemoteLLMSlots:
+    """
+    Async context manager holding one slot of the API process's global LLM limit.
+    Every acquire carries its own id, so a caller cancelled while waiting can tell the
+    API process to give up the slot it may still be about to get.
+    """
+    def __init__(self, channel: IPCChannel, serial: str):
+        self.channel = channel
+        self.serial = serial
+
+    async def __aenter__(self):
+        slot = uuid.uuid4().hex
+        try:
+            await self.channel.call("llm_acquire", {"serial": self.serial, "slot": slot})
+        except asyncio.CancelledError:
+            await asyncio.shield(self.channel.notify("llm_release", {"slot": slot}))
+            raise
+        _slot_id.set(slot)
+
+    async def __aexit__(self, *exc):
+        await asyncio.shield(self.channel.notify("llm_release", {"slot": _slot_id.get()}))
+
+
+class ShardWorker:
+    """One worker process: a DeviceHost for the devices the API process routes here."""
+    def __init__(self, shard: int, shards: int):
+        self.shard = shard
+        port_count = 1000 // shards
+        self.port_base = 27183 + shard * port_count
+        self.port_count = port_count
+        self.channel: Optional[IPCChannel] = None
+        self.host: Optional[DeviceHost] = None
+        self._runs: Dict[str, asyncio.Task] = {}
+
+    async def serve(self, port: int, token: str):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        self.channel = IPCChannel(reader, writer, f"shard-{self.shard}")
+        emitter = ChannelEmitter(self.channel)
+        self.host = DeviceHost(RelayHub(emitter), emitter.emit, port_base=self.port_base, port_count=self.port_count)
+
+        host = self.host
+        handlers = {
+            "start_agent": lambda p: host.start_agent(p["serial"], p.get("overrides"), p.get("incremental", False)),
+            "has_agent": lambda p: host.has_agent(p["serial"]),
+            "abort": lambda p: host.abort(p["serial"]),
+            "settle_stats": lambda p: host.settle_stats(p.get("serial")),
+            "planner_stats": lambda p: host.planner_stats(p.get("serial")),
+            "plan_cache_stats": lambda p: host.plan_cache_stats(),
+            "gateway_stats": lambda p: host.gateway_stats(),
+            "invalidate_plan_cache": lambda p: host.invalidate_plan_cache(p.get("model"), p.get("app_version"),
+                                                                  p.get("memory_only", False)),
+            "start_stream": lambda p: host.start_stream(p["serial"]),
+            "stop_stream": lambda p: host.stop_stream(p["serial"]),
+            "screen_stats": lambda p: host.screen_stats(),
+            "run_task": lambda p: self._run_task(p["serial"], p["task"], p["run_id"], p.get("replay_session")),
+            "screenshot": lambda p: self._screenshot(p["serial"], p.get("step"), p.get("session_id")),
+            "shutdown": lambda p: self._shutdown(),
+        }
+        for method, handler in handlers.items():
+            self.channel.on(method, lambda params, payload, handler=handler: handler(params))
+        self.channel.start()
+
+        await self.channel.call("hello", {"shard": self.shard, "token": token, "pid": os.getpid()})
+        logger.info(f"Shard {self.shard} ready (pid {os.getpid()})")
+        await self.channel.closed.wait()
+        await self._close()
+
+    async def _run_task(self, serial: str, task: str, run_id: str, replay_session: Optional[str] = None) -> bool:
+        agent = await self.host.get_or_create_agent(serial)
+        agent.planner.llm_slots = RemoteLLMSlots(self.channel, serial)
+
+        async def run():
+            try:
+                async for event in agent.stream_task(task, replay_session=replay_session):
+                    await self.channel.notify("task_event", {"run_id": run_id, "event": event})
+            except Exception as e:
+                logger.exception(f"Task {run_id} failed on {serial}: {e}")
+                await self.channel.notify("task_event", {
+                    "run_id": run_id, "event": {"type": "error", "data": {"message": str(e)}}
+                })
+            finally:
+                self._runs.pop(run_id, None)
+                await self.channel.notify("task_end", {"run_id": run_id})
+
+        self._runs[run_id] = asyncio.create_task(run())
+        return True
+
+    async def _screenshot(self, serial: str, step: Optional[int], session_id: Optional[str]):
+        shot = await self.host.screenshot(serial, step, session_id)
+        if shot is None:
+            return None
+        data, media_type = shot
+        return media_type, data
+
+    async def _shutdown(self):
+        # Sent as a notification; closing the channel ends serve()
+        await self.channel.close()
+
+    async def _close(self):
+        for run in list(self._runs.values()):
+            run.cancel()
+        await self.host.close()
+        adb = ADBManager()
+        await adb.close_shell_sessions()
+        adb.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TUTAN_AGENT shard worker")
+    parser.add_argument("--shard", type=int, required=True)
+    parser.add_argument("--shards", type=int, required=True)
+    parser.add_argument("--port", type=int, required=True)
+    args = parser.parse_args()
+    token = os.environ.get("TUTAN_SHARD_TOKEN", "")
+    asyncio.run(ShardWorker(args.shard, args.shards).serve(args.port, token))
+
+
+if __name__ == "__main__":
+    main()
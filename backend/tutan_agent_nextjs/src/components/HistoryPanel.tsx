@@ -20,31 +20,50 @@ interface Step {
   action: string;
   params: string;
   result: string;
+  screenshot_path?: string;
+  tree_path?: string;
   timestamp: number;
 }
 
 export default function HistoryPanel() {
   const [sessions, setSessions] = useState<Session[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [totalSessions, setTotalSessions] = useState(0);
   const [selectedSession, setSelectedSession] = useState<Session | null>(null);
   const [steps, setSteps] = useState<Step[]>([]);
   const [loading, setLoading] = useState(false);
 
   useEffect(() => {
     fetchSessions();
+    fetchStats();
   }, []);
 
-  const fetchSessions = async () => {
+  const fetchSessions = async (cursor?: string) => {
     try {
-      const res = await fetch('http://localhost:18888/api/sessions');
+      const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+      const res = await fetch(`http://localhost:18888/api/sessions${query}`);
       const data = await res.json();
       if (data.success) {
-        setSessions(data.sessions);
+        setSessions(prev => cursor ? [...prev, ...data.sessions] : data.sessions);
+        setNextCursor(data.next_cursor);
       }
     } catch (err) {
       console.error("Failed to fetch sessions", err);
     }
   };
 
+  const fetchStats = async () => {
+    try {
+      const res = await fetch('http://localhost:18888/api/sessions/stats');
+      const data = await res.json();
+      if (data.success) {
+        setTotalSessions(data.stats.total);
+      }
+    } catch (err) {
+      console.error("Failed to fetch session stats", err);
+    }
+  };
+
   const fetchSteps = async (sessionId: string) => {
     setLoading(true);
     try {
@@ -77,7 +96,7 @@ export default function HistoryPanel() {
             <h2 className="text-sm font-bold text-slate-800">执行历史</h2>
           </div>
           <span className="text-[10px] font-bold text-slate-400 uppercase tracking-widest bg-slate-100 px-2 py-1 rounded-md">
-            {sessions.length} Sessions
+            {totalSessions} Sessions
           </span>
         </div>
         
@@ -109,6 +128,14 @@ export default function HistoryPanel() {
               </div>
             </button>
           ))}
+          {nextCursor && (
+            <button
+              onClick={() => fetchSessions(nextCursor)}
+              className="w-full p-3 rounded-2xl border border-dashed border-slate-200 text-xs font-bold text-slate-400 hover:text-slate-600 hover:border-slate-300 transition-all"
+            >
+              加载更多
+            </button>
+          )}
         </div>
       </div>
 
@@ -157,6 +184,15 @@ export default function HistoryPanel() {
                         </p>
                       </div>
 
+                      {step.screenshot_path && (
+                        <img
+                          src={`http://localhost:18888/api/artifacts/${step.screenshot_path}`}
+                          alt={`Step ${step.step_number}`}
+                          loading="lazy"
+                          className="max-h-80 rounded-2xl border border-slate-100 shadow-sm"
+                        />
+                      )}
+
                       <div className="flex items-center gap-3 p-4 bg-indigo-50/50 rounded-2xl border border-indigo-100/50">
                         <div className="p-1.5 bg-indigo-100 text-indigo-600 rounded-lg">
                           <ChevronRight size={14} />
@@ -29,9 +29,10 @@ export default function ScrcpyPlayer({ serial }: ScrcpyPlayerProps) {
 
     socket.on('connect', () => {
       setStatus('Connected');
+      socket.emit('subscribe_screen', { serial });
     });
 
-    socket.on('screen_data', (data: { serial: string, data: string }) => {
+    socket.on('screen_data', (data: { serial: string, pts: number | null, config: boolean, keyframe: boolean, data: ArrayBuffer }) => {
       if (data.serial === serial) {
         setStatus('Streaming');
         // Decoder logic would go here